@@ -29,22 +29,97 @@ options:
     description:
       The name of the cluster in ambari
     required: yes
+  mode:
+    description:
+      C(sync) (default) checks and updates the given configurations. C(drift) compares the cluster desired configs
+      against the tag of every config type recorded by the previous drift run under C(state_dir), and only fetches and
+      diffs the types whose tag changed. The first drift run records the baseline
+    required: no
   config_type:
     description:
-      The configuration type for Ambari cluster configurations
-    required: yes
+      The configuration type for Ambari cluster configurations, required unless C(configs) is used
+    required: no
   tag:
     description:
       The tag version for a configuration type in Ambari
     required: no
   ignore_secret:
     description:
-      Whether to ignore the secrets as the configurations of Ambari secrets is not shown via api calls, Default is True
+      Whether to ignore the secrets as the configurations of Ambari secrets is not shown via api calls, Default is True.
+      After secrets are sent to Ambari, a salted fingerprint of them is kept under C(state_dir) together with the new
+      config tag, so later runs with the same secrets and an unchanged tag do not write a new config version
     required: no
   config_map:
     description:
-      The map object for all configurations need to be checked and updated
-    required: yes
+      The map object for all configurations need to be checked and updated, required together with C(config_type).
+      Every key takes a C(value), and optionally a C(regex) to only replace the matching part of the current value,
+      or a list of C(regex_rules) (each with C(regex) and C(value)) applied in a single pass. With C(line_mode) a rule
+      rewrites the whole line it matches
+    required: no
+  configs:
+    description:
+      Batch mode, a map of config type to its config_map. The desired configs index is fetched once and all the
+      changed types are sent to Ambari in a single PUT. Mutually exclusive with C(config_type), C(config_map) and C(config_tag)
+    required: no
+  parallelism:
+    description:
+      Batch mode only, the maximum number of config types fetched from Ambari at the same time, default value is 4
+    required: no
+  state_dir:
+    description:
+      Local directory the module keeps its state in, e.g. the config snapshot cache. Default is ~/.ansible/ambari
+    required: no
+  config_cache:
+    description:
+      Whether to cache configuration bodies on disk keyed by cluster/type/tag. Config versions are immutable in Ambari,
+      so with a warm cache only the desired configs index is requested. Default is False
+    required: no
+  config_cache_max_mb:
+    description:
+      Size bound of the config snapshot cache, least recently used entries are evicted first. Default is 256
+    required: no
+  large_value_threshold:
+    description:
+      Values longer than this many characters (e.g. C(content) templates) are compared with streamed digests instead
+      of lowercased copies, and only their sha256 digest and size are reported in the updates. Default is 65536
+    required: no
+  result_format:
+    description:
+      How much of the configuration is returned on change. C(full) (default) returns the whole property set of the
+      type and the updates, C(diff) only returns the changed keys with values longer than 1024 characters replaced by
+      their digest and size, C(summary) only returns the names and counts of the changed keys. Only C(full) returns
+      the Ambari response under C(results), the others return the new C(config_tag) instead
+    required: no
+    choices: ['full', 'diff', 'summary']
+  ambari_metrics:
+    description:
+      Return an C(ambari_metrics) block with the number of Ambari API calls, bytes sent and received, latency totals
+      and percentiles overall and per endpoint, and the time spent sleeping between request polls. Default is False
+  ambari_trace_file:
+    description:
+      Append one JSON line per Ambari API call (method, path, status, latency, bytes, retries) to this local file,
+      e.g. to analyze a whole playbook run offline
+  profile_dir:
+    description:
+      Run the module under cProfile and save the profile plus a summary of the top C(profile_top) functions in this
+      directory, their paths are returned under C(profile). Can also be set with the AMBARI_MODULE_PROFILE_DIR
+      environment variable. Default is not to profile
+  profile_top:
+    description:
+      Number of functions listed in the profile summary, default is 30
+  ambari_max_rps:
+    description:
+      Maximum number of Ambari API calls per second, shared by every module running on this host against the same
+      Ambari server, e.g. all the forks of a play. Can also be set with the AMBARI_MAX_RPS environment variable.
+      Default is no limit
+  ambari_max_in_flight:
+    description:
+      Maximum number of Ambari API calls in flight at once, shared the same way as C(ambari_max_rps). Can also be set
+      with the AMBARI_MAX_IN_FLIGHT environment variable. Default is no limit
+  ambari_throttle_dir:
+    description:
+      Directory of the lock files holding the shared limits, the modules must use the same one to share them. Can also
+      be set with the AMBARI_THROTTLE_DIR environment variable. Default is ambari-throttle in the system temp directory
 '''
 
 EXAMPLES = '''
@@ -72,9 +147,42 @@ EXAMPLES = '''
             regex: ^your_regex to fully replace
           key_x3:
             value: "{{lookup('template', './files/mytemplate.j2')}}"
+          content:
+            line_mode: true
+            regex_rules:
+              - regex: ^log4j.rootLogger=
+                value: log4j.rootLogger=INFO,DRFA
+              - regex: ^log4j.appender.DRFA.MaxBackupIndex=
+                value: log4j.appender.DRFA.MaxBackupIndex=10
+
+  - name: Report config types changed outside of Ansible since the last run
+    ambari_cluster_config:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: my_cluster
+        mode: drift
+        config_cache: true
+
+  - name: Update several config types in one request
+    ambari_cluster_config:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: my_cluster
+        configs:
+          kafka-broker:
+            log.retention.hours:
+              value: 150
+          hdfs-site:
+            dfs.replication:
+              value: 2
 '''
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.six import string_types
 import json
 import os
 try:
@@ -105,8 +213,45 @@ except ImportError:
 else:
     REGEX_FOUND = True
 
+try:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+except ImportError:
+    FUTURES_FOUND = False
+else:
+    FUTURES_FOUND = True
+
+import binascii
+import hashlib
 import traceback
 
+LARGE_VALUE_THRESHOLD = 64 * 1024
+DIFF_VALUE_LIMIT = 1024
+DIGEST_CHUNK_SIZE = 64 * 1024
+
+try:
+    from ansible.module_utils.ambari_client import AmbariError, get, get_client, plan_request, put
+    from ansible.module_utils.ambari_config_cache import ConfigCache, read_json, write_json_atomic
+    from ansible.module_utils.ambari_regex import apply_regex_rules
+except ImportError:
+    from module_utils.ambari_client import AmbariError, get, get_client, plan_request, put
+    from module_utils.ambari_config_cache import ConfigCache, read_json, write_json_atomic
+    from module_utils.ambari_regex import apply_regex_rules
+
+try:
+    from ansible.module_utils.ambari_metrics import instrument_module, metrics_argument_spec
+except ImportError:
+    from module_utils.ambari_metrics import instrument_module, metrics_argument_spec
+
+try:
+    from ansible.module_utils.ambari_profile import profile_argument_spec, start_profiling
+except ImportError:
+    from module_utils.ambari_profile import profile_argument_spec, start_profiling
+
+try:
+    from ansible.module_utils.ambari_throttle import throttle_argument_spec, throttle_module
+except ImportError:
+    from module_utils.ambari_throttle import throttle_argument_spec, throttle_module
+
 
 def main():
 
@@ -117,16 +262,34 @@ def main():
         username=dict(type='str', default=None, required=True),
         password=dict(type='str', default=None, required=True, no_log=True),
         cluster_name=dict(type='str', default=None, required=True),
-        config_type=dict(type='str', default=None, required=True),
+        mode=dict(type='str', default='sync', required=False,
+                  choices=['sync', 'drift']),
+        config_type=dict(type='str', default=None, required=False),
         config_tag=dict(type='str', default=None, required=False),
         ignore_secret=dict(default=True, required=False,
                            choices=[True, False]),
         timeout_sec=dict(type='int', default=10, required=False),
-        config_map=dict(type='dict', default=None, required=True)
+        config_map=dict(type='dict', default=None, required=False),
+        configs=dict(type='dict', default=None, required=False),
+        parallelism=dict(type='int', default=4, required=False),
+        state_dir=dict(type='path', default='~/.ansible/ambari', required=False),
+        config_cache=dict(type='bool', default=False, required=False),
+        config_cache_max_mb=dict(type='int', default=256, required=False),
+        large_value_threshold=dict(type='int', default=LARGE_VALUE_THRESHOLD, required=False),
+        result_format=dict(type='str', default='full', required=False,
+                           choices=['full', 'diff', 'summary'])
     )
 
+    argument_spec.update(metrics_argument_spec())
+    argument_spec.update(profile_argument_spec())
+    argument_spec.update(throttle_argument_spec())
+
     module = AnsibleModule(
-        argument_spec=argument_spec
+        argument_spec=argument_spec,
+        mutually_exclusive=[['configs', 'config_type'], ['configs', 'config_map'], ['configs', 'config_tag']],
+        required_if=[['mode', 'sync', ['configs', 'config_type'], True]],
+        required_together=[['config_type', 'config_map']],
+        supports_check_mode=True
     )
 
     if not REQUESTS_FOUND:
@@ -145,7 +308,14 @@ def main():
         module.fail_json(
             msg='regex(re) library is required for this module')
 
+    if not FUTURES_FOUND:
+        module.fail_json(
+            msg='futures(concurrent.futures) library is required for this module')
+
     p = module.params
+    instrument_module(module, p.get('ambari_metrics'), p.get('ambari_trace_file'))
+    start_profiling(module, p.get('profile_dir'), p.get('profile_top'))
+    throttle_module(module, p.get('ambari_max_rps'), p.get('ambari_max_in_flight'), p.get('ambari_throttle_dir'))
 
     protocol = p.get('protocol')
     host = p.get('host')
@@ -153,17 +323,36 @@ def main():
     username = p.get('username')
     password = p.get('password')
     cluster_name = p.get('cluster_name')
+    mode = p.get('mode')
     config_type = p.get('config_type')
     config_tag = p.get('config_tag')
     config_map = p.get('config_map')
     ignore_secret = p.get('ignore_secret')
     connection_timeout = p.get('timeout_sec')
-
-    process_ambari_config(module, protocol, host, port, username, password,
-                          cluster_name, config_type, config_tag, config_map, ignore_secret, connection_timeout)
+    configs = p.get('configs')
+    parallelism = p.get('parallelism')
+    state_dir = p.get('state_dir')
+    large_value_threshold = p.get('large_value_threshold')
+    result_format = p.get('result_format')
+    config_cache = None
+    if p.get('config_cache'):
+        config_cache = ConfigCache(os.path.join(state_dir, 'config_cache'),
+                                   p.get('config_cache_max_mb') * 1024 * 1024, module.check_mode)
+
+    if mode == 'drift':
+        process_ambari_drift(module, protocol, host, port, username, password,
+                             cluster_name, connection_timeout, parallelism, config_cache, state_dir)
+    elif configs is not None:
+        process_ambari_configs(module, protocol, host, port, username, password,
+                               cluster_name, configs, ignore_secret, connection_timeout, parallelism, config_cache, state_dir,
+                               large_value_threshold, result_format)
+    else:
+        process_ambari_config(module, protocol, host, port, username, password,
+                              cluster_name, config_type, config_tag, config_map, ignore_secret, connection_timeout, config_cache, state_dir,
+                              large_value_threshold, result_format)
 
 
-def process_ambari_config(module, protocol, host, port, username, password, cluster_name, config_type, config_tag, config_map, ignore_secret, connection_timeout):
+def process_ambari_config(module, protocol, host, port, username, password, cluster_name, config_type, config_tag, config_map, ignore_secret, connection_timeout, config_cache=None, state_dir=None, large_value_threshold=LARGE_VALUE_THRESHOLD, result_format='full'):
     ambari_url = '{0}://{1}:{2}'.format(protocol, host, port)
 
     try:
@@ -173,36 +362,214 @@ def process_ambari_config(module, protocol, host, port, username, password, clus
                 ambari_url, username, password, cluster_name, connection_timeout)
             config_tag = config_index[config_type]["tag"]
         # Get config using the effective tag
-        overall_cluster_config = get_cluster_config(
-            ambari_url, username, password, cluster_name, config_type, config_tag, connection_timeout)
+        overall_cluster_config = load_cluster_config(
+            ambari_url, username, password, cluster_name, config_type, config_tag, connection_timeout, config_cache)
         cluster_config = overall_cluster_config['properties']
         
-        changed, has_secrets, result_map, updated_map = sync_config_map_with_cluster(cluster_config, config_map, ignore_secret)
-
-        if changed:
+        changed, has_secrets, result_map, updated_map = sync_config_map_with_cluster(cluster_config, config_map, ignore_secret, large_value_threshold)
+
+        # Secrets are not readable through the API, only re-send them if they differ from the last sync
+        secrets_synced = has_secrets and secret_fingerprint_matches(
+            state_dir, cluster_name, config_type, config_tag, cluster_config, config_map)
+
+        if module.check_mode and (changed or (has_secrets and not secrets_synced)):
+            # Plan only, report the exact body that would be sent to Ambari
+            desired_config = build_desired_config(
+                config_type, result_map, extract_properties_attributes(overall_cluster_config))
+            module.exit_json(changed=changed, plan=[plan_desired_configs(cluster_name, [desired_config])],
+                             msg=format_result(result_map, updated_map, result_format))
+        elif changed:
+            new_tag = new_config_tag()
             request = update_cluster_config(
-                ambari_url, username, password, cluster_name, config_type, result_map, extract_properties_attributes(overall_cluster_config), connection_timeout)
+                ambari_url, username, password, cluster_name, config_type, result_map, extract_properties_attributes(overall_cluster_config), connection_timeout, new_tag)
+            if has_secrets:
+                record_secret_fingerprint(module, state_dir, cluster_name, config_type, new_tag, cluster_config, config_map)
             module.exit_json(
-                changed=True, results=request.content, msg={'result': result_map, 'updates': updated_map})
+                changed=True, msg=format_result(result_map, updated_map, result_format),
+                **put_result(request, new_tag, result_format))
         else:
-            if has_secrets:
+            if has_secrets and not secrets_synced:
+                new_tag = new_config_tag()
                 request = update_cluster_config(ambari_url, username, password, cluster_name,
-                                                config_type, result_map, extract_properties_attributes(overall_cluster_config), connection_timeout)
+                                                config_type, result_map, extract_properties_attributes(overall_cluster_config), connection_timeout, new_tag)
+                record_secret_fingerprint(module, state_dir, cluster_name, config_type, new_tag, cluster_config, config_map)
                 module.exit_json(
-                    changed=False, results=request.content, msg={'result': result_map, 'updates': updated_map})
+                    changed=False, msg=format_result(result_map, updated_map, result_format),
+                    **put_result(request, new_tag, result_format))
             else:
                 module.exit_json(changed=False, msg='No changes in config')
     except requests.ConnectionError as e:
         module.fail_json(
-            msg="Could not connect to Ambari client: " + str(e.message), stacktrace=traceback.format_exc())
+            msg="Could not connect to Ambari client: " + str(e), stacktrace=traceback.format_exc())
+    except AmbariError as e:
+        module.fail_json(msg=e.message, status_code=e.status_code, stacktrace=traceback.format_exc())
+    except AssertionError as e:
+        module.fail_json(msg=e.message, stacktrace=traceback.format_exc())
+    except Exception as e:
+        module.fail_json(
+            msg="Ambari client exception occurred: " + str(e), stacktrace=traceback.format_exc())
+
+
+def process_ambari_configs(module, protocol, host, port, username, password, cluster_name, configs, ignore_secret, connection_timeout, parallelism=1, config_cache=None, state_dir=None, large_value_threshold=LARGE_VALUE_THRESHOLD, result_format='full'):
+    ambari_url = '{0}://{1}:{2}'.format(protocol, host, port)
+
+    try:
+        # Make sure the shared connection pool is large enough for the fetch workers
+        get_client(ambari_url, username, password, connection_timeout, max(parallelism, 1))
+        # One index lookup for every config type in the batch
+        config_index = get_cluster_config_index(
+            ambari_url, username, password, cluster_name, connection_timeout)
+        missing_types = [config_type for config_type in configs if config_type not in config_index]
+        try:
+            assert len(missing_types) == 0
+        except AssertionError as e:
+            e.message = 'Config types not found in cluster desired configs: {0}'.format(
+                ', '.join(sorted(missing_types)))
+            raise
+
+        type_tags = [(config_type, config_index[config_type]['tag']) for config_type in sorted(configs)]
+        synced = {}
+        errors = {}
+        # Diff every config type as soon as its fetch completes
+        for config_type, overall_cluster_config, error in fetch_cluster_configs(
+                ambari_url, username, password, cluster_name, type_tags, connection_timeout, parallelism, config_cache):
+            if error is not None:
+                errors[config_type] = getattr(error, 'message', None) or str(error)
+                continue
+            synced[config_type] = (overall_cluster_config, sync_config_map_with_cluster(
+                overall_cluster_config['properties'], configs[config_type], ignore_secret, large_value_threshold))
+        try:
+            assert len(errors) == 0
+        except AssertionError as e:
+            e.message = 'Could not get cluster configuration for config types: {0}'.format(
+                json.dumps(errors, sort_keys=True))
+            raise
+
+        desired_configs = []
+        secret_types = []
+        changed_types = {}
+        new_tag = new_config_tag()
+        for config_type, config_tag in type_tags:
+            overall_cluster_config, (changed, has_secrets, result_map, updated_map) = synced[config_type]
+            if has_secrets and not changed and secret_fingerprint_matches(
+                    state_dir, cluster_name, config_type, config_tag, overall_cluster_config['properties'], configs[config_type]):
+                continue
+            if changed or has_secrets:
+                desired_configs.append(build_desired_config(
+                    config_type, result_map, extract_properties_attributes(overall_cluster_config), new_tag))
+            if has_secrets:
+                secret_types.append(config_type)
+            if changed:
+                changed_types[config_type] = format_result(result_map, updated_map, result_format)
+
+        if len(desired_configs) > 0 and module.check_mode:
+            module.exit_json(changed=len(changed_types) > 0, plan=[plan_desired_configs(cluster_name, desired_configs)],
+                             msg=changed_types)
+        elif len(desired_configs) > 0:
+            # All changed types go to Ambari in a single PUT / service config version
+            request = put_desired_configs(
+                ambari_url, username, password, cluster_name, desired_configs, connection_timeout)
+            for config_type in secret_types:
+                record_secret_fingerprint(module, state_dir, cluster_name, config_type, new_tag,
+                                          synced[config_type][0]['properties'], configs[config_type])
+            module.exit_json(
+                changed=len(changed_types) > 0, msg=changed_types, **put_result(request, new_tag, result_format))
+        else:
+            module.exit_json(changed=False, msg='No changes in config')
+    except requests.ConnectionError as e:
+        module.fail_json(
+            msg="Could not connect to Ambari client: " + str(e), stacktrace=traceback.format_exc())
+    except AmbariError as e:
+        module.fail_json(msg=e.message, status_code=e.status_code, stacktrace=traceback.format_exc())
     except AssertionError as e:
         module.fail_json(msg=e.message, stacktrace=traceback.format_exc())
     except Exception as e:
         module.fail_json(
-            msg="Ambari client exception occurred: " + str(e.message), stacktrace=traceback.format_exc())
+            msg="Ambari client exception occurred: " + str(e), stacktrace=traceback.format_exc())
 
 
-def sync_config_map_with_cluster(cluster_config, config_map, ignore_secret):
+def process_ambari_drift(module, protocol, host, port, username, password, cluster_name, connection_timeout, parallelism, config_cache, state_dir):
+    ambari_url = '{0}://{1}:{2}'.format(protocol, host, port)
+    state_path = os.path.join(state_dir, 'drift', '{0}.json'.format(cluster_name))
+
+    try:
+        config_index = get_cluster_config_index(
+            ambari_url, username, password, cluster_name, connection_timeout)
+        current_tags = dict((config_type, config_index[config_type]['tag']) for config_type in config_index)
+        known_tags = read_json(state_path)
+
+        if known_tags is None:
+            if not module.check_mode:
+                write_json_atomic(state_path, current_tags)
+            module.exit_json(changed=False, drift={},
+                             msg='Drift baseline recorded for {0} config types'.format(len(current_tags)))
+            return
+
+        drift = {}
+        type_tags = []
+        for config_type in sorted(set(current_tags) | set(known_tags)):
+            old_tag = known_tags.get(config_type)
+            new_tag = current_tags.get(config_type)
+            if old_tag == new_tag:
+                continue
+            drift[config_type] = {'old_tag': old_tag, 'new_tag': new_tag}
+            # Only the types whose tag moved are fetched, old and new version side by side
+            if old_tag is not None:
+                type_tags.append((config_type, old_tag))
+            if new_tag is not None:
+                type_tags.append((config_type, new_tag))
+
+        get_client(ambari_url, username, password, connection_timeout, max(parallelism, 1))
+        properties = {}
+        errors = {}
+        for config_type, config, error in fetch_cluster_configs(
+                ambari_url, username, password, cluster_name, type_tags, connection_timeout, parallelism, config_cache):
+            if error is not None:
+                errors[config_type] = getattr(error, 'message', None) or str(error)
+                continue
+            properties[(config_type, config['tag'])] = config['properties']
+        try:
+            assert len(errors) == 0
+        except AssertionError as e:
+            e.message = 'Could not get cluster configuration for config types: {0}'.format(
+                json.dumps(errors, sort_keys=True))
+            raise
+
+        for config_type in drift:
+            old_properties = properties.get((config_type, drift[config_type]['old_tag']), {})
+            new_properties = properties.get((config_type, drift[config_type]['new_tag']), {})
+            drift[config_type].update(diff_properties(old_properties, new_properties))
+
+        if not module.check_mode:
+            write_json_atomic(state_path, current_tags)
+        if len(drift) > 0:
+            module.exit_json(changed=True, drift=drift,
+                             msg='Configuration drift detected in {0} config types'.format(len(drift)))
+        else:
+            module.exit_json(changed=False, drift=drift, msg='No configuration drift')
+    except requests.ConnectionError as e:
+        module.fail_json(
+            msg="Could not connect to Ambari client: " + str(e), stacktrace=traceback.format_exc())
+    except AmbariError as e:
+        module.fail_json(msg=e.message, status_code=e.status_code, stacktrace=traceback.format_exc())
+    except AssertionError as e:
+        module.fail_json(msg=e.message, stacktrace=traceback.format_exc())
+    except Exception as e:
+        module.fail_json(
+            msg="Ambari client exception occurred: " + str(e), stacktrace=traceback.format_exc())
+
+
+def diff_properties(old_properties, new_properties):
+    old_keys = set(old_properties)
+    new_keys = set(new_properties)
+    return {
+        'added': sorted(new_keys - old_keys),
+        'removed': sorted(old_keys - new_keys),
+        'changed': sorted(key for key in old_keys & new_keys if old_properties[key] != new_properties[key])
+    }
+
+
+def sync_config_map_with_cluster(cluster_config, config_map, ignore_secret, large_value_threshold=LARGE_VALUE_THRESHOLD):
     changed = False
     has_secrets = False
     result_map = {}
@@ -212,14 +579,18 @@ def sync_config_map_with_cluster(cluster_config, config_map, ignore_secret):
         current_value = cluster_config[key]
         if key in config_map:
             desired_value = config_map[key].get('value')
-            if desired_value is not None and (current_value == desired_value or str(current_value).lower() == str(desired_value).lower()):
+            large_value = is_large_value(current_value, large_value_threshold) or is_large_value(desired_value, large_value_threshold)
+            if desired_value is not None and large_value and large_values_match(current_value, desired_value):
+                result_map[key] = current_value
+            elif desired_value is not None and not large_value and (current_value == desired_value or str(current_value).lower() == str(desired_value).lower()):
                 # if value matched, put it directly into the map
                 result_map[key] = current_value
             else:
                 # Mismatched!
                 # Get the require-to-update value base on regex/non-regex
-                (actual_value, updated) = get_config_desired_value(
-                    cluster_config, key, desired_value, config_map[key].get('regex'))
+                (actual_value, updated, matched_rules) = get_config_desired_value(
+                    cluster_config, key, desired_value, config_map[key].get('regex'),
+                    config_map[key].get('regex_rules'), config_map[key].get('line_mode', False))
                 # base on the regex sub, if not changed then change the change state to False
                 if ignore_secret and current_value.startswith('SECRET'):
                     updated = False
@@ -230,9 +601,15 @@ def sync_config_map_with_cluster(cluster_config, config_map, ignore_secret):
                     if 'password' in key or 'pw' in key or 'token' in key:
                         updated_map[key] = {'origin': hash_passwords(
                             cluster_config[key]), 'changed_to': hash_passwords(actual_value)}
+                    elif large_value:
+                        # Only report digests and sizes rather than echoing both full templates back
+                        updated_map[key] = {
+                            'origin': describe_large_value(cluster_config[key]), 'changed_to': describe_large_value(actual_value)}
                     else:
                         updated_map[key] = {
                             'origin': cluster_config[key], 'changed_to': actual_value}
+                    if matched_rules is not None:
+                        updated_map[key]['matched_rules'] = matched_rules
         else:
             result_map[key] = current_value
 
@@ -241,42 +618,161 @@ def sync_config_map_with_cluster(cluster_config, config_map, ignore_secret):
         if key not in cluster_config:
             changed = True
             result_map[key] = config_map.get(key).get('value')
+            changed_to = config_map.get(key).get('value')
+            if is_large_value(changed_to, large_value_threshold):
+                changed_to = describe_large_value(changed_to)
             updated_map[key] = {
-                'origin': 'no such key', 'changed_to': config_map.get(key).get('value')
+                'origin': 'no such key', 'changed_to': changed_to
             }
 
     return changed, has_secrets, result_map, updated_map
 
 
+def format_result(result_map, updated_map, result_format):
+    if result_format == 'summary':
+        return {'changed_keys': sorted(updated_map), 'changed_count': len(updated_map), 'total_count': len(result_map)}
+    elif result_format == 'diff':
+        # Only the changed keys, with long values replaced by their digest and size
+        updates = {}
+        for key in updated_map:
+            updates[key] = dict(updated_map[key])
+            for field in ['origin', 'changed_to']:
+                if is_large_value(updates[key].get(field), DIFF_VALUE_LIMIT):
+                    updates[key][field] = describe_large_value(updates[key][field])
+        return {'updates': updates}
+    else:
+        return {'result': result_map, 'updates': updated_map}
+
+
+def put_result(request, config_tag, result_format):
+    # Ambari echoes the whole new config version, only pass it back through Ansible with the full format
+    if result_format == 'full':
+        return {'results': request.content}
+    return {'config_tag': config_tag}
+
+
+def is_large_value(value, large_value_threshold):
+    return isinstance(value, string_types) and len(value) > large_value_threshold
+
+
+def value_digest(value, ignore_case=False):
+    # Digest the value chunk by chunk, so that at most one chunk is copied at a time
+    digest = hashlib.sha256()
+    if not isinstance(value, string_types):
+        value = str(value)
+    for start in range(0, len(value), DIGEST_CHUNK_SIZE):
+        chunk = value[start:start + DIGEST_CHUNK_SIZE]
+        if ignore_case:
+            chunk = chunk.lower()
+        digest.update(chunk.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def large_values_match(current_value, desired_value):
+    if current_value == desired_value:
+        return True
+    return value_digest(current_value, True) == value_digest(desired_value, True)
+
+
+def describe_large_value(value):
+    return {'sha256': value_digest(value), 'size': len(value)}
+
+
+def secret_state_path(state_dir, cluster_name, config_type):
+    return os.path.join(state_dir, 'secrets', cluster_name, '{0}.json'.format(config_type))
+
+
+def secret_fingerprint(cluster_config, config_map, salt):
+    # Salted, slow hash of the supplied values of every key Ambari only shows as a SECRET placeholder
+    secrets = sorted((key, str(config_map[key].get('value'))) for key in config_map
+                     if key in cluster_config and str(cluster_config[key]).startswith('SECRET'))
+    digest = hashlib.pbkdf2_hmac('sha256', json.dumps(secrets).encode('utf-8'), salt.encode('utf-8'), 100000)
+    return binascii.hexlify(digest).decode('ascii')
+
+
+def secret_fingerprint_matches(state_dir, cluster_name, config_type, config_tag, cluster_config, config_map):
+    if state_dir is None:
+        return False
+    state = read_json(secret_state_path(state_dir, cluster_name, config_type))
+    # A different tag means the config has been written since, by us or anyone else
+    if state is None or state.get('tag') != config_tag:
+        return False
+    return state.get('fingerprint') == secret_fingerprint(cluster_config, config_map, state.get('salt'))
+
+
+def record_secret_fingerprint(module, state_dir, cluster_name, config_type, config_tag, cluster_config, config_map):
+    if state_dir is None:
+        return
+    salt = binascii.hexlify(os.urandom(16)).decode('ascii')
+    try:
+        write_json_atomic(secret_state_path(state_dir, cluster_name, config_type), {
+            'tag': config_tag,
+            'salt': salt,
+            'fingerprint': secret_fingerprint(cluster_config, config_map, salt)
+        })
+    except (IOError, OSError) as e:
+        # The config is already in Ambari, without a fingerprint the secrets are simply sent again next time
+        module.warn('Could not record the secret fingerprint of {0} under {1}, its secrets will be sent again '
+                    'on the next run: {2}'.format(config_type, state_dir, e))
+
+
 def hash_passwords(pw):
     return '*' * len(pw)
 
 
-def get_config_desired_value(current_map, key, desired_value, regex):
-    if regex is None or regex == '':
+def get_config_desired_value(current_map, key, desired_value, regex, regex_rules=None, line_mode=False):
+    rules = []
+    if regex is not None and regex != '':
+        rules.append((regex, desired_value))
+    for rule in regex_rules or []:
+        rules.append((rule.get('regex'), rule.get('value')))
+    if len(rules) == 0:
         # if not contains regex, straight return the desired_value
-        return desired_value, True
+        return desired_value, True, None
     else:
-        # if contains regex, us re.sub to replace the regex pattern with desired_value
-        result = re.sub(regex, desired_value, current_map[key])
-        return result, result == current_map[key]
+        # if contains regex, run all the rules in one pass and only report a change if one of them matched
+        result, matched_rules = apply_regex_rules(current_map[key], rules, line_mode)
+        return result, len(matched_rules) > 0 and result != current_map[key], matched_rules
+
+
+def update_cluster_config(ambari_url, user, password, cluster_name, config_type, updated_map, properties_attributes, connection_timeout, config_tag=None):
+    desired_config = build_desired_config(config_type, updated_map, properties_attributes, config_tag)
+    return put_desired_configs(ambari_url, user, password, cluster_name, [desired_config], connection_timeout)
 
 
-def update_cluster_config(ambari_url, user, password, cluster_name, config_type, updated_map, properties_attributes, connection_timeout):
+def new_config_tag():
     ts = time.time()
     tag_ts = ts * 1000
+    return 'version{0}'.format('%d' % tag_ts)
+
+
+def build_desired_config(config_type, updated_map, properties_attributes, config_tag=None):
+    if config_tag is None:
+        config_tag = new_config_tag()
     payload = {
         'type': config_type,
-        'tag': 'version{0}'.format('%d' % tag_ts),
+        'tag': config_tag,
         'properties': updated_map,
         'service_config_version_note': 'Ansible module syncing',
     }
     if properties_attributes is not None:
         payload['properties_attributes'] = properties_attributes
-    put_body = {'Clusters': {'desired_config': []}}
-    put_body['Clusters']['desired_config'].append(payload)
+    return payload
+
+
+def desired_configs_body(desired_configs):
+    put_body = {'Clusters': {'desired_config': desired_configs}}
     put_list = []
     put_list.append(put_body)
+    return put_list
+
+
+def plan_desired_configs(cluster_name, desired_configs):
+    return plan_request('PUT', '/api/v1/clusters/{0}'.format(cluster_name), desired_configs_body(desired_configs))
+
+
+def put_desired_configs(ambari_url, user, password, cluster_name, desired_configs, connection_timeout):
+    put_list = desired_configs_body(desired_configs)
     r = put(ambari_url, user, password,
             '/api/v1/clusters/{0}'.format(cluster_name), json.dumps(put_list), connection_timeout)
     try:
@@ -333,18 +829,38 @@ def get_cluster_config(ambari_url, user, password, cluster_name, config_type, co
         raise
 
 
-def get(ambari_url, user, password, path, connection_timeout):
-    headers = {'X-Requested-By': 'ambari'}
-    r = requests.get(ambari_url + path, auth=(user, password),
-                     headers=headers, timeout=connection_timeout)
-    return r
+def load_cluster_config(ambari_url, user, password, cluster_name, config_type, config_tag, connection_timeout, config_cache=None):
+    """Get a config version, reading it from the local snapshot cache when one is available."""
+    if config_cache is not None:
+        config = config_cache.get(cluster_name, config_type, config_tag)
+        if config is not None:
+            return config
+    config = get_cluster_config(
+        ambari_url, user, password, cluster_name, config_type, config_tag, connection_timeout)
+    if config_cache is not None:
+        config_cache.put(cluster_name, config_type, config_tag, config)
+    return config
 
 
-def put(ambari_url, user, password, path, data, connection_timeout):
-    headers = {'X-Requested-By': 'ambari'}
-    r = requests.put(ambari_url + path, data=data,
-                     auth=(user, password), headers=headers, timeout=connection_timeout)
-    return r
+def fetch_cluster_configs(ambari_url, user, password, cluster_name, type_tags, connection_timeout, parallelism, config_cache=None):
+    """Fetch (config_type, config_tag) pairs with at most `parallelism` requests in flight.
+
+    Yields (config_type, config, error) tuples in completion order, error is None on success.
+    """
+    pool = ThreadPoolExecutor(max_workers=max(parallelism, 1))
+    try:
+        futures = {}
+        for config_type, config_tag in type_tags:
+            future = pool.submit(load_cluster_config, ambari_url, user, password,
+                                 cluster_name, config_type, config_tag, connection_timeout, config_cache)
+            futures[future] = config_type
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+    finally:
+        pool.shutdown(wait=True)
 
 
 if __name__ == '__main__':
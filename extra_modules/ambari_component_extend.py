@@ -34,18 +34,75 @@ options:
       The name of the service you want to start or stop(installed), use 'all' to stop all or start all
   component:
     description:
-      The name of the component of the service to add host to
-    required: yes
+      The name of the component of the service to add host to, or a list of components. Required unless C(layout) is set
   add_host:
     description:
-      The FQDN of the host to add to certain component
-    required: yes
+      The FQDN of the host to add to certain component, or a list of hosts. Every listed component is added to every
+      listed host, the missing ones are created and installed with a single install request. Hosts not in the cluster
+      yet are registered with one bulk request, the outcome for every host is reported under C(hosts) when some of
+      them cannot be registered. Required with C(component)
+  layout:
+    description:
+      The full target layout, a list of host groups each with a list of C(hosts) and a list of C(components). The
+      module reads every host component of the cluster in one paginated sweep, then adds and installs only what is
+      missing, C(layout_batch_size) hosts per request. Mutually exclusive with C(component) and C(add_host)
+  layout_batch_size:
+    description:
+      Maximum number of hosts per install request in C(layout) mode, default is 100
+  state:
+    description:
+      C(installed) (default) stops once the added components are installed. C(started) also starts them, each host as
+      soon as its own install tasks finished rather than after the whole install request. Needs C(wait=true)
   retry:
     description:
-      The time to retry to wait for request finished, default value is 60, depends on how many services you are trying to restart
+      Only used when C(wait_timeout) is not set, the request may take up to C(retry) x C(wait_interval) seconds, default value is 60
   wait_interval:
     description:
-      The wait interval between every retry, default value is 10s
+      The maximum wait interval between two request status checks, default value is 10s. Polling starts at 1s and backs
+      off with jitter, checking earlier when the request progress says it is nearly done
+  wait_timeout:
+    description:
+      Wall-clock deadline in seconds for the request to finish, default is C(retry) x C(wait_interval)
+  max_failed_tasks:
+    description:
+      Fail as soon as more than this many tasks of the request failed, were aborted or timed out, instead of waiting
+      for the whole request to be marked as failed. Default is to wait for the request status
+  abort_on_failure:
+    description:
+      Abort the request on Ambari when C(max_failed_tasks) is exceeded or C(wait_timeout) is reached, default is False
+  wait:
+    description:
+      Wait for the install request to finish, default is True. With C(wait=false) the module returns the C(request_id)
+      as soon as Ambari accepted the request, use the ambari_request_wait module to wait for it later
+  ambari_metrics:
+    description:
+      Return an C(ambari_metrics) block with the number of Ambari API calls, bytes sent and received, latency totals
+      and percentiles overall and per endpoint, and the time spent sleeping between request polls. Default is False
+  ambari_trace_file:
+    description:
+      Append one JSON line per Ambari API call (method, path, status, latency, bytes, retries) to this local file,
+      e.g. to analyze a whole playbook run offline
+  profile_dir:
+    description:
+      Run the module under cProfile and save the profile plus a summary of the top C(profile_top) functions in this
+      directory, their paths are returned under C(profile). Can also be set with the AMBARI_MODULE_PROFILE_DIR
+      environment variable. Default is not to profile
+  profile_top:
+    description:
+      Number of functions listed in the profile summary, default is 30
+  ambari_max_rps:
+    description:
+      Maximum number of Ambari API calls per second, shared by every module running on this host against the same
+      Ambari server, e.g. all the forks of a play. Can also be set with the AMBARI_MAX_RPS environment variable.
+      Default is no limit
+  ambari_max_in_flight:
+    description:
+      Maximum number of Ambari API calls in flight at once, shared the same way as C(ambari_max_rps). Can also be set
+      with the AMBARI_MAX_IN_FLIGHT environment variable. Default is no limit
+  ambari_throttle_dir:
+    description:
+      Directory of the lock files holding the shared limits, the modules must use the same one to share them. Can also
+      be set with the AMBARI_THROTTLE_DIR environment variable. Default is ambari-throttle in the system temp directory
 '''
 
 EXAMPLES = '''
@@ -80,6 +137,35 @@ EXAMPLES = '''
         add_host: amb1.service.consul
         retry: 10
         wait_interval: 10
+
+  - name: Converge the cluster to its declared layout
+    ambari_component_extend:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: mycluster
+        layout:
+          - hosts: "{{ groups['masters'] }}"
+            components: [NAMENODE, RESOURCEMANAGER]
+          - hosts: "{{ groups['workers'] }}"
+            components: [DATANODE, NODEMANAGER]
+
+  - name: Onboard new worker nodes with a single install request
+    ambari_component_extend:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: mycluster
+        component:
+          - DATANODE
+          - NODEMANAGER
+        add_host:
+          - amb2.service.consul
+          - amb3.service.consul
+          - amb4.service.consul
+        state: started
 '''
 
 from ansible.module_utils.basic import AnsibleModule
@@ -106,8 +192,46 @@ except ImportError:
 else:
     TIME_FOUND = True
 
+import threading
 import traceback
 
+try:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+except ImportError:
+    FUTURES_FOUND = False
+else:
+    FUTURES_FOUND = True
+
+HOST_COMPONENTS_PAGE_SIZE = 1000
+HOST_REGISTRATION_PARALLELISM = 10
+
+try:
+    from ansible.module_utils.ambari_client import AmbariError, assert_status, get, get_client, plan_request, post, put
+except ImportError:
+    from module_utils.ambari_client import AmbariError, assert_status, get, get_client, plan_request, post, put
+
+try:
+    from ansible.module_utils.ambari_requests import AmbariRequestError, accepted_request, get_request_tasks, \
+        wait_for_request, wait_for_requests
+except ImportError:
+    from module_utils.ambari_requests import AmbariRequestError, accepted_request, get_request_tasks, \
+        wait_for_request, wait_for_requests
+
+try:
+    from ansible.module_utils.ambari_metrics import instrument_module, metrics_argument_spec
+except ImportError:
+    from module_utils.ambari_metrics import instrument_module, metrics_argument_spec
+
+try:
+    from ansible.module_utils.ambari_profile import profile_argument_spec, start_profiling
+except ImportError:
+    from module_utils.ambari_profile import profile_argument_spec, start_profiling
+
+try:
+    from ansible.module_utils.ambari_throttle import throttle_argument_spec, throttle_module
+except ImportError:
+    from module_utils.ambari_throttle import throttle_argument_spec, throttle_module
+
 
 def main():
 
@@ -118,14 +242,29 @@ def main():
         username=dict(type='str', default=None, required=True),
         password=dict(type='str', default=None, required=True, no_log=True),
         cluster_name=dict(type='str', default=None, required=True),
-        component=dict(type='str', default=None, required=True),
-        add_host=dict(type='str', default=None, required=True),
+        component=dict(type='list', default=None, required=False),
+        add_host=dict(type='list', default=None, required=False),
+        layout=dict(type='list', default=None, required=False),
+        layout_batch_size=dict(type='int', default=100, required=False),
+        state=dict(type='str', default='installed', required=False, choices=['installed', 'started']),
         retry=dict(type='int', default=60, required=False),
-        wait_interval = dict(type='int', default=10, required=False)
+        wait_interval = dict(type='int', default=10, required=False),
+        wait_timeout=dict(type='int', default=None, required=False),
+        max_failed_tasks=dict(type='int', default=None, required=False),
+        abort_on_failure=dict(type='bool', default=False, required=False),
+        wait=dict(type='bool', default=True, required=False)
     )
 
+    argument_spec.update(metrics_argument_spec())
+    argument_spec.update(profile_argument_spec())
+    argument_spec.update(throttle_argument_spec())
+
     module = AnsibleModule(
-        argument_spec=argument_spec
+        argument_spec=argument_spec,
+        required_one_of=[['component', 'layout']],
+        required_together=[['component', 'add_host']],
+        mutually_exclusive=[['component', 'layout'], ['add_host', 'layout']],
+        supports_check_mode=True
     )
 
     if not REQUESTS_FOUND:
@@ -140,7 +279,14 @@ def main():
         module.fail_json(
             msg='pyYaml library is required for this module')
 
+    if not FUTURES_FOUND:
+        module.fail_json(
+            msg='futures library is required for this module')
+
     p = module.params
+    instrument_module(module, p.get('ambari_metrics'), p.get('ambari_trace_file'))
+    start_profiling(module, p.get('profile_dir'), p.get('profile_top'))
+    throttle_module(module, p.get('ambari_max_rps'), p.get('ambari_max_in_flight'), p.get('ambari_throttle_dir'))
 
     protocol = p.get('protocol')
     host = p.get('host')
@@ -148,131 +294,393 @@ def main():
     username = p.get('username')
     password = p.get('password')
     cluster_name = p.get('cluster_name')
-    component = p.get('component')
-    hosttoadd = p.get('add_host')
+    components = [component.upper() for component in p.get('component') or []]
+    hosts = p.get('add_host')
+    layout = p.get('layout')
+    layout_batch_size = p.get('layout_batch_size')
+    state = p.get('state')
     retry = p.get('retry')
     wait_interval = p.get('wait_interval')
+    # Without an explicit deadline keep the overall bound the retry count used to give
+    wait_timeout = p.get('wait_timeout') or retry * wait_interval
+    max_failed_tasks = p.get('max_failed_tasks')
+    abort_on_failure = p.get('abort_on_failure')
+    wait = p.get('wait')
 
     ambari_url = '{0}://{1}:{2}'.format(protocol, host, port)
 
+    if state == 'started' and not wait:
+        module.fail_json(msg='state=started starts the components as their install finishes and needs wait=true')
+
     try:
-        make_sure_host_exist(ambari_url, username,
-                             password, cluster_name, hosttoadd)
-        # Add components to the host
-        check_response = get(ambari_url, username, password,
-                             '/api/v1/clusters/{0}/hosts/{1}/host_components/{2}'.format(cluster_name, hosttoadd, component))
-        if check_response.status_code == 200:
-            module.exit_json(changed=False, result=check_response.content,
-                             msg='Nothing changed, component [{0}] exist for host [{1}]'.format(component, hosttoadd))
-        elif check_response.status_code == 404:
-            add_response = post(ambari_url, username, password, '/api/v1/clusters/{0}/hosts/{1}/host_components/{2}'.format(
-                cluster_name, hosttoadd, component), json.dumps({}))
-            assert_status(add_response, ['200', '201', '202'])
-            # Install components to hosts
-            r = put(ambari_url, username, password, '/api/v1/clusters/{0}/hosts/{1}/host_components/{2}'.format(cluster_name, hosttoadd, component), json.dumps({
-                'HostRoles': {
-                    'state': 'INSTALLED'
-                }
-            }))
-            assert_status(r, ['202'])
-            response = json.loads(r.content)
-            request_meta = response.get('Requests')
-            try:
-                request_status = request_meta.get('status')
-                assert request_status.upper() == 'ACCEPTED' or request_status.upper() == 'COMPLETED'
-            except AssertionError as e:
-                e.messge = 'Request sent to ambari server is not accepted or completed. request code: {0}, messge: {1}'.format(
-                    r.status_code, r.content)
-                raise
-
-            retry_counter = 0
-            while True and retry_counter < retry:
-                progress, completed = wait_for_request_bounded(
-                    cluster_name, ambari_url, username, password, request_meta)
-                if completed:
-                    module.exit_json(changed=True, results=progress)
-                else:
-                    time.sleep(wait_interval)
-                    retry_counter = retry_counter + 1
-
-            raise Exception('Max request waiting retries')
+        # In check mode the write requests are collected into the plan instead of being sent
+        plan = [] if module.check_mode else None
+        if layout is not None:
+            # converge the whole declared layout
+            process_layout(module, ambari_url, username, password, cluster_name, layout, layout_batch_size, state,
+                           wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait, plan)
         else:
-            raise Exception('Unknow status code from status check: {0}, response content: {1}'.format(
-                check_response.status_code, check_response))
+            outcomes = make_sure_hosts_exist(ambari_url, username, password, cluster_name, hosts, plan)
+            if len(unregistered_hosts(outcomes)) > 0:
+                module.fail_json(msg='Could not register hosts in cluster [{0}]: {1}'.format(
+                    cluster_name, ', '.join(unregistered_hosts(outcomes))), hosts=outcomes)
+            process_components(module, ambari_url, username, password, cluster_name, hosts, components, state,
+                               wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait, plan)
 
     except requests.ConnectionError as e:
         module.fail_json(
-            msg="Could not connect to Ambari client: " + str(e.message), stacktrace=traceback.format_exc())
+            msg="Could not connect to Ambari client: " + str(e), stacktrace=traceback.format_exc())
+    except AmbariRequestError as e:
+        module.fail_json(msg=e.message, request_id=e.request_id, aborted=e.aborted,
+                         failed_tasks=e.failed_tasks, stacktrace=traceback.format_exc())
+    except AmbariError as e:
+        module.fail_json(msg=e.message, status_code=e.status_code, stacktrace=traceback.format_exc())
     except AssertionError as e:
         module.fail_json(msg=e.message, stacktrace=traceback.format_exc())
     except Exception as e:
         module.fail_json(
-            msg="Ambari client exception occurred: " + str(e.message), stacktrace=traceback.format_exc())
-
-
-def assert_status(response, expected):
-    assert str(response.status_code) in expected, 'Expected response code unmatch: Exp[{0}], Actual[{1}] \n Message: {2}'.format(
-        expected, response.status_code, response.content)
-
-
-def make_sure_host_exist(ambari_url, username, password, cluster_name, hosttoadd):
-    r = get(ambari_url, username, password,
-            '/api/v1/clusters/{0}/hosts/{1}'.format(cluster_name, hosttoadd))
-    if str(r.status_code) == '404':
-        # Host not found, try to add host
-        payload = {}
-        create_host_response = put(ambari_url, username, password,
-                                   '/api/v1/clusters/{0}/hosts/{1}'.format(cluster_name, hosttoadd), json.dumps(payload))
-        assert_status(create_host_response, ['200', '201', '202'])
-    elif str(r.status_code) == '200':
-        pass
+            msg="Ambari client exception occurred: " + str(e), stacktrace=traceback.format_exc())
+
+
+def process_components(module, ambari_url, username, password, cluster_name, hosts, components, state, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait, plan=None):
+    existing = get_existing_host_components(ambari_url, username, password, cluster_name, hosts, components)
+    requested = [(hosttoadd, component) for hosttoadd in hosts for component in components]
+    missing = [pair for pair in requested if pair not in existing]
+    # Components created by an earlier run that stopped before installing them are still in INIT
+    to_install = [pair for pair in requested if existing.get(pair, 'INIT') == 'INIT']
+    added = [{'host': hosttoadd, 'component': component} for hosttoadd, component in missing]
+    installed = [{'host': hosttoadd, 'component': component} for hosttoadd, component in to_install]
+    if len(to_install) == 0:
+        module.exit_json(changed=False,
+                         msg='Nothing changed, components [{0}] exist for hosts [{1}]'.format(
+                             ', '.join(components), ', '.join(hosts)))
+    elif plan is not None:
+        plan.extend(plan_request('POST', path, payload) for path, payload in add_components_requests(cluster_name, missing))
+        plan.append(plan_request('PUT', install_components_path(cluster_name, to_install), install_components_payload(cluster_name)))
+        if state == 'started':
+            plan.extend(plan_request('PUT', path, payload) for path, payload in start_components_requests(cluster_name, to_install))
+        module.exit_json(changed=True, added=added, installed=installed, plan=plan)
     else:
-        raise AssertionError(
-            'Status code for checking host registration not support: {0}'.format(str(r.status_code)))
-
-
-def get(ambari_url, user, password, path, connection_timeout=10):
-    headers = {'X-Requested-By': 'ambari'}
-    r = requests.get(ambari_url + path, auth=(user, password),
-                     headers=headers, timeout=connection_timeout)
-    return r
-
-
-def post(ambari_url, user, password, path, data, connection_timeout=10):
-    headers = {'X-Requested-By': 'ambari'}
-    r = requests.post(ambari_url + path, data=data,
-                      auth=(user, password), headers=headers, timeout=connection_timeout)
-    return r
-
-
-def put(ambari_url, user, password, path, data, connection_timeout=10):
-    headers = {'X-Requested-By': 'ambari'}
-    r = requests.put(ambari_url + path, data=data,
-                     auth=(user, password), headers=headers, timeout=connection_timeout)
-    return r
+        # Create the missing host components, one POST per distinct set of components missing on a group of hosts
+        for path, payload in add_components_requests(cluster_name, missing):
+            add_response = post(ambari_url, username, password, path, json.dumps(payload))
+            assert_status(add_response, ['200', '201', '202'])
+        # Install all of them with a single request, only the new and the leftover components are still in INIT
+        r = put(ambari_url, username, password, install_components_path(cluster_name, to_install),
+                json.dumps(install_components_payload(cluster_name)))
+        assert_status(r, ['202'])
+        request_meta = accepted_request(r)
+        if not wait:
+            # Fire and forget, the request is tracked later with the ambari_request_wait module
+            module.exit_json(changed=True, added=added, installed=installed, request_id=request_meta.get('id'),
+                             results={'Requests': request_meta})
+        elif state == 'started':
+            start_request_ids = []
+            progress = wait_for_request(
+                cluster_name, ambari_url, username, password, request_meta, wait_timeout, wait_interval, max_failed_tasks,
+                abort_on_failure, on_progress=start_when_installed(ambari_url, username, password, cluster_name, to_install,
+                                                                   start_request_ids))
+            wait_for_requests(cluster_name, ambari_url, username, password, start_request_ids, wait_timeout,
+                              wait_interval, max_failed_tasks, abort_on_failure)
+            module.exit_json(changed=True, added=added, installed=installed, request_id=request_meta.get('id'),
+                             start_request_ids=start_request_ids, results=progress)
+        else:
+            progress = wait_for_request(
+                cluster_name, ambari_url, username, password, request_meta, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure)
+            module.exit_json(changed=True, added=added, installed=installed, request_id=request_meta.get('id'),
+                             results=progress)
+
+
+def process_layout(module, ambari_url, username, password, cluster_name, layout, batch_size, state, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait, plan=None):
+    desired = layout_host_components(layout)
+    index = get_host_components_index(ambari_url, username, password, cluster_name)
+    # Hosts without any component are not in the index, only those may still need to be registered
+    known_hosts = set(hosttoadd for hosttoadd, _ in index)
+    unknown_hosts = sorted(set(hosttoadd for hosttoadd, _ in desired) - known_hosts)
+    if len(unknown_hosts) > 0:
+        outcomes = make_sure_hosts_exist(ambari_url, username, password, cluster_name, unknown_hosts, plan)
+        if len(unregistered_hosts(outcomes)) > 0:
+            module.fail_json(msg='Could not register hosts in cluster [{0}]: {1}'.format(
+                cluster_name, ', '.join(unregistered_hosts(outcomes))), hosts=outcomes)
+    missing = [pair for pair in desired if pair not in index]
+    # Components created earlier but never installed are still in INIT
+    to_install = [pair for pair in desired if index.get(pair, 'INIT') == 'INIT']
+    added = [{'host': hosttoadd, 'component': component} for hosttoadd, component in missing]
+    installed = [{'host': hosttoadd, 'component': component} for hosttoadd, component in to_install]
+    if len(to_install) == 0:
+        module.exit_json(changed=False, msg='Nothing changed, the cluster matches the layout')
+    elif plan is not None:
+        for batch_missing, batch_install in layout_batches(missing, to_install, batch_size):
+            plan.extend(plan_request('POST', path, payload) for path, payload in add_components_requests(cluster_name, batch_missing))
+            plan.append(plan_request('PUT', install_components_path(cluster_name, batch_install),
+                                     install_components_payload(cluster_name)))
+            if state == 'started':
+                plan.extend(plan_request('PUT', path, payload)
+                            for path, payload in start_components_requests(cluster_name, batch_install))
+        module.exit_json(changed=True, added=added, installed=installed, plan=plan)
+    else:
+        request_ids = []
+        for batch_missing, batch_install in layout_batches(missing, to_install, batch_size):
+            for path, payload in add_components_requests(cluster_name, batch_missing):
+                add_response = post(ambari_url, username, password, path, json.dumps(payload))
+                assert_status(add_response, ['200', '201', '202'])
+            r = put(ambari_url, username, password, install_components_path(cluster_name, batch_install),
+                    json.dumps(install_components_payload(cluster_name)))
+            assert_status(r, ['202'])
+            request_ids.append(accepted_request(r).get('id'))
+        if not wait:
+            module.exit_json(changed=True, added=added, installed=installed, request_ids=request_ids)
+        else:
+            start_request_ids = []
+            on_progress = None
+            if state == 'started':
+                on_progress = start_when_installed(ambari_url, username, password, cluster_name, to_install,
+                                                   start_request_ids)
+            # The install requests of all the batches run side by side on Ambari
+            progress = wait_for_requests(cluster_name, ambari_url, username, password, request_ids, wait_timeout,
+                                         wait_interval, max_failed_tasks, abort_on_failure, on_progress=on_progress)
+            wait_for_requests(cluster_name, ambari_url, username, password, start_request_ids, wait_timeout,
+                              wait_interval, max_failed_tasks, abort_on_failure)
+            module.exit_json(changed=True, added=added, installed=installed, request_ids=request_ids,
+                             start_request_ids=start_request_ids,
+                             results=[progress[request_id] for request_id in request_ids])
+
+
+def start_when_installed(ambari_url, username, password, cluster_name, to_start, start_request_ids):
+    """Return a progress callback that starts the components of every host as soon as all its install tasks completed.
+
+    The ids of the start requests are appended to start_request_ids. Hosts that finish between two polls are started
+    with one request per distinct set of installed components, so the start of early hosts does not wait for the
+    slowest host of the install. The full task list of an install request is read once to learn its hosts, later
+    polls only read the tasks that are not completed yet.
+    """
+    components_by_host = {}
+    for hosttoadd, component in to_start:
+        components_by_host.setdefault(hosttoadd, []).append(component)
+    started_hosts = set()
+    completed_counts = {}
+    request_hosts = {}
+    lock = threading.Lock()
+
+    def on_progress(progress):
+        request = progress.get('Requests')
+        request_id = request.get('id')
+        completed_count = request.get('completed_task_count')
+        # Task details are only read when more install tasks finished since the last poll
+        if completed_count is not None and completed_count == completed_counts.get(request_id, 0):
+            return
+        completed_counts[request_id] = completed_count
+        if request_id not in request_hosts:
+            tasks = get_request_tasks(cluster_name, ambari_url, username, password, request_id)
+            request_hosts[request_id] = set(task.get('host_name') for task in tasks)
+        else:
+            tasks = get_request_tasks(cluster_name, ambari_url, username, password, request_id, unfinished_only=True)
+        unfinished_hosts = set(task.get('host_name') for task in tasks if task.get('status') != 'COMPLETED')
+        with lock:
+            ready = [hosttoadd for hosttoadd in request_hosts[request_id]
+                     if hosttoadd in components_by_host and hosttoadd not in started_hosts
+                     and hosttoadd not in unfinished_hosts]
+            started_hosts.update(ready)
+        if len(ready) == 0:
+            return
+        ready_pairs = [(hosttoadd, component) for hosttoadd in sorted(ready) for component in components_by_host[hosttoadd]]
+        for path, payload in start_components_requests(cluster_name, ready_pairs):
+            r = put(ambari_url, username, password, path, json.dumps(payload))
+            assert_status(r, ['200', '202'])
+            if str(r.status_code) == '202':
+                start_request_ids.append(accepted_request(r).get('id'))
+
+    return on_progress
+
+
+def layout_host_components(layout):
+    """Expand the host groups of a layout into the ordered list of desired (host, component) pairs."""
+    desired = []
+    seen = set()
+    for group in layout:
+        try:
+            assert isinstance(group, dict) and group.get('hosts') and group.get('components')
+        except AssertionError as e:
+            e.message = 'Every layout entry needs a list of hosts and a list of components: {0}'.format(group)
+            raise
+        for hosttoadd in group.get('hosts'):
+            for component in group.get('components'):
+                pair = (hosttoadd, component.upper())
+                if pair not in seen:
+                    seen.add(pair)
+                    desired.append(pair)
+    return desired
+
+
+def layout_batches(missing, to_install, batch_size):
+    """Split the work into batches of at most batch_size hosts, keeping the predicate URLs short."""
+    hosts = []
+    for hosttoadd, _ in to_install:
+        if hosttoadd not in hosts:
+            hosts.append(hosttoadd)
+    batches = []
+    for i in range(0, len(hosts), batch_size):
+        batch_hosts = set(hosts[i:i + batch_size])
+        batches.append(([pair for pair in missing if pair[0] in batch_hosts],
+                        [pair for pair in to_install if pair[0] in batch_hosts]))
+    return batches
+
+
+def get_host_components_index(ambari_url, username, password, cluster_name, page_size=HOST_COMPONENTS_PAGE_SIZE):
+    """Return the state of every host component of the cluster by (host, component), read page by page."""
+    index = {}
+    offset = 0
+    while True:
+        r = get(ambari_url, username, password,
+                '/api/v1/clusters/{0}/host_components?fields=HostRoles/host_name,HostRoles/component_name,HostRoles/state'
+                '&page_size={1}&from={2}'.format(cluster_name, page_size, offset))
+        assert_status(r, ['200'])
+        items = json.loads(r.content).get('items', [])
+        for item in items:
+            index[(item['HostRoles']['host_name'], item['HostRoles']['component_name'])] = item['HostRoles'].get('state')
+        if len(items) < page_size:
+            return index
+        offset = offset + page_size
+
+
+def get_existing_host_components(ambari_url, username, password, cluster_name, hosts, components):
+    """Return the state of the (host, component) pairs that already exist, read with a single host_components query."""
+    r = get(ambari_url, username, password,
+            '/api/v1/clusters/{0}/host_components?HostRoles/host_name.in({1})&HostRoles/component_name.in({2})'
+            '&fields=HostRoles/host_name,HostRoles/component_name,HostRoles/state'.format(
+                cluster_name, ','.join(hosts), ','.join(components)))
+    assert_status(r, ['200'])
+    existing = {}
+    for item in json.loads(r.content).get('items', []):
+        existing[(item['HostRoles']['host_name'], item['HostRoles']['component_name'])] = item['HostRoles'].get('state')
+    return existing
+
+
+def hosts_by_components(pairs):
+    """Group (host, component) pairs into (components, hosts) tuples of the hosts that have exactly the same components."""
+    components_by_host = {}
+    for hosttoadd, component in pairs:
+        components_by_host.setdefault(hosttoadd, []).append(component)
+    groups = {}
+    for hosttoadd, host_components in components_by_host.items():
+        groups.setdefault(tuple(sorted(host_components)), []).append(hosttoadd)
+    return [(host_components, sorted(groups[host_components])) for host_components in sorted(groups)]
+
+
+def add_components_requests(cluster_name, missing):
+    # Hosts missing the same components share one multi-host POST on /hosts
+    add_requests = []
+    for host_components, group_hosts in hosts_by_components(missing):
+        add_requests.append(('/api/v1/clusters/{0}/hosts'.format(cluster_name), {
+            'RequestInfo': {
+                'query': 'Hosts/host_name.in({0})'.format(','.join(group_hosts))
+            },
+            'Body': {
+                'host_components': [{'HostRoles': {'component_name': component}} for component in host_components]
+            }
+        }))
+    return add_requests
+
+
+def install_components_path(cluster_name, missing):
+    hosts = sorted(set(hosttoadd for hosttoadd, _ in missing))
+    components = sorted(set(component for _, component in missing))
+    return '/api/v1/clusters/{0}/host_components?HostRoles/host_name.in({1})&HostRoles/component_name.in({2})' \
+        '&HostRoles/state=INIT'.format(cluster_name, ','.join(hosts), ','.join(components))
+
+
+def start_components_path(cluster_name, hosts, components):
+    return '/api/v1/clusters/{0}/host_components?HostRoles/host_name.in({1})&HostRoles/component_name.in({2})' \
+        '&HostRoles/state=INSTALLED'.format(cluster_name, ','.join(hosts), ','.join(components))
+
+
+def start_components_requests(cluster_name, pairs):
+    # One PUT per group of hosts sharing the same components, a hosts x components predicate would also start
+    # components that were already on one of the hosts and are stopped on purpose
+    return [(start_components_path(cluster_name, group_hosts, host_components), start_components_payload(cluster_name))
+            for host_components, group_hosts in hosts_by_components(pairs)]
+
+
+def start_components_payload(cluster_name):
+    return {
+        'RequestInfo': {
+            'context': 'Start components in Cluster[{0}] via API'.format(cluster_name)
+        },
+        'Body': {
+            'HostRoles': {
+                'state': 'STARTED'
+            }
+        }
+    }
+
+
+def install_components_payload(cluster_name):
+    return {
+        'RequestInfo': {
+            'context': 'Install components in Cluster[{0}] via API'.format(cluster_name)
+        },
+        'Body': {
+            'HostRoles': {
+                'state': 'INSTALLED'
+            }
+        }
+    }
+
+
+def make_sure_hosts_exist(ambari_url, username, password, cluster_name, hosts, plan=None):
+    """Register the hosts missing from the cluster, returning the outcome for every host.
+
+    The cluster hosts are listed once and the missing ones are registered with one bulk POST. Ambari creates the hosts
+    of a bulk POST all or nothing, so when it fails every host is registered on its own to report which ones fail.
+    """
+    r = get(ambari_url, username, password, '/api/v1/clusters/{0}/hosts?fields=Hosts/host_name'.format(cluster_name))
+    assert_status(r, ['200'])
+    existing = set(item['Hosts']['host_name'] for item in json.loads(r.content).get('items', []))
+    outcomes = {}
+    missing = []
+    for hosttoadd in hosts:
+        if hosttoadd in existing:
+            outcomes[hosttoadd] = 'exists'
+        elif hosttoadd not in missing:
+            missing.append(hosttoadd)
+    if len(missing) == 0:
+        return outcomes
+    path = '/api/v1/clusters/{0}/hosts'.format(cluster_name)
+    payload = [{'Hosts': {'host_name': hosttoadd}} for hosttoadd in missing]
+    if plan is not None:
+        plan.append(plan_request('POST', path, payload))
+        outcomes.update((hosttoadd, 'registered') for hosttoadd in missing)
+        return outcomes
+    r = post(ambari_url, username, password, path, json.dumps(payload))
+    if str(r.status_code) in ['200', '201', '202']:
+        outcomes.update((hosttoadd, 'registered') for hosttoadd in missing)
+        return outcomes
+    parallelism = min(len(missing), HOST_REGISTRATION_PARALLELISM)
+    get_client(ambari_url, username, password, pool_size=parallelism)
+    pool = ThreadPoolExecutor(max_workers=parallelism)
+    try:
+        futures = dict((pool.submit(register_host, ambari_url, username, password, cluster_name, hosttoadd), hosttoadd)
+                       for hosttoadd in missing)
+        for future in as_completed(futures):
+            outcomes[futures[future]] = future.result()
+    finally:
+        pool.shutdown(wait=True)
+    return outcomes
 
 
-def wait_for_request_bounded(cluster_name, ambari_url, user, password, request_meta):
-    res = get(ambari_url, user, password,
-              '/api/v1/clusters/{0}/requests/{1}'.format(cluster_name, request_meta.get('id')))
+def register_host(ambari_url, username, password, cluster_name, hosttoadd):
     try:
-        assert res.status_code == 200 or res.status_code == 201
-    except AssertionError as e:
-        e.message = 'Coud not obtain requests status: request code {0}, \
-                    request message {1}'.format(res.status_code, res.content)
-        raise
-    progress = json.loads(res.content)
-    try:
-        assert progress.get('Requests').get(
-            'request_status').upper() != 'FAILED'
-    except AssertionError as e:
-        e.message = 'Request has failed due to: {0}'.format(res.content)
-        raise
-    if progress.get('Requests').get('request_status').upper() == 'COMPLETED':
-        return progress, True
-    else:
-        return progress, False
+        r = post(ambari_url, username, password,
+                 '/api/v1/clusters/{0}/hosts/{1}'.format(cluster_name, hosttoadd), json.dumps({}))
+    except requests.RequestException as e:
+        return 'failed: {0}'.format(e)
+    if str(r.status_code) in ['200', '201', '202']:
+        return 'registered'
+    return 'failed: status code {0}, {1}'.format(r.status_code, r.content)
+
 
+def unregistered_hosts(outcomes):
+    return sorted(hosttoadd for hosttoadd, outcome in outcomes.items() if outcome.startswith('failed'))
 
 if __name__ == '__main__':
     main()
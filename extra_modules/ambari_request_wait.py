@@ -0,0 +1,275 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Documentation section
+DOCUMENTATION = '''
+---
+module: ambari_request_wait
+version_added: "1.0"
+short_description: Wait for Ambari requests submitted earlier with wait=false
+  - Wait for several Ambari requests and request schedules at once, returns when all of them completed or as soon
+    as one failed
+options:
+  protocol:
+    description:
+      The protocol for the ambari web server (http / https)
+  host:
+    description:
+      The hostname for the ambari web server
+  port:
+    description:
+      The port for the ambari web server
+  username:
+    description:
+      The username for the ambari web server
+  password:
+    description:
+      The name of the cluster in web server
+    required: yes
+  cluster_name:
+    description:
+      The name of the cluster in ambari
+    required: yes
+  request_ids:
+    description:
+      The ids of the Ambari requests to wait for, as returned under C(request_id) by the other modules with C(wait=false)
+    required: no
+  request_schedule_ids:
+    description:
+      The ids of the Ambari request schedules to wait for, as returned under C(request_schedule_id) by
+      ambari_service_control with C(state=rolling_restarted) and C(wait=false). At least one of C(request_ids) and
+      C(request_schedule_ids) is required
+    required: no
+  parallelism:
+    description:
+      Number of requests and schedules polled concurrently over the shared connection pool, default is 10
+  retry:
+    description:
+      Only used when C(wait_timeout) is not set, the requests may take up to C(retry) x C(wait_interval) seconds, default value is 60
+  wait_interval:
+    description:
+      The maximum wait interval between two status checks of a request, default value is 10s
+  wait_timeout:
+    description:
+      Wall-clock deadline in seconds for every request and schedule to finish, default is C(retry) x C(wait_interval)
+  max_failed_tasks:
+    description:
+      Fail as soon as more than this many tasks of one of the requests failed, were aborted or timed out
+  abort_on_failure:
+    description:
+      Abort a request on Ambari when C(max_failed_tasks) is exceeded or C(wait_timeout) is reached, and delete a
+      schedule that did not complete within C(wait_timeout). Default is False
+  ambari_metrics:
+    description:
+      Return an C(ambari_metrics) block with the number of Ambari API calls, bytes sent and received, latency totals
+      and percentiles overall and per endpoint, and the time spent sleeping between request polls. Default is False
+  ambari_trace_file:
+    description:
+      Append one JSON line per Ambari API call (method, path, status, latency, bytes, retries) to this local file,
+      e.g. to analyze a whole playbook run offline
+  profile_dir:
+    description:
+      Run the module under cProfile and save the profile plus a summary of the top C(profile_top) functions in this
+      directory, their paths are returned under C(profile). Can also be set with the AMBARI_MODULE_PROFILE_DIR
+      environment variable. Default is not to profile
+  profile_top:
+    description:
+      Number of functions listed in the profile summary, default is 30
+  ambari_max_rps:
+    description:
+      Maximum number of Ambari API calls per second, shared by every module running on this host against the same
+      Ambari server, e.g. all the forks of a play. Can also be set with the AMBARI_MAX_RPS environment variable.
+      Default is no limit
+  ambari_max_in_flight:
+    description:
+      Maximum number of Ambari API calls in flight at once, shared the same way as C(ambari_max_rps). Can also be set
+      with the AMBARI_MAX_IN_FLIGHT environment variable. Default is no limit
+  ambari_throttle_dir:
+    description:
+      Directory of the lock files holding the shared limits, the modules must use the same one to share them. Can also
+      be set with the AMBARI_THROTTLE_DIR environment variable. Default is ambari-throttle in the system temp directory
+'''
+
+EXAMPLES = '''
+# example:
+
+  - name: Install the new DataNode without blocking
+    ambari_component_extend:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: my_cluster
+        component: DATANODE
+        add_host: new-host.example.com
+        wait: false
+    register: install
+
+  - name: Restart the other cluster without blocking
+    ambari_service_control:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: my_cluster
+        service: all
+        state: restarted_stale
+        wait: false
+    register: restart
+
+  - name: Rolling restart of the DataNodes without blocking
+    ambari_service_control:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: my_cluster
+        service: HDFS
+        component: DATANODE
+        state: rolling_restarted
+        wait: false
+    register: rolling
+
+  - name: Wait for all of them
+    ambari_request_wait:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: my_cluster
+        request_ids:
+          - "{{ install.request_id }}"
+          - "{{ restart.request_id }}"
+        request_schedule_ids:
+          - "{{ rolling.request_schedule_id }}"
+        wait_timeout: 3600
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+try:
+    import requests
+except ImportError:
+    REQUESTS_FOUND = False
+else:
+    REQUESTS_FOUND = True
+
+import traceback
+
+try:
+    from ansible.module_utils.ambari_client import AmbariError
+except ImportError:
+    from module_utils.ambari_client import AmbariError
+
+try:
+    from ansible.module_utils.ambari_requests import FUTURES_FOUND, AmbariRequestError, wait_for_all
+except ImportError:
+    from module_utils.ambari_requests import FUTURES_FOUND, AmbariRequestError, wait_for_all
+
+try:
+    from ansible.module_utils.ambari_metrics import instrument_module, metrics_argument_spec
+except ImportError:
+    from module_utils.ambari_metrics import instrument_module, metrics_argument_spec
+
+try:
+    from ansible.module_utils.ambari_profile import profile_argument_spec, start_profiling
+except ImportError:
+    from module_utils.ambari_profile import profile_argument_spec, start_profiling
+
+try:
+    from ansible.module_utils.ambari_throttle import throttle_argument_spec, throttle_module
+except ImportError:
+    from module_utils.ambari_throttle import throttle_argument_spec, throttle_module
+
+
+def main():
+
+    argument_spec = dict(
+        protocol=dict(type='str', default='http', required=False),
+        host=dict(type='str', default=None, required=True),
+        port=dict(type='int', default=None, required=True),
+        username=dict(type='str', default=None, required=True),
+        password=dict(type='str', default=None, required=True, no_log=True),
+        cluster_name=dict(type='str', default=None, required=True),
+        request_ids=dict(type='list', default=[], required=False),
+        request_schedule_ids=dict(type='list', default=[], required=False),
+        parallelism=dict(type='int', default=10, required=False),
+        retry=dict(type='int', default=60, required=False),
+        wait_interval=dict(type='int', default=10, required=False),
+        wait_timeout=dict(type='int', default=None, required=False),
+        max_failed_tasks=dict(type='int', default=None, required=False),
+        abort_on_failure=dict(type='bool', default=False, required=False)
+    )
+
+    argument_spec.update(metrics_argument_spec())
+    argument_spec.update(profile_argument_spec())
+    argument_spec.update(throttle_argument_spec())
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        required_one_of=[['request_ids', 'request_schedule_ids']],
+        supports_check_mode=True
+    )
+
+    if not REQUESTS_FOUND:
+        module.fail_json(
+            msg='requests library is required for this module')
+
+    if not FUTURES_FOUND:
+        module.fail_json(
+            msg='futures library is required for this module')
+
+    p = module.params
+    instrument_module(module, p.get('ambari_metrics'), p.get('ambari_trace_file'))
+    start_profiling(module, p.get('profile_dir'), p.get('profile_top'))
+    throttle_module(module, p.get('ambari_max_rps'), p.get('ambari_max_in_flight'), p.get('ambari_throttle_dir'))
+
+    protocol = p.get('protocol')
+    host = p.get('host')
+    port = p.get('port')
+    username = p.get('username')
+    password = p.get('password')
+    cluster_name = p.get('cluster_name')
+    request_ids = p.get('request_ids')
+    request_schedule_ids = p.get('request_schedule_ids')
+    parallelism = p.get('parallelism')
+    retry = p.get('retry')
+    wait_interval = p.get('wait_interval')
+    wait_timeout = p.get('wait_timeout') or retry * wait_interval
+    max_failed_tasks = p.get('max_failed_tasks')
+    abort_on_failure = p.get('abort_on_failure')
+
+    ambari_url = '{0}://{1}:{2}'.format(protocol, host, port)
+
+    try:
+        process_request_wait(ambari_url, username, password, module, cluster_name, request_ids, request_schedule_ids,
+                             parallelism, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure)
+    except requests.ConnectionError as e:
+        module.fail_json(
+            msg="Could not connect to Ambari client: " + str(e), stacktrace=traceback.format_exc())
+    except AmbariRequestError as e:
+        module.fail_json(msg=e.message, request_id=e.request_id, aborted=e.aborted,
+                         failed_tasks=e.failed_tasks, stacktrace=traceback.format_exc())
+    except AmbariError as e:
+        module.fail_json(msg=e.message, status_code=e.status_code, stacktrace=traceback.format_exc())
+    except AssertionError as e:
+        module.fail_json(msg=e.message, stacktrace=traceback.format_exc())
+    except Exception as e:
+        module.fail_json(
+            msg="Ambari client exception occurred: " + str(e), stacktrace=traceback.format_exc())
+
+
+def process_request_wait(ambari_url, username, password, module, cluster_name, request_ids, request_schedule_ids, parallelism, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure):
+    # Ansible templating hands the ids over as strings
+    request_ids = [int(request_id) for request_id in request_ids or []]
+    request_schedule_ids = [int(schedule_id) for schedule_id in request_schedule_ids or []]
+    results, schedule_results = wait_for_all(cluster_name, ambari_url, username, password, request_ids,
+                                             request_schedule_ids, wait_timeout, wait_interval, max_failed_tasks,
+                                             abort_on_failure, parallelism)
+    module.exit_json(changed=False, request_status=dict(
+        (str(request_id), results[request_id].get('Requests')) for request_id in request_ids),
+        request_schedule_status=dict(
+        (str(schedule_id), schedule_results[schedule_id].get('RequestSchedule')) for schedule_id in request_schedule_ids))
+
+
+if __name__ == '__main__':
+    main()
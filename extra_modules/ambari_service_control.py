@@ -31,17 +31,77 @@ options:
     required: yes
   service:
     description:
-      The name of the service you want to start or stop(installed), use 'all' to stop all or start all
+      The name of the service you want to start or stop(installed), use 'all' to stop all or start all.
+      A list of services is changed with a single Ambari request, services already in the desired state are skipped
   state:
     description:
-      start or stop (installed in ambari language), the desired state for the ambari service ['STARTED', 'INSTALLED']
+      start or stop (installed in ambari language), the desired state for the ambari service ['STARTED', 'INSTALLED'].
+      C(restarted_stale) restarts only the host components of the given services (or of all services) that run with
+      stale configs, using a single RESTART request. C(rolling_restarted) restarts C(component) C(batch_size) hosts at a time
     required: yes
+  component:
+    description:
+      The components to restart with C(state=rolling_restarted), e.g. DATANODE or NODEMANAGER
+  batch_size:
+    description:
+      Number of hosts restarted per batch with C(state=rolling_restarted), default is 1
+  batch_pause:
+    description:
+      Seconds Ambari waits between two batches with C(state=rolling_restarted), default is 60
+  batch_failure_tolerance:
+    description:
+      Number of failed tasks tolerated over the rolling restart before Ambari stops running batches, default is 0
   retry:
     description:
-      The time to retry to wait for request finished, default value is 60, depends on how many services you are trying to restart
+      Only used when C(wait_timeout) is not set, the request may take up to C(retry) x C(wait_interval) seconds, default value is 60
   wait_interval:
     description:
-      The wait interval between every retry, default value is 10s
+      The maximum wait interval between two request status checks, default value is 10s. Polling starts at 1s and backs
+      off with jitter, checking earlier when the request progress says it is nearly done
+  wait_timeout:
+    description:
+      Wall-clock deadline in seconds for the request to finish, default is C(retry) x C(wait_interval)
+  max_failed_tasks:
+    description:
+      Fail as soon as more than this many tasks of the request failed, were aborted or timed out, instead of waiting
+      for the whole request to be marked as failed. Default is to wait for the request status
+  abort_on_failure:
+    description:
+      Abort the request on Ambari when C(max_failed_tasks) is exceeded or C(wait_timeout) is reached, default is False
+  wait:
+    description:
+      Wait for the Ambari request to finish, default is True. With C(wait=false) the module returns the C(request_id)
+      (C(request_schedule_id) for a rolling restart) as soon as Ambari accepted the request, use the
+      ambari_request_wait module with C(request_ids) (or C(request_schedule_ids)) to wait for it later
+  ambari_metrics:
+    description:
+      Return an C(ambari_metrics) block with the number of Ambari API calls, bytes sent and received, latency totals
+      and percentiles overall and per endpoint, and the time spent sleeping between request polls. Default is False
+  ambari_trace_file:
+    description:
+      Append one JSON line per Ambari API call (method, path, status, latency, bytes, retries) to this local file,
+      e.g. to analyze a whole playbook run offline
+  profile_dir:
+    description:
+      Run the module under cProfile and save the profile plus a summary of the top C(profile_top) functions in this
+      directory, their paths are returned under C(profile). Can also be set with the AMBARI_MODULE_PROFILE_DIR
+      environment variable. Default is not to profile
+  profile_top:
+    description:
+      Number of functions listed in the profile summary, default is 30
+  ambari_max_rps:
+    description:
+      Maximum number of Ambari API calls per second, shared by every module running on this host against the same
+      Ambari server, e.g. all the forks of a play. Can also be set with the AMBARI_MAX_RPS environment variable.
+      Default is no limit
+  ambari_max_in_flight:
+    description:
+      Maximum number of Ambari API calls in flight at once, shared the same way as C(ambari_max_rps). Can also be set
+      with the AMBARI_MAX_IN_FLIGHT environment variable. Default is no limit
+  ambari_throttle_dir:
+    description:
+      Directory of the lock files holding the shared limits, the modules must use the same one to share them. Can also
+      be set with the AMBARI_THROTTLE_DIR environment variable. Default is ambari-throttle in the system temp directory
 '''
 
 EXAMPLES = '''
@@ -76,6 +136,45 @@ EXAMPLES = '''
         state: started
         retry: 10
         wait_interval: 10
+
+  - name: Restart only what a config change made stale
+    ambari_service_control:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: my_cluster
+        service: all
+        state: restarted_stale
+
+  - name: Rolling restart of the DataNodes, two hosts at a time
+    ambari_service_control:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: my_cluster
+        service: HDFS
+        state: rolling_restarted
+        component: DATANODE
+        batch_size: 2
+        batch_pause: 120
+        batch_failure_tolerance: 1
+        wait_timeout: 7200
+
+  - name: Restart a subset of services in one request
+    ambari_service_control:
+        host: localhost
+        port: 8080
+        username: admin
+        password: admin
+        cluster_name: my_cluster
+        service:
+          - HDFS
+          - YARN
+          - MAPREDUCE2
+          - HIVE
+        state: started
 '''
 
 from ansible.module_utils.basic import AnsibleModule
@@ -104,6 +203,33 @@ else:
 
 import traceback
 
+try:
+    from ansible.module_utils.ambari_client import AmbariError, get, plan_request, post, put
+except ImportError:
+    from module_utils.ambari_client import AmbariError, get, plan_request, post, put
+
+try:
+    from ansible.module_utils.ambari_requests import AmbariRequestError, accepted_request, accepted_request_schedule, \
+        wait_for_request, wait_for_request_schedule
+except ImportError:
+    from module_utils.ambari_requests import AmbariRequestError, accepted_request, accepted_request_schedule, \
+        wait_for_request, wait_for_request_schedule
+
+try:
+    from ansible.module_utils.ambari_metrics import instrument_module, metrics_argument_spec
+except ImportError:
+    from module_utils.ambari_metrics import instrument_module, metrics_argument_spec
+
+try:
+    from ansible.module_utils.ambari_profile import profile_argument_spec, start_profiling
+except ImportError:
+    from module_utils.ambari_profile import profile_argument_spec, start_profiling
+
+try:
+    from ansible.module_utils.ambari_throttle import throttle_argument_spec, throttle_module
+except ImportError:
+    from module_utils.ambari_throttle import throttle_argument_spec, throttle_module
+
 
 def main():
 
@@ -114,15 +240,29 @@ def main():
         username=dict(type='str', default=None, required=True),
         password=dict(type='str', default=None, required=True, no_log=True),
         cluster_name=dict(type='str', default=None, required=True),
-        service=dict(type='str', default=None, required=True),
+        service=dict(type='list', default=None, required=True),
         state=dict(type='str', default=None, required=True,
-                   choices=['started', 'installed']),
+                   choices=['started', 'installed', 'restarted_stale', 'rolling_restarted']),
+        component=dict(type='list', default=None, required=False),
+        batch_size=dict(type='int', default=1, required=False),
+        batch_pause=dict(type='int', default=60, required=False),
+        batch_failure_tolerance=dict(type='int', default=0, required=False),
         retry=dict(type='int', default=60, required=False),
-        wait_interval = dict(type='int', default=10, required=False)
+        wait_interval = dict(type='int', default=10, required=False),
+        wait_timeout=dict(type='int', default=None, required=False),
+        max_failed_tasks=dict(type='int', default=None, required=False),
+        abort_on_failure=dict(type='bool', default=False, required=False),
+        wait=dict(type='bool', default=True, required=False)
     )
 
+    argument_spec.update(metrics_argument_spec())
+    argument_spec.update(profile_argument_spec())
+    argument_spec.update(throttle_argument_spec())
+
     module = AnsibleModule(
-        argument_spec=argument_spec
+        argument_spec=argument_spec,
+        required_if=[('state', 'rolling_restarted', ['component'])],
+        supports_check_mode=True
     )
 
     if not REQUESTS_FOUND:
@@ -139,6 +279,9 @@ def main():
 
 
     p = module.params
+    instrument_module(module, p.get('ambari_metrics'), p.get('ambari_trace_file'))
+    start_profiling(module, p.get('profile_dir'), p.get('profile_top'))
+    throttle_module(module, p.get('ambari_max_rps'), p.get('ambari_max_in_flight'), p.get('ambari_throttle_dir'))
 
     protocol = p.get('protocol')
     host = p.get('host')
@@ -146,37 +289,58 @@ def main():
     username = p.get('username')
     password = p.get('password')
     cluster_name = p.get('cluster_name')
-    service_name = p.get('service')
+    service_names = p.get('service')
     state = p.get('state')
     retry = p.get('retry')
     wait_interval = p.get('wait_interval')
+    # Without an explicit deadline keep the overall bound the retry count used to give
+    wait_timeout = p.get('wait_timeout') or retry * wait_interval
+    max_failed_tasks = p.get('max_failed_tasks')
+    abort_on_failure = p.get('abort_on_failure')
+    component_names = p.get('component')
+    batch_size = p.get('batch_size')
+    batch_pause = p.get('batch_pause')
+    batch_failure_tolerance = p.get('batch_failure_tolerance')
+    wait = p.get('wait')
 
     ambari_url = '{0}://{1}:{2}'.format(protocol, host, port)
-    services_fact = get_all_services_states(
-        ambari_url, username, password, cluster_name)
 
     try:
-        if service_name.lower() == 'all':
+        if state == 'restarted_stale':
+            # restart only the host components running with stale configs
+            process_stale_restart(ambari_url, username, password, module, cluster_name, service_names,
+                                  wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait)
+        elif state == 'rolling_restarted':
+            # restart the components batch_size hosts at a time through a request schedule
+            process_rolling_restart(ambari_url, username, password, module, cluster_name, service_names, component_names,
+                                    batch_size, batch_pause, batch_failure_tolerance, wait_timeout, wait_interval,
+                                    abort_on_failure, wait)
+        elif len(service_names) == 1 and service_names[0].lower() == 'all':
             # start/stop all services
             process_all_services(ambari_url, username, password,
-                                module, cluster_name, state, retry, wait_interval)
+                                module, cluster_name, state, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait)
         else:
-            # process individual services
+            # process the listed services in a single request
             services_fact = get_all_services_states(
                 ambari_url, username, password, cluster_name)
-            process_individual_service(
-                services_fact, ambari_url, username, password, module, cluster_name, service_name, state, retry, wait_interval)
+            process_services(
+                services_fact, ambari_url, username, password, module, cluster_name, service_names, state, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait)
     except requests.ConnectionError as e:
         module.fail_json(
-            msg="Could not connect to Ambari client: " + str(e.message), stacktrace=traceback.format_exc())
+            msg="Could not connect to Ambari client: " + str(e), stacktrace=traceback.format_exc())
+    except AmbariRequestError as e:
+        module.fail_json(msg=e.message, request_id=e.request_id, aborted=e.aborted,
+                         failed_tasks=e.failed_tasks, stacktrace=traceback.format_exc())
+    except AmbariError as e:
+        module.fail_json(msg=e.message, status_code=e.status_code, stacktrace=traceback.format_exc())
     except AssertionError as e:
         module.fail_json(msg=e.message, stacktrace=traceback.format_exc())
     except Exception as e:
         module.fail_json(
-            msg="Ambari client exception occurred: " + str(e.message), stacktrace=traceback.format_exc())
+            msg="Ambari client exception occurred: " + str(e), stacktrace=traceback.format_exc())
 
 
-def process_all_services(ambari_url, username, password, module, cluster_name, state, retry, wait_interval):
+def process_all_services(ambari_url, username, password, module, cluster_name, state, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait=True):
     if state == 'started':
         context_info = 'START'
     else:
@@ -195,34 +359,61 @@ def process_all_services(ambari_url, username, password, module, cluster_name, s
             }
         }
     }
-    r = put(ambari_url, username, password, '/api/v1/clusters/{0}/services'.format(
-        cluster_name), json.dumps(payload))
-    progress, _ = process_ambari_request_response(
-        r, cluster_name, ambari_url, username, password, retry, wait_interval)
-    module.exit_json(changed=True, results=r.content,
-                     request_status=json.dumps(progress))
+    path = '/api/v1/clusters/{0}/services'.format(cluster_name)
+    if module.check_mode:
+        module.exit_json(changed=True, plan=[plan_request('PUT', path, payload)])
+    else:
+        r = put(ambari_url, username, password, path, json.dumps(payload))
+        progress, _ = process_ambari_request_response(
+            r, cluster_name, ambari_url, username, password, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait)
+        module.exit_json(changed=True, request_id=progress.get('Requests').get('id'), results=r.content,
+                         request_status=json.dumps(progress))
 
 
-def process_individual_service(services_fact, ambari_url, username, password, module, cluster_name, service_name, state, retry, wait_interval):
+def process_services(services_fact, ambari_url, username, password, module, cluster_name, service_names, state, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait=True):
+    current_states = {}
     for service_state in services_fact:
         s_name = service_state.get('ServiceInfo').get('service_name')
-        s_state = service_state.get('ServiceInfo').get('state')
+        current_states[str(s_name).lower()] = (s_name, service_state.get('ServiceInfo').get('state'))
+
+    unknown_services = [name for name in service_names if str(name).lower() not in current_states]
+    try:
+        assert len(unknown_services) == 0
+    except AssertionError as e:
+        e.message = 'Services not found in cluster [{0}]: {1}'.format(cluster_name, ', '.join(unknown_services))
+        raise
 
-        if str(service_name).lower() == str(s_name).lower():
-            if s_state.lower is not None and state.lower() == s_state.lower():
-                module.exit_json(
-                    changed=False, msg='No changes in service state')
-            else:
-                # Update state base on the service/state specified
-                r, progress = update_service_state(cluster_name, s_name, state, ambari_url, username, password, retry, wait_interval)
-                module.exit_json(changed=True, results=r.content,
-                                 request_status=json.dumps(progress))
+    # Services already in the desired state are left out of the request
+    to_change = []
+    for name in service_names:
+        s_name, s_state = current_states[str(name).lower()]
+        if (s_state is None or state.lower() != s_state.lower()) and s_name not in to_change:
+            to_change.append(s_name)
+
+    if len(to_change) == 0:
+        module.exit_json(
+            changed=False, msg='No changes in service state')
+    elif module.check_mode:
+        module.exit_json(changed=True, services=to_change, plan=[plan_request(
+            'PUT', service_state_path(cluster_name, to_change), service_state_payload(cluster_name, to_change, state))])
+    else:
+        # One request for all the services, Ambari schedules them in parallel
+        r, progress = update_service_state(cluster_name, to_change, state, ambari_url, username, password, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait)
+        module.exit_json(changed=True, services=to_change, request_id=progress.get('Requests').get('id'), results=r.content,
+                         request_status=json.dumps(progress))
 
 
-def update_service_state(cluster, service_name, state, ambari_url, username, password, retry, wait_interval):
-    payload = {
+def service_state_path(cluster, service_names):
+    if len(service_names) == 1:
+        return '/api/v1/clusters/{0}/services/{1}'.format(cluster, service_names[0].upper())
+    return '/api/v1/clusters/{0}/services?ServiceInfo/service_name.in({1})'.format(
+        cluster, ','.join(name.upper() for name in service_names))
+
+
+def service_state_payload(cluster, service_names, state):
+    return {
         'RequestInfo': {
-            'context': '{0} {1} Service in Cluster[{2}] via API'.format(state, service_name, cluster)
+            'context': '{0} {1} Service in Cluster[{2}] via API'.format(state, ','.join(service_names), cluster)
         },
         'Body': {
             'ServiceInfo':  {
@@ -230,64 +421,158 @@ def update_service_state(cluster, service_name, state, ambari_url, username, pas
             }
         }
     }
-    r = put(ambari_url, username, password, '/api/v1/clusters/{0}/services/{1}'.format(
-        cluster, service_name.upper()), json.dumps(payload))
-    progress, _ = process_ambari_request_response(r, cluster, ambari_url, username, password, retry, wait_interval)
+
+
+def update_service_state(cluster, service_names, state, ambari_url, username, password, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait=True):
+    payload = service_state_payload(cluster, service_names, state)
+    r = put(ambari_url, username, password, service_state_path(cluster, service_names), json.dumps(payload))
+    progress, _ = process_ambari_request_response(r, cluster, ambari_url, username, password, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait)
     return r, progress
 
 
-def process_ambari_request_response(r, cluster_name, ambari_url, user, password, retry, wait_interval):
+def process_stale_restart(ambari_url, username, password, module, cluster_name, service_names, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait=True):
+    stale_components = get_stale_host_components(ambari_url, username, password, cluster_name, service_names)
+    if len(stale_components) == 0:
+        module.exit_json(changed=False, msg='No components with stale configs')
+    else:
+        payload = stale_restart_payload(cluster_name, stale_components)
+        path = '/api/v1/clusters/{0}/requests'.format(cluster_name)
+        if module.check_mode:
+            module.exit_json(changed=True, stale_components=stale_components, plan=[plan_request('POST', path, payload)])
+        else:
+            r = post(ambari_url, username, password, path, json.dumps(payload))
+            progress, _ = process_ambari_request_response(
+                r, cluster_name, ambari_url, username, password, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait)
+            module.exit_json(changed=True, stale_components=stale_components, request_id=progress.get('Requests').get('id'),
+                             results=r.content,
+                             request_status=json.dumps(progress))
+
+
+def get_stale_host_components(ambari_url, user, password, cluster_name, service_names):
+    """Return the hosts of every component with stale configs, as {service: {component: [hosts]}}."""
+    return get_host_components(ambari_url, user, password, cluster_name, service_names,
+                               ['HostRoles/stale_configs=true'], 'host components with stale configs')
+
+
+def get_host_components(ambari_url, user, password, cluster_name, service_names, predicates, description):
+    # One host_components query for the whole cluster, grouped by service and component
+    if not (len(service_names) == 1 and service_names[0].lower() == 'all'):
+        predicates = predicates + ['HostRoles/service_name.in({0})'.format(','.join(name.upper() for name in service_names))]
+    path = '/api/v1/clusters/{0}/host_components?{1}&fields=HostRoles/service_name,HostRoles/component_name,HostRoles/host_name'.format(
+        cluster_name, '&'.join(predicates))
+    result = get(ambari_url, user, password, path)
     try:
-        assert r.status_code == 200 or r.status_code == 201 or r.status_code == 202
+        assert result.status_code == 200
     except AssertionError as e:
-        e.message = 'Coud not process response as: request code {0}, \
-                    request message {1}'.format(r.status_code, r.content)
+        e.message = 'Coud not get {0}: request code {1}, \
+                    request message {2}'.format(description, result.status_code, result.content)
         raise
+    host_components = {}
+    for item in json.loads(result.content)['items']:
+        host_role = item.get('HostRoles')
+        hosts = host_components.setdefault(host_role.get('service_name'), {}).setdefault(host_role.get('component_name'), [])
+        hosts.append(host_role.get('host_name'))
+    return host_components
+
+
+def stale_restart_payload(cluster_name, stale_components):
+    # A single RESTART custom command, filtered down to the stale host components
+    resource_filters = []
+    for service_name in sorted(stale_components):
+        for component_name in sorted(stale_components[service_name]):
+            resource_filters.append({
+                'service_name': service_name,
+                'component_name': component_name,
+                'hosts': ','.join(sorted(stale_components[service_name][component_name]))
+            })
+    return {
+        'RequestInfo': {
+            'command': 'RESTART',
+            'context': 'Restart components with stale configs in Cluster[{0}] via API'.format(cluster_name),
+            'operation_level': {
+                'level': 'CLUSTER',
+                'cluster_name': cluster_name
+            }
+        },
+        'Requests/resource_filters': resource_filters
+    }
 
-    response = json.loads(r.content)
-    request_meta = response.get('Requests')
 
+def process_rolling_restart(ambari_url, username, password, module, cluster_name, service_names, component_names, batch_size, batch_pause, batch_failure_tolerance, wait_timeout, wait_interval, abort_on_failure, wait=True):
+    host_components = get_host_components(
+        ambari_url, username, password, cluster_name, service_names,
+        ['HostRoles/component_name.in({0})'.format(','.join(name.upper() for name in component_names))],
+        'host components to restart')
     try:
-        request_status = request_meta.get('status')
-        assert request_status.upper() == 'ACCEPTED' or request_status.upper() == 'COMPLETED'
+        assert len(host_components) > 0
     except AssertionError as e:
-        e.messge = 'Request sent to ambari server is not accepted or completed. request code: {0}, messge: {1}'.format(
-            r.status_code, r.content)
+        e.message = 'Components not found in cluster [{0}]: {1}'.format(cluster_name, ', '.join(component_names))
         raise
-
-    retry_counter = 0
-    while True and retry_counter < retry:
-        progress, completed = wait_for_request_bounded(
-            cluster_name, ambari_url, user, password, request_meta)
-        if completed:
-            return progress, completed
+    payload = rolling_restart_payload(cluster_name, host_components, batch_size, batch_pause, batch_failure_tolerance)
+    batch_count = len(payload[0]['RequestSchedule']['batch'][0]['requests'])
+    path = '/api/v1/clusters/{0}/request_schedules'.format(cluster_name)
+    if module.check_mode:
+        module.exit_json(changed=True, host_components=host_components, batches=batch_count,
+                         plan=[plan_request('POST', path, payload)])
+    else:
+        r = post(ambari_url, username, password, path, json.dumps(payload))
+        schedule_id = accepted_request_schedule(r)
+        if not wait:
+            module.exit_json(changed=True, host_components=host_components, batches=batch_count,
+                             request_schedule_id=schedule_id)
         else:
-            time.sleep(wait_interval)
-            retry_counter = retry_counter + 1
-
-    raise Exception('Max request waiting retries')
+            schedule = wait_for_request_schedule(cluster_name, ambari_url, username, password, schedule_id, batch_count,
+                                                 wait_timeout, wait_interval, abort_on_failure)
+            module.exit_json(changed=True, host_components=host_components, batches=batch_count,
+                             request_schedule_id=schedule_id,
+                             batch_requests=schedule.get('RequestSchedule').get('batch').get('batch_requests'))
+
+
+def rolling_restart_payload(cluster_name, host_components, batch_size, batch_pause, batch_failure_tolerance):
+    # One batch per batch_size hosts of a component, Ambari runs them in order with batch_pause seconds in between
+    requests = []
+    for service_name in sorted(host_components):
+        for component_name in sorted(host_components[service_name]):
+            hosts = sorted(host_components[service_name][component_name])
+            batches = [hosts[i:i + batch_size] for i in range(0, len(hosts), batch_size)]
+            for index, batch_hosts in enumerate(batches):
+                requests.append({
+                    'order_id': len(requests) + 1,
+                    'type': 'POST',
+                    'uri': '/clusters/{0}/requests'.format(cluster_name),
+                    'RequestBodyInfo': {
+                        'RequestInfo': {
+                            'context': '_PARSE_.ROLLING-RESTART.{0}.{1}.{2}'.format(component_name, index + 1, len(batches)),
+                            'command': 'RESTART'
+                        },
+                        'Requests/resource_filters': [{
+                            'service_name': service_name,
+                            'component_name': component_name,
+                            'hosts': ','.join(batch_hosts)
+                        }]
+                    }
+                })
+    return [{
+        'RequestSchedule': {
+            'batch': [
+                {'requests': requests},
+                {'batch_settings': {
+                    'batch_separation_in_seconds': batch_pause,
+                    'task_failure_tolerance': batch_failure_tolerance
+                }}
+            ]
+        }
+    }]
 
 
-def wait_for_request_bounded(cluster_name, ambari_url, user, password, request_meta):
-    res = get(ambari_url, user, password,
-              '/api/v1/clusters/{0}/requests/{1}'.format(cluster_name, request_meta.get('id')))
-    try:
-        assert res.status_code == 200 or res.status_code == 201
-    except AssertionError as e:
-        e.message = 'Coud not obtain requests status: request code {0}, \
-                    request message {1}'.format(res.status_code, res.content)
-        raise
-    progress = json.loads(res.content)
-    try:
-        assert progress.get('Requests').get(
-            'request_status').upper() != 'FAILED'
-    except AssertionError as e:
-        e.message = 'Request has failed due to: {0}'.format(res.content)
-        raise
-    if progress.get('Requests').get('request_status').upper() == 'COMPLETED':
-        return progress, True
-    else:
-        return progress, False
+def process_ambari_request_response(r, cluster_name, ambari_url, user, password, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure, wait=True):
+    request_meta = accepted_request(r)
+    if not wait:
+        # Fire and forget, the request is tracked later with the ambari_request_wait module
+        return {'Requests': request_meta}, False
+    progress = wait_for_request(
+        cluster_name, ambari_url, user, password, request_meta, wait_timeout, wait_interval, max_failed_tasks, abort_on_failure)
+    return progress, True
 
 
 def get_all_services_states(ambari_url, user, password, cluster_name):
@@ -297,19 +582,5 @@ def get_all_services_states(ambari_url, user, password, cluster_name):
     return service_state['items']
 
 
-def get(ambari_url, user, password, path, connection_timeout=10):
-    headers = {'X-Requested-By': 'ambari'}
-    r = requests.get(ambari_url + path, auth=(user, password),
-                     headers=headers, timeout=connection_timeout)
-    return r
-
-
-def put(ambari_url, user, password, path, data, connection_timeout=10):
-    headers = {'X-Requested-By': 'ambari'}
-    r = requests.put(ambari_url + path, data=data,
-                     auth=(user, password), headers=headers, timeout=connection_timeout)
-    return r
-
-
 if __name__ == '__main__':
     main()
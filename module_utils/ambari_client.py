@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Shared Ambari REST client for the ambari_* modules.
+#
+# All modules talk to Ambari through this file so that every call within one
+# module run reuses the same keep-alive session (one TCP/TLS handshake per
+# Ambari server instead of one per request), the same header and timeout
+# policy and the same error model. Every call waits for the ambari_throttle
+# limits shared with the other forks, then is recorded in ambari_metrics.
+
+import time
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    REQUESTS_FOUND = False
+else:
+    REQUESTS_FOUND = True
+
+try:
+    from ansible.module_utils.ambari_metrics import record_call
+except ImportError:
+    from module_utils.ambari_metrics import record_call
+
+try:
+    from ansible.module_utils.ambari_throttle import throttled
+except ImportError:
+    from module_utils.ambari_throttle import throttled
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_POOL_SIZE = 10
+DEFAULT_HEADERS = {'X-Requested-By': 'ambari'}
+
+_CLIENTS = {}
+
+
+class AmbariError(Exception):
+    """Raised when Ambari answers with an unexpected status code."""
+
+    def __init__(self, message, status_code=None, content=None):
+        super(AmbariError, self).__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.content = content
+
+
+class AmbariClient(object):
+    """Keep-alive, connection pooled client bound to one Ambari server."""
+
+    def __init__(self, ambari_url, user, password, connection_timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE):
+        self.ambari_url = ambari_url
+        self.connection_timeout = connection_timeout
+        self.session = requests.Session()
+        self.session.auth = (user, password)
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.pool_size = 0
+        self.resize_pool(pool_size)
+
+    def resize_pool(self, pool_size):
+        """Grow the connection pool so that pool_size threads can share this client."""
+        if pool_size <= self.pool_size:
+            return
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool_size = pool_size
+
+    def request(self, method, path, data=None, connection_timeout=None, expected=None):
+        if connection_timeout is None:
+            connection_timeout = self.connection_timeout
+        with throttled(self.ambari_url):
+            started = time.time()
+            try:
+                r = self.session.request(method, self.ambari_url + path, data=data,
+                                         timeout=connection_timeout)
+            except requests.RequestException:
+                record_call(method, path, None, time.time() - started, len(data or ''), 0)
+                raise
+        record_call(method, path, r.status_code, time.time() - started, len(data or ''), len(r.content),
+                    transport_retries(r))
+        if expected is not None:
+            assert_status(r, expected)
+        return r
+
+    def get(self, path, connection_timeout=None, expected=None):
+        return self.request('GET', path, connection_timeout=connection_timeout, expected=expected)
+
+    def put(self, path, data, connection_timeout=None, expected=None):
+        return self.request('PUT', path, data=data, connection_timeout=connection_timeout, expected=expected)
+
+    def post(self, path, data, connection_timeout=None, expected=None):
+        return self.request('POST', path, data=data, connection_timeout=connection_timeout, expected=expected)
+
+    def delete(self, path, connection_timeout=None, expected=None):
+        return self.request('DELETE', path, connection_timeout=connection_timeout, expected=expected)
+
+    def close(self):
+        self.session.close()
+
+
+def transport_retries(response):
+    """Number of retries urllib3 made for this response, when the adapter is configured to retry."""
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    history = getattr(retries, 'history', None)
+    return len(history) if history else 0
+
+
+def assert_status(response, expected):
+    if str(response.status_code) not in [str(code) for code in expected]:
+        raise AmbariError('Expected response code unmatch: Exp[{0}], Actual[{1}] \n Message: {2}'.format(
+            expected, response.status_code, response.content), response.status_code, response.content)
+
+
+def plan_request(method, path, body=None):
+    """Describe a write request the way check mode reports it instead of sending it."""
+    entry = {'method': method, 'path': path}
+    if body is not None:
+        entry['body'] = body
+    return entry
+
+
+def get_client(ambari_url, user, password, connection_timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE):
+    """Return the shared client for this server/credential pair, creating it on first use."""
+    key = (ambari_url, user, password)
+    client = _CLIENTS.get(key)
+    if client is None:
+        client = AmbariClient(ambari_url, user, password, connection_timeout, pool_size)
+        _CLIENTS[key] = client
+    else:
+        client.resize_pool(pool_size)
+    return client
+
+
+def close_clients():
+    for client in _CLIENTS.values():
+        client.close()
+    _CLIENTS.clear()
+
+
+def get(ambari_url, user, password, path, connection_timeout=DEFAULT_TIMEOUT):
+    return get_client(ambari_url, user, password).get(path, connection_timeout)
+
+
+def put(ambari_url, user, password, path, data, connection_timeout=DEFAULT_TIMEOUT):
+    return get_client(ambari_url, user, password).put(path, data, connection_timeout)
+
+
+def post(ambari_url, user, password, path, data, connection_timeout=DEFAULT_TIMEOUT):
+    return get_client(ambari_url, user, password).post(path, data, connection_timeout)
+
+
+def delete(ambari_url, user, password, path, connection_timeout=DEFAULT_TIMEOUT):
+    return get_client(ambari_url, user, password).delete(path, connection_timeout)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# On-disk snapshot cache for Ambari cluster configurations.
+#
+# A configuration version in Ambari is immutable once it has a (type, tag)
+# pair, so the body fetched for a tag can be reused for as long as the cluster
+# desired_configs still point at that tag. Entries are stored as one JSON file
+# per cluster/type/tag, written atomically (temp file + rename) so that several
+# Ansible forks can share the same cache directory, and evicted least recently
+# used first once the cache grows beyond its size bound. The cache size is
+# measured once and then kept as a running estimate, so the cache tree is only
+# walked again when the estimate goes over the bound. Eviction then frees a
+# margin below the bound so that a full cache is not walked on every write.
+
+import json
+import os
+import tempfile
+import threading
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+EVICT_LOW_WATER = 0.9
+
+
+def read_json(path):
+    """Return the JSON document stored at path, or None if it is missing or unreadable."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_json_atomic(path, data):
+    """Write data as JSON through a temp file and rename so readers never see a partial file."""
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ConfigCache(object):
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, read_only=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Check mode reads the cache but leaves the directory untouched
+        self.read_only = read_only
+        self.size = None
+        self.lock = threading.Lock()
+
+    def path(self, cluster_name, config_type, config_tag):
+        return os.path.join(self.cache_dir, quote(cluster_name, safe=''), quote(config_type, safe=''),
+                            quote(config_tag, safe='') + '.json')
+
+    def get(self, cluster_name, config_type, config_tag):
+        """Return the cached configuration item or None on a cache miss."""
+        path = self.path(cluster_name, config_type, config_tag)
+        config = read_json(path)
+        if config is None or self.read_only:
+            return config
+        try:
+            # Touch the entry so that eviction sees it as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return config
+
+    def put(self, cluster_name, config_type, config_tag, config):
+        """Store a configuration item, return False if it could not be written, e.g. on a full disk."""
+        if self.read_only:
+            return False
+        path = self.path(cluster_name, config_type, config_tag)
+        try:
+            write_json_atomic(path, config)
+            size = os.path.getsize(path)
+        except (IOError, OSError):
+            return False
+        with self.lock:
+            if self.size is None:
+                # Includes the entry just written
+                self.size = sum(entry[1] for entry in self.entries())
+            else:
+                self.size = self.size + size
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+        return True
+
+    def entries(self):
+        """(mtime, size, path) of every cache entry."""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Removed by another fork in the meantime
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache is back under its low water mark."""
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(entry[1] for entry in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes * EVICT_LOW_WATER:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total = total - size
+            self.size = total
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# Per-call accounting of the Ambari API calls made during one module run.
+#
+# AmbariClient records every HTTP call here: method, path template, status,
+# latency, bytes sent and received and transport retries, the request pollers
+# record the time they spend sleeping and the throttle the time calls waited. Modules can return a summary
+# as `ambari_metrics` and append every call as a JSON line to a trace file
+# shared by the whole playbook run.
+
+import json
+import math
+import os
+import re
+import threading
+import time
+import warnings
+
+TEMPLATE_SEGMENTS = {
+    'clusters': '{cluster_name}',
+    'hosts': '{host_name}',
+    'services': '{service_name}',
+    'components': '{component_name}',
+    'host_components': '{component_name}',
+    'configurations': '{config_type}'
+}
+
+_NUMERIC = re.compile(r'^\d+$')
+
+_LOCK = threading.Lock()
+_CALLS = []
+_STATE = {'started': time.time(), 'sleep_s': 0.0, 'throttle_s': 0.0, 'module': None, 'trace_file': None, 'trace': None,
+          'warn': None}
+
+
+def metrics_argument_spec():
+    """Options shared by every module to report the API calls they made."""
+    return dict(
+        ambari_metrics=dict(type='bool', default=False, required=False),
+        ambari_trace_file=dict(type='path', default=None, required=False)
+    )
+
+
+def path_template(path):
+    """/api/v1/clusters/c1/hosts/h1?fields=x -> /api/v1/clusters/{cluster_name}/hosts/{host_name}"""
+    segments = path.split('?', 1)[0].split('/')
+    for index in range(1, len(segments)):
+        if _NUMERIC.match(segments[index]):
+            segments[index] = '{id}'
+        elif segments[index - 1] in TEMPLATE_SEGMENTS:
+            segments[index] = TEMPLATE_SEGMENTS[segments[index - 1]]
+    return '/'.join(segments)
+
+
+def configure(module_name=None, trace_file=None, warn=None):
+    """Start accounting for a module run, appending call traces to trace_file if set.
+
+    warn is called with the reason when the trace file cannot be written, tracing is then off for the rest of the run.
+    """
+    with _LOCK:
+        del _CALLS[:]
+        _STATE.update(started=time.time(), sleep_s=0.0, throttle_s=0.0, module=module_name, trace_file=trace_file,
+                      warn=warn)
+        close_trace()
+
+
+def record_call(method, path, status, latency, bytes_sent, bytes_received, retries=0):
+    call = {
+        'method': method,
+        'path_template': path_template(path),
+        'status': status,
+        'latency_ms': round(latency * 1000, 3),
+        'bytes_sent': bytes_sent,
+        'bytes_received': bytes_received,
+        'retries': retries
+    }
+    with _LOCK:
+        _CALLS.append(call)
+        if _STATE['trace_file'] is not None:
+            try:
+                write_trace(dict(call, ts=time.time(), module=_STATE['module'], pid=os.getpid(), path=path))
+            except (IOError, OSError) as e:
+                # Tracing must not fail the module, give up on it after the first error
+                message = 'Ambari call tracing disabled, cannot write {0}: {1}'.format(_STATE['trace_file'], str(e))
+                _STATE['trace_file'] = None
+                close_trace()
+                (_STATE['warn'] or warnings.warn)(message)
+
+
+def record_sleep(seconds):
+    with _LOCK:
+        _STATE['sleep_s'] = _STATE['sleep_s'] + seconds
+
+
+def record_throttle(seconds):
+    with _LOCK:
+        _STATE['throttle_s'] = _STATE['throttle_s'] + seconds
+
+
+def write_trace(entry):
+    # One write per line on a file opened for appending, so forks sharing the file do not interleave lines
+    if _STATE['trace'] is None:
+        directory = os.path.dirname(_STATE['trace_file'])
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        _STATE['trace'] = open(_STATE['trace_file'], 'a')
+    _STATE['trace'].write(json.dumps(entry, sort_keys=True) + '\n')
+    _STATE['trace'].flush()
+
+
+def close_trace():
+    if _STATE['trace'] is not None:
+        try:
+            _STATE['trace'].close()
+        except (IOError, OSError):
+            pass
+        _STATE['trace'] = None
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if len(values) == 0:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def latency_summary(calls):
+    latencies = sorted(call['latency_ms'] for call in calls)
+    return {
+        'calls': len(calls),
+        'errors': len([call for call in calls if call['status'] is None or call['status'] >= 400]),
+        'retries': sum(call['retries'] for call in calls),
+        'bytes_sent': sum(call['bytes_sent'] for call in calls),
+        'bytes_received': sum(call['bytes_received'] for call in calls),
+        'latency_ms_total': round(sum(latencies), 3),
+        'latency_ms_p50': percentile(latencies, 50),
+        'latency_ms_p90': percentile(latencies, 90),
+        'latency_ms_p99': percentile(latencies, 99),
+        'latency_ms_max': latencies[-1] if latencies else None
+    }
+
+
+def summary():
+    """Totals and latency percentiles of the calls made so far, overall and per method and path template."""
+    with _LOCK:
+        calls = list(_CALLS)
+        wall_s = time.time() - _STATE['started']
+        sleep_s = _STATE['sleep_s']
+        throttle_s = _STATE['throttle_s']
+    by_endpoint = {}
+    for call in calls:
+        by_endpoint.setdefault('{0} {1}'.format(call['method'], call['path_template']), []).append(call)
+    result = latency_summary(calls)
+    result.update({
+        'wall_s': round(wall_s, 3),
+        'poll_sleep_s': round(sleep_s, 3),
+        'throttle_wait_s': round(throttle_s, 3),
+        'endpoints': dict((endpoint, latency_summary(endpoint_calls)) for endpoint, endpoint_calls in by_endpoint.items())
+    })
+    return result
+
+
+def instrument_module(module, report, trace_file):
+    """Reset the accounting for this run and, if report is set, add the summary to the module result."""
+    configure(getattr(module, '_name', None), trace_file, getattr(module, 'warn', None))
+    if not report:
+        return
+    exit_json = module.exit_json
+    fail_json = module.fail_json
+
+    def exit_with_metrics(**kwargs):
+        kwargs['ambari_metrics'] = summary()
+        exit_json(**kwargs)
+
+    def fail_with_metrics(**kwargs):
+        kwargs['ambari_metrics'] = summary()
+        fail_json(**kwargs)
+
+    module.exit_json = exit_with_metrics
+    module.fail_json = fail_with_metrics
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Opt-in profiling of a module run.
+#
+# AnsiballZ runs the module as a throwaway process on the target, which leaves
+# no room for an external profiler. When a profile directory is given, through
+# the profile_dir option or the AMBARI_MODULE_PROFILE_DIR environment variable,
+# the rest of the run after argument parsing executes under cProfile. The raw
+# profile and a top-N summary are saved in that directory on exit, and their
+# paths are returned in the module result under `profile`.
+
+import os
+import time
+
+try:
+    import cProfile
+    import pstats
+except ImportError:
+    PROFILE_FOUND = False
+else:
+    PROFILE_FOUND = True
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+PROFILE_DIR_ENV = 'AMBARI_MODULE_PROFILE_DIR'
+DEFAULT_PROFILE_TOP = 30
+
+
+def profile_argument_spec():
+    """Options shared by every module to profile its run."""
+    return dict(
+        profile_dir=dict(type='path', default=None, required=False),
+        profile_top=dict(type='int', default=DEFAULT_PROFILE_TOP, required=False)
+    )
+
+
+def profile_paths(profile_dir, module_name):
+    base = os.path.join(profile_dir, '{0}-{1}-{2}'.format(module_name or 'ambari', int(time.time() * 1000), os.getpid()))
+    return base + '.prof', base + '.txt'
+
+
+def save_profile(profiler, profile_dir, module_name, top):
+    """Write the raw profile and a summary of the top functions by cumulative time, return both paths."""
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+    profile_path, summary_path = profile_paths(profile_dir, module_name)
+    profiler.dump_stats(profile_path)
+    stream = StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(top)
+    stats.sort_stats('tottime').print_stats(top)
+    with open(summary_path, 'w') as f:
+        f.write(stream.getvalue())
+    return {'path': profile_path, 'summary_path': summary_path}
+
+
+def start_profiling(module, profile_dir=None, top=DEFAULT_PROFILE_TOP):
+    """Profile the rest of the module run when profile_dir or the environment variable is set."""
+    profile_dir = profile_dir or os.environ.get(PROFILE_DIR_ENV)
+    if not profile_dir or not PROFILE_FOUND:
+        return
+    module_name = getattr(module, '_name', None)
+    exit_json = module.exit_json
+    fail_json = module.fail_json
+    profiler = cProfile.Profile()
+
+    def finish(kwargs):
+        profiler.disable()
+        try:
+            kwargs['profile'] = save_profile(profiler, profile_dir, module_name, top)
+        except (IOError, OSError) as e:
+            kwargs['profile'] = {'error': 'Could not save the profile: {0}'.format(e)}
+
+    def exit_with_profile(**kwargs):
+        finish(kwargs)
+        exit_json(**kwargs)
+
+    def fail_with_profile(**kwargs):
+        finish(kwargs)
+        fail_json(**kwargs)
+
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this process
+        return
+    module.exit_json = exit_with_profile
+    module.fail_json = fail_with_profile
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Regex replacement engine for ambari_cluster_config.
+#
+# Every pattern is compiled once per module run. All the rules of one property
+# are combined into a single alternation so that a multi-hundred-KB value such
+# as a `content` template is scanned once, no matter how many rules it has.
+# The engine reports which rules matched, so callers can tell an actual
+# replacement apart from a value that merely differs. Rules whose patterns
+# refer back to their own groups are applied one by one instead, since the
+# group numbers change once the patterns are combined.
+
+import re
+
+MAX_CACHED_PATTERNS = 256
+
+_GROUP_REFERENCE = re.compile(r'\\\\|\\g<(\w+)>|\\(\d{1,2})')
+# Numbered and named backreferences and conditional groups inside a pattern
+_PATTERN_REFERENCE = re.compile(r'\\\\|\\[1-9]|\(\?P=|\(\?\(')
+
+_COMPILED = {}
+
+
+def compile_pattern(pattern, flags=0):
+    key = (pattern, flags)
+    compiled = _COMPILED.get(key)
+    if compiled is None:
+        if len(_COMPILED) >= MAX_CACHED_PATTERNS:
+            _COMPILED.clear()
+        compiled = re.compile(pattern, flags)
+        _COMPILED[key] = compiled
+    return compiled
+
+
+def shift_template(template, offset):
+    """Renumber the group references of a replacement template by offset, \\0 becomes \\g<offset>."""
+    def shift(m):
+        name = m.group(1) if m.group(1) is not None else m.group(2)
+        if name is None or not name.isdigit():
+            return m.group(0)
+        return '\\g<{0}>'.format(int(name) + offset)
+    return _GROUP_REFERENCE.sub(shift, template)
+
+
+def has_backreference(pattern):
+    return any(m.group(0) != '\\\\' for m in _PATTERN_REFERENCE.finditer(pattern))
+
+
+def combine_rules(rules, line_mode):
+    """Build one alternation out of (pattern, replacement) rules.
+
+    Returns the compiled pattern and, per rule, the wrapping group name and the shifted template.
+    Raises re.error when the rules cannot be combined (e.g. duplicate group names).
+    """
+    flags = re.MULTILINE if line_mode else 0
+    alternatives = []
+    templates = {}
+    offset = 1
+    for index, (pattern, replacement) in enumerate(rules):
+        compiled = compile_pattern(pattern, flags)
+        name = '_rule{0}'.format(index)
+        alternatives.append('(?P<{0}>{1})'.format(name, pattern))
+        templates[name] = (index, shift_template(replacement, offset))
+        offset = offset + compiled.groups + 1
+    combined = '|'.join(alternatives)
+    if line_mode:
+        # The whole line is rewritten when any rule matches somewhere on it
+        combined = '^[^\\n]*?(?:{0})[^\\n]*$'.format(combined)
+    return compile_pattern(combined, flags), templates
+
+
+def apply_regex_rules(value, rules, line_mode=False):
+    """Apply (pattern, replacement) rules to value in a single pass.
+
+    In line mode a matching line is replaced as a whole by the expanded replacement, other lines are left untouched.
+    Returns the new value and the sorted indexes of the rules that matched.
+    """
+    matched = set()
+    if any(has_backreference(pattern) for pattern, _ in rules):
+        return apply_regex_rules_sequentially(value, rules, line_mode)
+    try:
+        combined, templates = combine_rules(rules, line_mode)
+    except re.error:
+        return apply_regex_rules_sequentially(value, rules, line_mode)
+
+    def replace(m):
+        index, template = templates[m.lastgroup]
+        matched.add(index)
+        return m.expand(template)
+
+    result = combined.sub(replace, value)
+    return result, sorted(matched)
+
+
+def apply_regex_rules_sequentially(value, rules, line_mode=False):
+    flags = re.MULTILINE if line_mode else 0
+    matched = []
+    for index, (pattern, replacement) in enumerate(rules):
+        if line_mode:
+            pattern = '^[^\\n]*?(?:{0})[^\\n]*$'.format(pattern)
+        value, count = compile_pattern(pattern, flags).subn(replacement, value)
+        if count > 0:
+            matched.append(index)
+    return value, matched
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+#
+# Tracking of asynchronous Ambari requests (/clusters/{c}/requests/{id}).
+#
+# Polling starts with short intervals so that quick requests return quickly,
+# backs off exponentially with jitter up to a maximum interval, and uses the
+# request progress_percent to poll again around the time the request is
+# expected to finish. Waiting is bounded by a wall-clock deadline.
+#
+# Rolling operations are submitted as request schedules
+# (/clusters/{c}/request_schedules/{id}): Ambari runs the batches one after the
+# other, and the schedule is tracked the same way until every batch is done.
+
+import json
+import random
+import threading
+import time
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+except ImportError:
+    FUTURES_FOUND = False
+else:
+    FUTURES_FOUND = True
+
+try:
+    from ansible.module_utils.ambari_client import AmbariError, assert_status, delete, get, get_client, put
+except ImportError:
+    from module_utils.ambari_client import AmbariError, assert_status, delete, get, get_client, put
+
+try:
+    from ansible.module_utils.ambari_metrics import record_sleep
+except ImportError:
+    from module_utils.ambari_metrics import record_sleep
+
+MIN_POLL_INTERVAL = 1
+BACKOFF_FACTOR = 1.5
+JITTER = 0.2
+
+# Partial response for status polls, the full resource lists every task of the request
+REQUEST_STATUS_FIELDS = ','.join([
+    'Requests/id',
+    'Requests/request_status',
+    'Requests/progress_percent',
+    'Requests/task_count',
+    'Requests/queued_task_count',
+    'Requests/completed_task_count',
+    'Requests/failed_task_count',
+    'Requests/aborted_task_count',
+    'Requests/timed_out_task_count'
+])
+FAILED_TASK_STATUSES = 'FAILED,ABORTED,TIMEDOUT'
+# Every status a request can end in besides COMPLETED
+FAILED_REQUEST_STATUSES = ['FAILED', 'ABORTED', 'TIMEDOUT', 'SKIPPED_FAILED']
+TASK_DETAIL_FIELDS = 'Tasks/id,Tasks/host_name,Tasks/role,Tasks/command,Tasks/status,Tasks/stderr'
+STDERR_SUMMARY_LENGTH = 1000
+TASK_STATUS_FIELDS = 'Tasks/id,Tasks/host_name,Tasks/role,Tasks/status'
+
+REQUEST_SCHEDULE_FIELDS = 'RequestSchedule/id,RequestSchedule/status,RequestSchedule/batch/batch_requests'
+# Ambari stops running batches once the schedule leaves SCHEDULED without being COMPLETED
+SCHEDULE_FAILED_STATUSES = ['ABORTED', 'PAUSED', 'DISABLED']
+
+
+class AmbariRequestError(AmbariError):
+    """Raised when an Ambari request fails, times out or has too many failed tasks."""
+
+    def __init__(self, message, request_id, failed_tasks, aborted=False):
+        super(AmbariRequestError, self).__init__(message)
+        self.request_id = request_id
+        self.failed_tasks = failed_tasks
+        self.aborted = aborted
+
+
+def accepted_request(r):
+    """Return the Requests block of a response to a request submission, asserting Ambari accepted it."""
+    assert_status(r, ['200', '201', '202'])
+    response = json.loads(r.content)
+    request_meta = response.get('Requests')
+    try:
+        request_status = request_meta.get('status')
+        assert request_status.upper() == 'ACCEPTED' or request_status.upper() == 'COMPLETED'
+    except AssertionError as e:
+        e.message = 'Request sent to ambari server is not accepted or completed. request code: {0}, message: {1}'.format(
+            r.status_code, r.content)
+        raise
+    return request_meta
+
+
+def get_failed_tasks(cluster_name, ambari_url, user, password, request_id):
+    """Task details are only fetched once a request has failed, and only for its failed tasks."""
+    res = get(ambari_url, user, password,
+              '/api/v1/clusters/{0}/requests/{1}/tasks?Tasks/status.in({2})&fields={3}'.format(
+                  cluster_name, request_id, FAILED_TASK_STATUSES, TASK_DETAIL_FIELDS))
+    if res.status_code != 200:
+        return []
+    failed_tasks = []
+    for item in json.loads(res.content).get('items', []):
+        task = item.get('Tasks')
+        if task.get('stderr'):
+            # Keep the tail of stderr, it is where the actual error usually is
+            task['stderr'] = task['stderr'][-STDERR_SUMMARY_LENGTH:]
+        failed_tasks.append(task)
+    return failed_tasks
+
+
+def get_request_tasks(cluster_name, ambari_url, user, password, request_id, unfinished_only=False):
+    """Return the host, role and status of every task of a request, or only of those not completed yet."""
+    res = get(ambari_url, user, password, '/api/v1/clusters/{0}/requests/{1}/tasks?fields={2}{3}'.format(
+        cluster_name, request_id, TASK_STATUS_FIELDS, '&Tasks/status!=COMPLETED' if unfinished_only else ''))
+    assert_status(res, ['200'])
+    return [item.get('Tasks') for item in json.loads(res.content).get('items', [])]
+
+
+def abort_request(cluster_name, ambari_url, user, password, request_id, reason):
+    r = put(ambari_url, user, password, '/api/v1/clusters/{0}/requests/{1}'.format(cluster_name, request_id),
+            json.dumps({'Requests': {'request_status': 'ABORTED', 'abort_reason': reason}}))
+    assert_status(r, ['200', '201', '202'])
+
+
+def failed_task_count(progress):
+    request = progress.get('Requests')
+    return (request.get('failed_task_count') or 0) + (request.get('aborted_task_count') or 0) + \
+        (request.get('timed_out_task_count') or 0)
+
+
+def request_failure(cluster_name, ambari_url, user, password, request_id, message, abort_on_failure):
+    """Build the error for a failed request, aborting the request on Ambari first if asked to."""
+    aborted = False
+    if abort_on_failure:
+        abort_request(cluster_name, ambari_url, user, password, request_id, message)
+        aborted = True
+    failed_tasks = get_failed_tasks(cluster_name, ambari_url, user, password, request_id)
+    return AmbariRequestError('{0}, failed tasks: {1}'.format(message, json.dumps(failed_tasks)),
+                              request_id, failed_tasks, aborted)
+
+
+def wait_for_request_bounded(cluster_name, ambari_url, user, password, request_meta):
+    res = get(ambari_url, user, password,
+              '/api/v1/clusters/{0}/requests/{1}?fields={2}'.format(cluster_name, request_meta.get('id'), REQUEST_STATUS_FIELDS))
+    try:
+        assert res.status_code == 200 or res.status_code == 201
+    except AssertionError as e:
+        e.message = 'Coud not obtain requests status: request code {0}, \
+                    request message {1}'.format(res.status_code, res.content)
+        raise
+    progress = json.loads(res.content)
+    if progress.get('Requests').get('request_status').upper() in FAILED_REQUEST_STATUSES:
+        raise request_failure(cluster_name, ambari_url, user, password, request_meta.get('id'),
+                              'Request has failed due to: {0}'.format(res.content), False)
+    if progress.get('Requests').get('request_status').upper() == 'COMPLETED':
+        return progress, True
+    else:
+        return progress, False
+
+
+def next_poll_interval(interval, elapsed, progress_percent, max_interval, min_interval=MIN_POLL_INTERVAL):
+    """Back off from the previous interval, but poll earlier if the progress so far says the request is nearly done."""
+    interval = interval * BACKOFF_FACTOR
+    if progress_percent is not None and 0 < progress_percent < 100 and elapsed > 0:
+        remaining = elapsed * (100.0 - progress_percent) / progress_percent
+        interval = min(interval, max(remaining / 2, min_interval))
+    return min(max(interval, min_interval), max_interval)
+
+
+def pause(seconds, stop=None):
+    """Sleep between two polls, return True as soon as the stop event is set."""
+    record_sleep(seconds)
+    if stop is None:
+        time.sleep(seconds)
+        return False
+    return stop.wait(seconds)
+
+
+def wait_for_request(cluster_name, ambari_url, user, password, request_meta, wait_timeout, max_interval,
+                     max_failed_tasks=None, abort_on_failure=False, stop=None, on_progress=None):
+    """Poll a request until it completes.
+
+    Raises AmbariRequestError once wait_timeout seconds have passed, or as soon as more than max_failed_tasks
+    tasks failed, aborting the request on Ambari first when abort_on_failure is set. When the stop event is set
+    polling ends early and the last status is returned. on_progress is called with every status polled.
+    """
+    started = time.time()
+    deadline = started + wait_timeout
+    interval = min(MIN_POLL_INTERVAL, max_interval) / BACKOFF_FACTOR
+    while True:
+        progress, completed = wait_for_request_bounded(
+            cluster_name, ambari_url, user, password, request_meta)
+        if on_progress is not None:
+            on_progress(progress)
+        if completed or (stop is not None and stop.is_set()):
+            return progress
+        if max_failed_tasks is not None and failed_task_count(progress) > max_failed_tasks:
+            raise request_failure(cluster_name, ambari_url, user, password, request_meta.get('id'),
+                                  'Request {0} has {1} failed tasks, more than the {2} tolerated'.format(
+                                      request_meta.get('id'), failed_task_count(progress), max_failed_tasks),
+                                  abort_on_failure)
+        now = time.time()
+        if now >= deadline:
+            raise request_failure(cluster_name, ambari_url, user, password, request_meta.get('id'),
+                                  'Request {0} did not complete within {1} seconds, last status: {2}'.format(
+                                      request_meta.get('id'), wait_timeout, json.dumps(progress.get('Requests'))),
+                                  abort_on_failure)
+        interval = next_poll_interval(interval, now - started, progress.get('Requests').get('progress_percent'),
+                                      max_interval, min(MIN_POLL_INTERVAL, max_interval))
+        sleep = max(min(interval * random.uniform(1 - JITTER, 1 + JITTER), deadline - now), 0)
+        if pause(sleep, stop):
+            return progress
+
+
+def wait_for_requests(cluster_name, ambari_url, user, password, request_ids, wait_timeout, max_interval,
+                      max_failed_tasks=None, abort_on_failure=False, parallelism=10, on_progress=None):
+    """Poll several requests concurrently over the shared connection pool until all of them completed.
+
+    Returns the last status of every request by id. The first failure stops the other pollers and is raised.
+    """
+    return wait_for_all(cluster_name, ambari_url, user, password, request_ids, [], wait_timeout, max_interval,
+                        max_failed_tasks, abort_on_failure, parallelism, on_progress)[0]
+
+
+def accepted_request_schedule(r):
+    """Return the id of the request schedule created by a request_schedules submission."""
+    assert_status(r, ['200', '201', '202'])
+    return json.loads(r.content)['resources'][0]['RequestSchedule']['id']
+
+
+def batch_requests(schedule):
+    return (schedule.get('RequestSchedule').get('batch') or {}).get('batch_requests') or []
+
+
+def failed_batch_request(schedule):
+    for batch_request in batch_requests(schedule):
+        if str(batch_request.get('request_status')).upper() in FAILED_REQUEST_STATUSES:
+            return batch_request
+    return None
+
+
+def schedule_failure(cluster_name, ambari_url, user, password, schedule, message, abort_on_failure):
+    """Build the error for a failed schedule, deleting the remaining batches and aborting the running one if asked to."""
+    schedule_id = schedule.get('RequestSchedule').get('id')
+    aborted = False
+    if abort_on_failure:
+        r = delete(ambari_url, user, password, '/api/v1/clusters/{0}/request_schedules/{1}'.format(cluster_name, schedule_id))
+        assert_status(r, ['200', '202'])
+        for batch_request in batch_requests(schedule):
+            if batch_request.get('request_id') is not None and \
+                    str(batch_request.get('request_status')).upper() in ['PENDING', 'QUEUED', 'IN_PROGRESS']:
+                abort_request(cluster_name, ambari_url, user, password, batch_request.get('request_id'), message)
+        aborted = True
+    failed = failed_batch_request(schedule)
+    request_id = failed.get('request_id') if failed is not None else None
+    failed_tasks = []
+    if request_id is not None:
+        failed_tasks = get_failed_tasks(cluster_name, ambari_url, user, password, request_id)
+    return AmbariRequestError('{0}, failed tasks: {1}'.format(message, json.dumps(failed_tasks)),
+                              request_id, failed_tasks, aborted)
+
+
+def wait_for_request_schedule(cluster_name, ambari_url, user, password, schedule_id, batch_count, wait_timeout,
+                              max_interval, abort_on_failure=False, stop=None):
+    """Poll a request schedule until all of its batches completed.
+
+    Raises AmbariRequestError when Ambari stops the schedule (e.g. the task failure tolerance was exceeded) or once
+    wait_timeout seconds have passed, deleting the schedule first on timeout when abort_on_failure is set. Without
+    batch_count, the number of batches is read from the schedule. When the stop event is set polling ends early
+    and the last status is returned.
+    """
+    started = time.time()
+    deadline = started + wait_timeout
+    interval = min(MIN_POLL_INTERVAL, max_interval) / BACKOFF_FACTOR
+    while True:
+        res = get(ambari_url, user, password, '/api/v1/clusters/{0}/request_schedules/{1}?fields={2}'.format(
+            cluster_name, schedule_id, REQUEST_SCHEDULE_FIELDS))
+        try:
+            assert res.status_code == 200
+        except AssertionError as e:
+            e.message = 'Coud not obtain request schedule status: request code {0}, \
+                        request message {1}'.format(res.status_code, res.content)
+            raise
+        schedule = json.loads(res.content)
+        status = str(schedule.get('RequestSchedule').get('status')).upper()
+        if status == 'COMPLETED' or (stop is not None and stop.is_set()):
+            return schedule
+        if status in SCHEDULE_FAILED_STATUSES:
+            raise schedule_failure(cluster_name, ambari_url, user, password, schedule,
+                                   'Request schedule {0} stopped with status {1}'.format(schedule_id, status), False)
+        now = time.time()
+        if now >= deadline:
+            raise schedule_failure(cluster_name, ambari_url, user, password, schedule,
+                                   'Request schedule {0} did not complete within {1} seconds'.format(
+                                       schedule_id, wait_timeout), abort_on_failure)
+        completed = len([b for b in batch_requests(schedule) if str(b.get('request_status')).upper() == 'COMPLETED'])
+        batches = batch_count or len(batch_requests(schedule))
+        interval = next_poll_interval(interval, now - started, 100.0 * completed / max(batches, 1),
+                                      max_interval, min(MIN_POLL_INTERVAL, max_interval))
+        sleep = max(min(interval * random.uniform(1 - JITTER, 1 + JITTER), deadline - now), 0)
+        if pause(sleep, stop):
+            return schedule
+
+
+def wait_for_all(cluster_name, ambari_url, user, password, request_ids, schedule_ids, wait_timeout, max_interval,
+                 max_failed_tasks=None, abort_on_failure=False, parallelism=10, on_progress=None):
+    """Poll requests and request schedules concurrently over the shared connection pool until all of them completed.
+
+    Returns the last status of every request and of every schedule by id. The first failure stops the other
+    pollers and is raised.
+    """
+    parallelism = max(min(parallelism, len(request_ids) + len(schedule_ids)), 1)
+    get_client(ambari_url, user, password, pool_size=parallelism)
+    stop = threading.Event()
+    results = ({}, {})
+    pool = ThreadPoolExecutor(max_workers=parallelism)
+    try:
+        futures = {}
+        for request_id in request_ids:
+            futures[pool.submit(wait_for_request, cluster_name, ambari_url, user, password, {'id': request_id},
+                                wait_timeout, max_interval, max_failed_tasks, abort_on_failure, stop,
+                                on_progress)] = (0, request_id)
+        for schedule_id in schedule_ids:
+            futures[pool.submit(wait_for_request_schedule, cluster_name, ambari_url, user, password, schedule_id,
+                                None, wait_timeout, max_interval, abort_on_failure, stop)] = (1, schedule_id)
+        for future in as_completed(futures):
+            kind, resource_id = futures[future]
+            try:
+                results[kind][resource_id] = future.result()
+            except Exception:
+                stop.set()
+                raise
+    finally:
+        pool.shutdown(wait=True)
+    return results
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Host-local rate limit and concurrency cap on the calls made to one Ambari
+# server, shared by every module process running on the host.
+#
+# With many forks, or several plays at once, each module instance only sees its
+# own calls. The limits are therefore kept in lock files per Ambari server:
+# a token bucket of ambari_max_rps requests per second, stored in a small
+# state file updated under flock, and ambari_max_in_flight slot files of which
+# a call must hold one (flock LOCK_NB) while it is in flight. The kernel drops
+# the flocks of a process that dies, so a killed fork never leaks its slot.
+
+import errno
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    FCNTL_FOUND = False
+else:
+    FCNTL_FOUND = True
+
+try:
+    from ansible.module_utils.ambari_metrics import record_throttle
+except ImportError:
+    from module_utils.ambari_metrics import record_throttle
+
+MAX_RPS_ENV = 'AMBARI_MAX_RPS'
+MAX_IN_FLIGHT_ENV = 'AMBARI_MAX_IN_FLIGHT'
+THROTTLE_DIR_ENV = 'AMBARI_THROTTLE_DIR'
+SLOT_POLL_INTERVAL = 0.02
+
+_STATE = {'max_rps': None, 'max_in_flight': None, 'lock_dir': None}
+
+
+def throttle_argument_spec():
+    """Options shared by every module to limit the load they put on Ambari together."""
+    return dict(
+        ambari_max_rps=dict(type='float', default=None, required=False),
+        ambari_max_in_flight=dict(type='int', default=None, required=False),
+        ambari_throttle_dir=dict(type='path', default=None, required=False)
+    )
+
+
+def configure_throttle(max_rps=None, max_in_flight=None, lock_dir=None):
+    """Limit the calls of this process, and of every other one using the same lock_dir, to each Ambari server."""
+    _STATE.update(max_rps=max_rps or None, max_in_flight=max_in_flight or None,
+                  lock_dir=lock_dir or os.path.join(tempfile.gettempdir(), 'ambari-throttle'))
+
+
+def throttle_module(module, max_rps=None, max_in_flight=None, lock_dir=None):
+    """Configure the throttle from the module options, falling back to the environment variables."""
+    max_rps = max_rps or float(os.environ.get(MAX_RPS_ENV) or 0)
+    max_in_flight = max_in_flight or int(os.environ.get(MAX_IN_FLIGHT_ENV) or 0)
+    lock_dir = lock_dir or os.environ.get(THROTTLE_DIR_ENV)
+    if (max_rps or max_in_flight) and not FCNTL_FOUND:
+        module.fail_json(msg='fcntl is required to throttle the Ambari API calls')
+    configure_throttle(max_rps, max_in_flight, lock_dir)
+
+
+def lock_prefix(ambari_url):
+    """One set of lock files per Ambari server, whatever the cluster or credentials."""
+    try:
+        os.makedirs(_STATE['lock_dir'], 0o700)
+    except OSError:
+        if not os.path.isdir(_STATE['lock_dir']):
+            raise
+    key = hashlib.sha1(ambari_url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(_STATE['lock_dir'], 'ambari-' + key)
+
+
+def take_token(bucket_path, max_rps):
+    """Reserve the next token of the bucket and return how long to wait before using it.
+
+    Tokens are handed out even when the bucket is empty, driving it negative, so
+    that waiting callers are served in arrival order without polling the lock.
+    A full bucket allows a burst of one second worth of calls.
+    """
+    burst = max(max_rps, 1.0)
+    fd = os.open(bucket_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        now = time.time()
+        try:
+            tokens, updated = json.loads(os.read(fd, 4096).decode('utf-8'))
+        except ValueError:
+            tokens, updated = burst, now
+        tokens = min(burst, tokens + max(now - updated, 0) * max_rps) - 1
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, json.dumps([tokens, now]).encode('utf-8'))
+    finally:
+        # Closing the descriptor releases the flock
+        os.close(fd)
+    return -tokens / max_rps if tokens < 0 else 0
+
+
+def acquire_slot(prefix, max_in_flight):
+    """Block until one of the max_in_flight slot files is locked, return its open descriptor."""
+    while True:
+        start = random.randrange(max_in_flight)
+        for index in range(max_in_flight):
+            fd = os.open('{0}.slot{1}'.format(prefix, (start + index) % max_in_flight), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except (IOError, OSError) as e:
+                os.close(fd)
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+        time.sleep(SLOT_POLL_INTERVAL)
+
+
+@contextmanager
+def throttled(ambari_url):
+    """Hold a token and an in-flight slot for one call to ambari_url, when the throttle is configured."""
+    max_rps = _STATE['max_rps']
+    max_in_flight = _STATE['max_in_flight']
+    if not max_rps and not max_in_flight:
+        yield
+        return
+    started = time.time()
+    prefix = lock_prefix(ambari_url)
+    if max_rps:
+        wait = take_token(prefix + '.bucket', max_rps)
+        if wait > 0:
+            time.sleep(wait)
+    slot = acquire_slot(prefix, max_in_flight) if max_in_flight else None
+    record_throttle(time.time() - started)
+    try:
+        yield
+    finally:
+        if slot is not None:
+            os.close(slot)
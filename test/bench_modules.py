@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+#
+# Benchmarks of the module code paths against the local fake Ambari server.
+#
+# Every scenario runs in its own child process so that its peak RSS is not
+# mixed with the server's or another scenario's, while the server counts the
+# HTTP calls and bytes the scenario cost. Run from the repository root:
+#
+#     python -m test.bench_modules
+#     python -m test.bench_modules --sizes 10 100 --scenarios config_batch --save bench.json
+#     python -m test.bench_modules --compare bench.json
+#
+# With --compare the run fails when a scenario makes more HTTP calls than the
+# baseline, or takes longer than the baseline plus --tolerance.
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from test.fake_ambari import FakeAmbari
+
+DEFAULT_SIZES = [10, 100, 1000]
+PROPERTIES_PER_TYPE = 50
+
+
+class ModuleExit(SystemExit):
+    """Raised by FakeModule.exit_json/fail_json, like AnsibleModule leaving through sys.exit."""
+
+    def __init__(self, result, failed):
+        super(ModuleExit, self).__init__(1 if failed else 0)
+        self.result = result
+        self.failed = failed
+
+
+class FakeModule(object):
+    check_mode = False
+    params = {}
+
+    def exit_json(self, **kwargs):
+        raise ModuleExit(kwargs, False)
+
+    def fail_json(self, **kwargs):
+        raise ModuleExit(kwargs, True)
+
+
+def hosts(size):
+    return ['host{0:04d}.example.com'.format(i) for i in range(size)]
+
+
+# Scenarios: setup(fake, size) builds the cluster in the server, run(url, size) runs the module code in the child
+
+def setup_config_batch(fake, size):
+    for i in range(size):
+        fake.add_config('type-{0}'.format(i), dict(('property.{0}'.format(j), 'value-{0}'.format(j))
+                                                    for j in range(PROPERTIES_PER_TYPE)))
+
+
+def run_config_batch(url, size):
+    from extra_modules.ambari_cluster_config import process_ambari_configs
+    protocol, host, port = split_url(url)
+    configs = dict(('type-{0}'.format(i), {'property.0': {'value': 'changed'}}) for i in range(size))
+    process_ambari_configs(FakeModule(), protocol, host, port, 'admin', 'admin', 'mycluster', configs, True, 10, 4)
+
+
+def setup_stale_restart(fake, size):
+    for host_name in hosts(size):
+        fake.add_host_component(host_name, 'DATANODE', stale_configs=True)
+        fake.add_host_component(host_name, 'NODEMANAGER')
+
+
+def run_stale_restart(url, size):
+    from extra_modules.ambari_service_control import process_stale_restart
+    process_stale_restart(url, 'admin', 'admin', FakeModule(), 'mycluster', ['all'], 600, 10, None, False)
+
+
+def setup_rolling_restart(fake, size):
+    for host_name in hosts(size):
+        fake.add_host_component(host_name, 'DATANODE')
+
+
+def run_rolling_restart(url, size):
+    from extra_modules.ambari_service_control import process_rolling_restart
+    process_rolling_restart(url, 'admin', 'admin', FakeModule(), 'mycluster', ['HDFS'], ['DATANODE'],
+                            max(size // 10, 1), 0, 0, 600, 10, False)
+
+
+def setup_component_bulk(fake, size):
+    for host_name in hosts(size):
+        fake.add_host(host_name, in_cluster=False)
+
+
+def run_component_bulk(url, size):
+    from extra_modules.ambari_component_extend import make_sure_hosts_exist, process_components
+    make_sure_hosts_exist(url, 'admin', 'admin', 'mycluster', hosts(size))
+    process_components(FakeModule(), url, 'admin', 'admin', 'mycluster', hosts(size), ['DATANODE', 'NODEMANAGER'],
+                       'started', 600, 10, None, False, True)
+
+
+def setup_layout(fake, size):
+    # Half of the workers are already in place
+    for host_name in hosts(size)[:size // 2]:
+        fake.add_host_component(host_name, 'DATANODE')
+        fake.add_host_component(host_name, 'NODEMANAGER')
+    for host_name in hosts(size)[size // 2:]:
+        fake.add_host(host_name)
+
+
+def run_layout(url, size):
+    from extra_modules.ambari_component_extend import process_layout
+    layout = [{'hosts': hosts(size), 'components': ['DATANODE', 'NODEMANAGER']}]
+    process_layout(FakeModule(), url, 'admin', 'admin', 'mycluster', layout, 100, 'installed', 600, 10, None, False, True)
+
+
+def setup_services(fake, size, state):
+    for host_name in hosts(size):
+        fake.add_host_component(host_name, 'DATANODE', state)
+        fake.add_host_component(host_name, 'NODEMANAGER', state)
+    for service_name in ['HDFS', 'YARN']:
+        fake.add_service(service_name, state)
+
+
+def run_services(url, state):
+    from extra_modules.ambari_service_control import get_all_services_states, process_services
+    services_fact = get_all_services_states(url, 'admin', 'admin', 'mycluster')
+    process_services(services_fact, url, 'admin', 'admin', FakeModule(), 'mycluster', ['HDFS', 'YARN'], state,
+                     600, 10, None, False)
+
+
+def setup_service_start(fake, size):
+    setup_services(fake, size, 'INSTALLED')
+
+
+def run_service_start(url, size):
+    run_services(url, 'started')
+
+
+def setup_service_stop(fake, size):
+    setup_services(fake, size, 'STARTED')
+
+
+def run_service_stop(url, size):
+    run_services(url, 'installed')
+
+
+def request_count(size):
+    return max(size // 10, 1)
+
+
+def setup_request_wait(fake, size):
+    # One request per ten hosts, with ids 1 to request_count(size)
+    names = hosts(size)
+    for index in range(request_count(size)):
+        fake.submit('Restart batch {0}'.format(index), [{'host_name': host_name, 'role': 'DATANODE', 'command': 'RESTART'}
+                                                        for host_name in names[index * 10:(index + 1) * 10]])
+
+
+def run_request_wait(url, size):
+    from extra_modules.ambari_request_wait import process_request_wait
+    process_request_wait(url, 'admin', 'admin', FakeModule(), 'mycluster', list(range(1, request_count(size) + 1)), [],
+                         10, 600, 10, None, False)
+
+
+SCENARIOS = {
+    'config_batch': (setup_config_batch, run_config_batch),
+    'stale_restart': (setup_stale_restart, run_stale_restart),
+    'rolling_restart': (setup_rolling_restart, run_rolling_restart),
+    'component_bulk': (setup_component_bulk, run_component_bulk),
+    'layout': (setup_layout, run_layout),
+    'service_start': (setup_service_start, run_service_start),
+    'service_stop': (setup_service_stop, run_service_stop),
+    'request_wait': (setup_request_wait, run_request_wait)
+}
+
+
+def split_url(url):
+    protocol, rest = url.split('://')
+    host, port = rest.rsplit(':', 1)
+    return protocol, host, int(port)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+def run_child(scenario, size, url):
+    started = time.time()
+    try:
+        SCENARIOS[scenario][1](url, size)
+        result = {'failed': True, 'msg': 'module did not exit'}
+    except ModuleExit as e:
+        result = {'failed': e.failed, 'changed': e.result.get('changed'), 'msg': e.result.get('msg') if e.failed else None}
+    print(json.dumps({'wall_s': round(time.time() - started, 3), 'peak_rss_mb': peak_rss_mb(), 'result': result}))
+
+
+def run_scenario(scenario, size, latency, request_duration):
+    fake = FakeAmbari(latency=latency, request_duration=request_duration)
+    SCENARIOS[scenario][0](fake, size)
+    url = fake.start()
+    try:
+        output = subprocess.check_output([sys.executable, '-m', 'test.bench_modules', '--child', scenario, str(size), url])
+    finally:
+        fake.stop()
+    measured = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    counters = fake.counters()
+    return {
+        'scenario': scenario,
+        'size': size,
+        'wall_s': measured['wall_s'],
+        'calls': counters['calls'],
+        'bytes_in': counters['bytes_in'],
+        'bytes_out': counters['bytes_out'],
+        'peak_rss_mb': measured['peak_rss_mb'],
+        'failed': measured['result']['failed'],
+        'msg': measured['result']['msg']
+    }
+
+
+def regressions(results, baseline, tolerance):
+    reference = dict(((r['scenario'], r['size']), r) for r in baseline)
+    found = []
+    for r in results:
+        base = reference.get((r['scenario'], r['size']))
+        if base is None:
+            continue
+        if r['calls'] > base['calls']:
+            found.append('{0}@{1}: {2} HTTP calls, baseline {3}'.format(r['scenario'], r['size'], r['calls'], base['calls']))
+        if r['wall_s'] > base['wall_s'] * (1 + tolerance) + 0.1:
+            found.append('{0}@{1}: {2}s, baseline {3}s'.format(r['scenario'], r['size'], r['wall_s'], base['wall_s']))
+    return found
+
+
+def print_table(results):
+    columns = ['scenario', 'size', 'wall_s', 'calls', 'bytes_in', 'bytes_out', 'peak_rss_mb', 'failed']
+    print(' '.join('{0:>15}'.format(c) for c in columns))
+    for r in results:
+        print(' '.join('{0:>15}'.format(str(r[c])) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Ambari modules against a local fake Ambari server')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES,
+                        help='number of simulated hosts / config types')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every API call')
+    parser.add_argument('--request-duration', type=float, default=0, help='seconds an async request takes')
+    parser.add_argument('--save', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON file to check the results against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative wall time increase')
+    parser.add_argument('--child', nargs=3, metavar=('SCENARIO', 'SIZE', 'URL'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), args.child[2])
+        return 0
+
+    results = [run_scenario(scenario, size, args.latency, args.request_duration)
+               for scenario in args.scenarios for size in args.sizes]
+    print_table(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    status = 1 if any(r['failed'] for r in results) else 0
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print('REGRESSION ' + line)
+        if found:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
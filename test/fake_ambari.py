@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -*-
+#
+# Stateful stand-in for the Ambari REST API, served locally over HTTP.
+#
+# It models what the modules talk to: desired_configs with tag versioning,
+# services, hosts, host_components (predicates, partial responses and
+# pagination), asynchronous requests whose tasks finish over a configurable
+# duration, request schedules, and injected latency and failures. Every call
+# is counted together with the bytes moved, so benchmarks and tests can check
+# the round trips a code path costs.
+
+import json
+import random
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
+
+COMPONENT_SERVICES = {
+    'NAMENODE': 'HDFS',
+    'SECONDARY_NAMENODE': 'HDFS',
+    'DATANODE': 'HDFS',
+    'HDFS_CLIENT': 'HDFS',
+    'RESOURCEMANAGER': 'YARN',
+    'NODEMANAGER': 'YARN',
+    'YARN_CLIENT': 'YARN',
+    'HISTORYSERVER': 'MAPREDUCE2',
+    'HIVE_SERVER': 'HIVE',
+    'HIVE_METASTORE': 'HIVE',
+    'ZOOKEEPER_SERVER': 'ZOOKEEPER',
+    'KAFKA_BROKER': 'KAFKA'
+}
+
+_IN_PREDICATE = re.compile(r'^(.+)\.in\((.*)\)$')
+
+# Ambari always returns the key fields of a resource, whatever ?fields= asks for
+KEY_FIELDS = {
+    'Clusters': ['cluster_name'],
+    'ServiceInfo': ['cluster_name', 'service_name'],
+    'Hosts': ['cluster_name', 'host_name'],
+    'HostRoles': ['cluster_name', 'component_name', 'host_name'],
+    'Requests': ['id'],
+    'Tasks': ['id', 'request_id'],
+    'RequestSchedule': ['id']
+}
+
+
+def flatten(resource):
+    """{'HostRoles': {'host_name': 'h'}} -> {'HostRoles/host_name': 'h'}"""
+    flat = {}
+    for category, properties in resource.items():
+        if isinstance(properties, dict):
+            for key, value in properties.items():
+                flat['{0}/{1}'.format(category, key)] = value
+        else:
+            flat[category] = properties
+    return flat
+
+
+def parse_query(query):
+    """Split a query string into its predicates and the fields, page_size, from and plain parameters."""
+    predicates = []
+    params = {}
+    for term in query.split('&') if query else []:
+        term = unquote(term)
+        match = _IN_PREDICATE.match(term)
+        if match:
+            predicates.append((match.group(1), set(match.group(2).split(','))))
+        elif '=' in term:
+            key, value = term.split('=', 1)
+            if key in ('fields', 'page_size', 'from', 'type', 'tag', 'sortBy'):
+                params[key] = value
+            else:
+                predicates.append((key, set([value])))
+    return predicates, params
+
+
+def matches(resource, predicates):
+    flat = flatten(resource)
+    for key, values in predicates:
+        # A != predicate is parsed with its key ending in !
+        negated = key.endswith('!')
+        value = flat.get(key[:-1] if negated else key)
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        if (str(value) in values) == negated:
+            return False
+    return True
+
+
+def partial(resource, fields):
+    """Keep only the requested fields of a resource, the way Ambari answers ?fields=."""
+    if not fields:
+        return resource
+    result = {}
+    for field in fields.split(','):
+        category, _, key = field.partition('/')
+        if category not in resource:
+            continue
+        if key in ('', '*') or not isinstance(resource[category], dict):
+            result[category] = resource[category]
+        elif key in resource[category]:
+            result.setdefault(category, {})[key] = resource[category][key]
+    for category, keys in KEY_FIELDS.items():
+        if isinstance(resource.get(category), dict):
+            for key in keys:
+                if key in resource[category]:
+                    result.setdefault(category, {})[key] = resource[category][key]
+    return result
+
+
+class FakeRequest(object):
+    """An asynchronous Ambari request, its tasks complete one after the other over duration seconds."""
+
+    def __init__(self, request_id, context, tasks, duration, on_task_completed=None):
+        self.id = request_id
+        self.context = context
+        self.created = time.time()
+        self.duration = duration
+        self.tasks = tasks
+        self.on_task_completed = on_task_completed
+        self.aborted = False
+
+    def refresh(self, fail_hosts):
+        elapsed = time.time() - self.created
+        for index, task in enumerate(self.tasks):
+            if task['status'] != 'IN_PROGRESS':
+                continue
+            if self.aborted:
+                task['status'] = 'ABORTED'
+            elif elapsed >= self.duration * (index + 1) / len(self.tasks):
+                if task['host_name'] in fail_hosts:
+                    task['status'] = 'FAILED'
+                    task['stderr'] = 'Injected failure on {0}'.format(task['host_name'])
+                else:
+                    task['status'] = 'COMPLETED'
+                    if self.on_task_completed is not None:
+                        self.on_task_completed(task)
+
+    def status(self):
+        counts = dict((s, len([t for t in self.tasks if t['status'] == s]))
+                      for s in ['IN_PROGRESS', 'COMPLETED', 'FAILED', 'ABORTED'])
+        if self.aborted:
+            request_status = 'ABORTED'
+        elif counts['IN_PROGRESS'] > 0:
+            request_status = 'IN_PROGRESS'
+        elif counts['FAILED'] > 0:
+            request_status = 'FAILED'
+        else:
+            request_status = 'COMPLETED'
+        done = len(self.tasks) - counts['IN_PROGRESS']
+        return {'Requests': {
+            'id': self.id,
+            'request_context': self.context,
+            'request_status': request_status,
+            'progress_percent': 100.0 * done / len(self.tasks) if self.tasks else 100.0,
+            'task_count': len(self.tasks),
+            'queued_task_count': 0,
+            'completed_task_count': done,
+            'failed_task_count': counts['FAILED'],
+            'aborted_task_count': counts['ABORTED'],
+            'timed_out_task_count': 0
+        }}
+
+
+class FakeAmbari(object):
+
+    def __init__(self, cluster_name='mycluster', latency=0, request_duration=0, http_failure_rate=0, seed=0):
+        self.cluster_name = cluster_name
+        self.latency = latency
+        self.request_duration = request_duration
+        self.http_failure_rate = http_failure_rate
+        self.random = random.Random(seed)
+        self.fail_hosts = set()
+        self.lock = threading.RLock()
+        self.configs = {}
+        self.desired_configs = {}
+        self.services = {}
+        self.agents = set()
+        self.hosts = set()
+        self.host_components = {}
+        self.requests = {}
+        self.schedules = {}
+        self.next_id = 1
+        self.server = None
+        self.reset_counters()
+
+    # State setup
+
+    def add_config(self, config_type, properties, tag='version1', properties_attributes=None):
+        with self.lock:
+            version = len([key for key in self.configs if key[0] == config_type]) + 1
+            self.configs[(config_type, tag)] = {'type': config_type, 'tag': tag, 'version': version,
+                                                'properties': properties,
+                                                'properties_attributes': properties_attributes or {}}
+            self.desired_configs[config_type] = {'tag': tag, 'version': version}
+
+    def add_service(self, service_name, state='STARTED'):
+        self.services[service_name] = state
+
+    def add_host(self, host_name, in_cluster=True):
+        """Register an agent for the host, and add the host to the cluster unless in_cluster is False."""
+        self.agents.add(host_name)
+        if in_cluster:
+            self.hosts.add(host_name)
+
+    def add_host_component(self, host_name, component_name, state='STARTED', stale_configs=False):
+        self.add_host(host_name)
+        service_name = COMPONENT_SERVICES.get(component_name, 'UNKNOWN')
+        if service_name not in self.services:
+            self.add_service(service_name)
+        self.host_components[(host_name, component_name)] = {'HostRoles': {
+            'cluster_name': self.cluster_name,
+            'host_name': host_name,
+            'component_name': component_name,
+            'service_name': service_name,
+            'state': state,
+            'stale_configs': stale_configs
+        }}
+
+    def reset_counters(self):
+        self.calls = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.calls_by_method = {}
+
+    def counters(self):
+        return {'calls': self.calls, 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                'calls_by_method': dict(self.calls_by_method)}
+
+    # Server lifecycle
+
+    def start(self, port=0):
+        self.server = _Server(('127.0.0.1', port), _Handler)
+        self.server.fake = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    # Request handling
+
+    def handle(self, method, raw_path, body):
+        if self.latency:
+            time.sleep(self.latency)
+        path, _, query = raw_path.partition('?')
+        with self.lock:
+            self.calls = self.calls + 1
+            self.bytes_in = self.bytes_in + len(raw_path) + len(body)
+            self.calls_by_method[method] = self.calls_by_method.get(method, 0) + 1
+            if self.http_failure_rate and self.random.random() < self.http_failure_rate:
+                return 500, {'status': 500, 'message': 'Injected server error'}
+            data = json.loads(body) if body else None
+            prefix = '/api/v1/clusters/{0}'.format(self.cluster_name)
+            if not path.startswith(prefix):
+                return 404, {'status': 404, 'message': 'Cluster not found'}
+            resource = path[len(prefix):]
+            predicates, params = parse_query(query)
+            for pattern, handler in self.routes():
+                match = re.match(pattern, resource)
+                if match and method in handler:
+                    return handler[method](predicates, params, data, *match.groups())
+            return 404, {'status': 404, 'message': 'No route for {0} {1}'.format(method, path)}
+
+    def routes(self):
+        return [
+            (r'^$', {'GET': self.get_cluster, 'PUT': self.put_cluster}),
+            (r'^/configurations$', {'GET': self.get_configurations}),
+            (r'^/services$', {'GET': self.get_services, 'PUT': self.put_services}),
+            (r'^/services/([^/]+)$', {'PUT': self.put_service}),
+            (r'^/hosts$', {'GET': self.get_hosts, 'POST': self.post_hosts}),
+            (r'^/hosts/([^/]+)$', {'GET': self.get_host, 'POST': self.post_host}),
+            (r'^/host_components$', {'GET': self.get_host_components, 'PUT': self.put_host_components}),
+            (r'^/requests$', {'POST': self.post_requests}),
+            (r'^/requests/(\d+)$', {'GET': self.get_request, 'PUT': self.put_request}),
+            (r'^/requests/(\d+)/tasks$', {'GET': self.get_tasks}),
+            (r'^/request_schedules$', {'POST': self.post_schedules}),
+            (r'^/request_schedules/(\d+)$', {'GET': self.get_schedule, 'DELETE': self.delete_schedule})
+        ]
+
+    def new_id(self):
+        self.next_id = self.next_id + 1
+        return self.next_id - 1
+
+    def submit(self, context, tasks, on_task_completed=None):
+        if len(tasks) == 0:
+            return 200, None
+        request = FakeRequest(self.new_id(), context, tasks, self.request_duration, on_task_completed)
+        for index, task in enumerate(tasks):
+            task.update({'id': request.id * 100000 + index, 'status': 'IN_PROGRESS', 'request_id': request.id})
+        self.requests[request.id] = request
+        return 202, {'href': '/api/v1/clusters/{0}/requests/{1}'.format(self.cluster_name, request.id),
+                     'Requests': {'id': request.id, 'status': 'Accepted'}}
+
+    def items(self, resources, predicates, params):
+        selected = [r for r in resources if matches(r, predicates)]
+        offset = int(params.get('from', 0))
+        if 'page_size' in params:
+            selected = selected[offset:offset + int(params['page_size'])]
+        return {'items': [partial(r, params.get('fields')) for r in selected]}
+
+    # Cluster and configurations
+
+    def get_cluster(self, predicates, params, data):
+        return 200, partial({'Clusters': {'cluster_name': self.cluster_name, 'desired_configs': self.desired_configs}},
+                            params.get('fields'))
+
+    def put_cluster(self, predicates, params, data):
+        for entry in data if isinstance(data, list) else [data]:
+            desired = entry['Clusters']['desired_config']
+            for config in desired if isinstance(desired, list) else [desired]:
+                self.add_config(config['type'], config['properties'], config['tag'], config.get('properties_attributes'))
+        return 200, {'resources': []}
+
+    def get_configurations(self, predicates, params, data):
+        config = self.configs.get((params.get('type'), params.get('tag')))
+        return 200, {'items': [config] if config else []}
+
+    # Services
+
+    def get_services(self, predicates, params, data):
+        resources = [{'ServiceInfo': {'cluster_name': self.cluster_name, 'service_name': name, 'state': state,
+                                      'maintenance_state': 'OFF'}} for name, state in sorted(self.services.items())]
+        return 200, self.items(resources, predicates, params)
+
+    def put_services(self, predicates, params, data):
+        names = [name for name in sorted(self.services)
+                 if matches({'ServiceInfo': {'service_name': name}}, predicates)]
+        return self.change_services(names, data)
+
+    def put_service(self, predicates, params, data, service_name):
+        if service_name not in self.services:
+            return 404, {'status': 404, 'message': 'Service not found'}
+        return self.change_services([service_name], data)
+
+    def change_services(self, names, data):
+        state = data['Body']['ServiceInfo']['state']
+        names = [name for name in names if self.services[name] != state]
+        tasks = []
+        for key, host_component in sorted(self.host_components.items()):
+            if host_component['HostRoles']['service_name'] in names:
+                tasks.append({'host_name': key[0], 'role': key[1], 'command': state == 'STARTED' and 'START' or 'STOP'})
+        if len(tasks) == 0:
+            tasks = [{'host_name': None, 'role': name, 'command': 'SERVICE'} for name in names]
+
+        def completed(task):
+            if task['host_name'] is not None:
+                self.host_components[(task['host_name'], task['role'])]['HostRoles']['state'] = state
+        for name in names:
+            self.services[name] = state
+        return self.submit(data.get('RequestInfo', {}).get('context'), tasks, completed)
+
+    # Hosts
+
+    def get_hosts(self, predicates, params, data):
+        resources = [{'Hosts': {'cluster_name': self.cluster_name, 'host_name': h}} for h in sorted(self.hosts)]
+        return 200, self.items(resources, predicates, params)
+
+    def get_host(self, predicates, params, data, host_name):
+        if host_name not in self.hosts:
+            return 404, {'status': 404, 'message': 'Host not found'}
+        return 200, {'Hosts': {'cluster_name': self.cluster_name, 'host_name': host_name}}
+
+    def post_hosts(self, predicates, params, data):
+        if isinstance(data, list):
+            # Bulk registration, all or nothing like Ambari
+            names = [entry['Hosts']['host_name'] for entry in data]
+            unknown = [name for name in names if name not in self.agents]
+            if unknown:
+                return 400, {'status': 400, 'message': 'Attempted to add unknown hosts to a cluster. These hosts '
+                                                       'have not been registered with the server: ' + ','.join(unknown)}
+            self.hosts.update(names)
+            return 201, None
+        # Multi-host component creation, RequestInfo/query selects the hosts
+        query_predicates, _ = parse_query(data['RequestInfo']['query'])
+        for host_name in sorted(self.hosts):
+            if matches({'Hosts': {'host_name': host_name}}, query_predicates):
+                for entry in data['Body']['host_components']:
+                    self.add_host_component(host_name, entry['HostRoles']['component_name'], 'INIT')
+        return 201, None
+
+    def post_host(self, predicates, params, data, host_name):
+        if host_name not in self.agents:
+            return 400, {'status': 400, 'message': 'Host {0} has not been registered with the server'.format(host_name)}
+        if host_name in self.hosts:
+            return 409, {'status': 409, 'message': 'Host already exists'}
+        self.hosts.add(host_name)
+        return 201, None
+
+    # Host components
+
+    def get_host_components(self, predicates, params, data):
+        resources = [self.host_components[key] for key in sorted(self.host_components)]
+        return 200, self.items(resources, predicates, params)
+
+    def put_host_components(self, predicates, params, data):
+        state = data['Body']['HostRoles']['state']
+        selected = [key for key in sorted(self.host_components) if matches(self.host_components[key], predicates)]
+        command = {'INSTALLED': 'INSTALL', 'STARTED': 'START'}.get(state, state)
+        tasks = [{'host_name': host_name, 'role': component, 'command': command} for host_name, component in selected]
+
+        def completed(task):
+            self.host_components[(task['host_name'], task['role'])]['HostRoles']['state'] = state
+        return self.submit(data.get('RequestInfo', {}).get('context'), tasks, completed)
+
+    # Requests
+
+    def post_requests(self, predicates, params, data):
+        tasks = []
+        for resource_filter in data.get('Requests/resource_filters', []):
+            for host_name in resource_filter.get('hosts', '').split(','):
+                tasks.append({'host_name': host_name, 'role': resource_filter['component_name'],
+                              'command': data['RequestInfo']['command']})
+
+        def completed(task):
+            self.host_components[(task['host_name'], task['role'])]['HostRoles']['stale_configs'] = False
+        return self.submit(data['RequestInfo'].get('context'), tasks, completed)
+
+    def request(self, request_id):
+        request = self.requests.get(int(request_id))
+        if request is not None:
+            request.refresh(self.fail_hosts)
+        return request
+
+    def get_request(self, predicates, params, data, request_id):
+        request = self.request(request_id)
+        if request is None:
+            return 404, {'status': 404, 'message': 'Request not found'}
+        return 200, partial(request.status(), params.get('fields'))
+
+    def put_request(self, predicates, params, data, request_id):
+        request = self.request(request_id)
+        if request is None:
+            return 404, {'status': 404, 'message': 'Request not found'}
+        if data['Requests'].get('request_status') == 'ABORTED':
+            request.aborted = True
+            request.refresh(self.fail_hosts)
+        return 200, None
+
+    def get_tasks(self, predicates, params, data, request_id):
+        request = self.request(request_id)
+        if request is None:
+            return 404, {'status': 404, 'message': 'Request not found'}
+        return 200, self.items([{'Tasks': task} for task in request.tasks], predicates, params)
+
+    # Request schedules, batches run one after the other with batch_separation_in_seconds in between
+
+    def post_schedules(self, predicates, params, data):
+        batch = data[0]['RequestSchedule']['batch']
+        schedule_id = self.new_id()
+        self.schedules[schedule_id] = {
+            'id': schedule_id,
+            'status': 'SCHEDULED',
+            'requests': batch[0]['requests'],
+            'settings': batch[1]['batch_settings'],
+            'batch_requests': [],
+            'next_at': time.time()
+        }
+        return 201, {'resources': [{'href': '/api/v1/clusters/{0}/request_schedules/{1}'.format(
+            self.cluster_name, schedule_id), 'RequestSchedule': {'id': schedule_id}}]}
+
+    def refresh_schedule(self, schedule):
+        while schedule['status'] == 'SCHEDULED':
+            if schedule['batch_requests']:
+                last = schedule['batch_requests'][-1]
+                status = self.request(last['request_id']).status()['Requests']
+                last['request_status'] = status['request_status']
+                if status['request_status'] == 'IN_PROGRESS':
+                    return
+                failed = sum(self.request(b['request_id']).status()['Requests']['failed_task_count']
+                             for b in schedule['batch_requests'])
+                if failed > schedule['settings'].get('task_failure_tolerance', 0):
+                    schedule['status'] = 'PAUSED'
+                    return
+            if len(schedule['batch_requests']) == len(schedule['requests']):
+                schedule['status'] = 'COMPLETED'
+                return
+            if time.time() < schedule['next_at']:
+                return
+            entry = schedule['requests'][len(schedule['batch_requests'])]
+            _, response = self.post_requests([], {}, entry['RequestBodyInfo'])
+            schedule['batch_requests'].append({'order_id': entry['order_id'],
+                                               'request_id': response['Requests']['id'],
+                                               'request_status': 'IN_PROGRESS'})
+            schedule['next_at'] = time.time() + schedule['settings'].get('batch_separation_in_seconds', 0)
+
+    def get_schedule(self, predicates, params, data, schedule_id):
+        schedule = self.schedules.get(int(schedule_id))
+        if schedule is None:
+            return 404, {'status': 404, 'message': 'Request schedule not found'}
+        self.refresh_schedule(schedule)
+        return 200, {'RequestSchedule': {'id': schedule['id'], 'status': schedule['status'],
+                                         'batch': {'batch_requests': schedule['batch_requests']}}}
+
+    def delete_schedule(self, predicates, params, data, schedule_id):
+        schedule = self.schedules.get(int(schedule_id))
+        if schedule is None:
+            return 404, {'status': 404, 'message': 'Request schedule not found'}
+        schedule['status'] = 'DISABLED'
+        return 200, None
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like Ambari's Jetty, so that connection reuse is measured too
+    protocol_version = 'HTTP/1.1'
+
+    def handle_method(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        fake = self.server.fake
+        status, response = fake.handle(self.command, self.path, body)
+        content = json.dumps(response).encode('utf-8') if response is not None else b''
+        with fake.lock:
+            fake.bytes_out = fake.bytes_out + len(content)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = handle_method
+    do_PUT = handle_method
+    do_POST = handle_method
+    do_DELETE = handle_method
+
+    def log_message(self, format, *args):
+        pass
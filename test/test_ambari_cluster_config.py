@@ -1,5 +1,14 @@
 import httpretty
+import shutil
+import tempfile
+import threading
+import time
 from extra_modules.ambari_cluster_config import process_ambari_config as ambari_config
+from extra_modules.ambari_cluster_config import process_ambari_configs as ambari_configs
+from extra_modules.ambari_cluster_config import process_ambari_drift as ambari_drift
+from extra_modules.ambari_cluster_config import sync_config_map_with_cluster
+from extra_modules.ambari_cluster_config import format_result
+from module_utils.ambari_regex import apply_regex_rules
 import mock
 from nose.tools import assert_equals
 import json
@@ -50,6 +59,7 @@ dummy_update_success_response = '{"dummy_key" : "dummy_value"}'
 @httpretty.activate
 @mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
 def test_no_change(mock_module):
+    mock_module.check_mode = False
     # define your patch:
     httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster?fields=Clusters/desired_configs",
                            body=sample_desire_config)
@@ -63,7 +73,7 @@ def test_no_change(mock_module):
             'value': 'mockvalue2'
         }
     }
-    ambari_config(mock_module, 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None, config_map, True, 60)
+    ambari_config(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None, config_map, True, 60)
     assert_equals(mock_module.fail_json.call_count, 0)
     assert_equals(mock_module.exit_json.call_count, 1)
     mock_module.exit_json.assert_called_with(changed=False, msg='No changes in config')
@@ -72,6 +82,7 @@ def test_no_change(mock_module):
 @httpretty.activate
 @mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
 def test_changes(mock_module):
+    mock_module.check_mode = False
     # define your patch:
     httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster?fields=Clusters/desired_configs",
                            body=sample_desire_config)
@@ -87,7 +98,389 @@ def test_changes(mock_module):
             'value': 'changevalue2'
         }
     }
-    ambari_config(mock_module, 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None, config_map, True, 60)
+    ambari_config(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None, config_map, True, 60)
     assert_equals(mock_module.fail_json.call_count, 0)
     assert_equals(mock_module.exit_json.call_count, 1)
-    mock_module.exit_json.assert_called_with(changed=True, msg=mock.ANY, results=mock.ANY)
\ No newline at end of file
+    mock_module.exit_json.assert_called_with(changed=True, msg=mock.ANY, results=mock.ANY)
+
+sample_batch_desire_config = '''
+{
+  "Clusters" : {
+    "cluster_name" : "mycluster",
+    "desired_configs" : {
+      "mock_config_type" : {
+        "tag" : "version1",
+        "version" : 1
+      },
+      "other_config_type" : {
+        "tag" : "version7",
+        "version" : 7
+      }
+    }
+  }
+}
+'''
+
+
+def batch_config_detail(request, uri, headers):
+    config = json.loads(sample_config_detail)
+    config['items'][0]['type'] = request.querystring['type'][0]
+    config['items'][0]['tag'] = request.querystring['tag'][0]
+    return (200, headers, json.dumps(config))
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
+def test_batch_changes_single_put(mock_module):
+    mock_module.check_mode = False
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                           body=sample_batch_desire_config)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/configurations",
+                           body=batch_config_detail)
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster",
+                           body=dummy_update_success_response)
+    configs = {
+        'mock_config_type': {
+            'key1': {
+                'value': 'mockvalue1'
+            }
+        },
+        'other_config_type': {
+            'key2': {
+                'value': 'changevalue2'
+            }
+        }
+    }
+    ambari_configs(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', configs, True, 60)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    mock_module.exit_json.assert_called_with(changed=True, msg=mock.ANY, results=mock.ANY)
+    assert_equals(mock_module.exit_json.call_count, 1)
+    assert_equals(httpretty.last_request().method, 'PUT')
+    desired_config = json.loads(httpretty.last_request().body)[0]['Clusters']['desired_config']
+    assert_equals([c['type'] for c in desired_config], ['other_config_type'])
+
+
+sample_parallel_desire_config = json.dumps({'Clusters': {'cluster_name': 'mycluster', 'desired_configs': dict(
+    (config_type, {'tag': 'version1', 'version': 1}) for config_type in ['a_type', 'b_type', 'c_type'])}})
+
+
+class SlowConfigs(object):
+    """Serve config types with per-type delays, counting the fetches in flight."""
+
+    def __init__(self, delays, failing=()):
+        self.delays = delays
+        self.failing = failing
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.served = []
+
+    def __call__(self, request, uri, headers):
+        config_type = request.querystring['type'][0]
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(self.delays[config_type])
+        with self.lock:
+            self.in_flight -= 1
+            self.served.append(config_type)
+        if config_type in self.failing:
+            return (500, headers, 'Server Error')
+        return batch_config_detail(request, uri, headers)
+
+
+def parallel_configs():
+    return dict((config_type, {'key2': {'value': 'changevalue2'}}) for config_type in ['a_type', 'b_type', 'c_type'])
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
+def test_batch_fetches_concurrently_in_stable_order(mock_module):
+    mock_module.check_mode = False
+    # The first type in the batch is the last one to arrive
+    configs_endpoint = SlowConfigs({'a_type': 0.3, 'b_type': 0.2, 'c_type': 0.1})
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                           body=sample_parallel_desire_config)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/configurations",
+                           body=configs_endpoint)
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster",
+                           body=dummy_update_success_response)
+    ambari_configs(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', parallel_configs(), True, 60, 3)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    assert_equals(configs_endpoint.peak, 3)
+    assert_equals(configs_endpoint.served, ['c_type', 'b_type', 'a_type'])
+    assert_equals(httpretty.last_request().method, 'PUT')
+    desired_config = json.loads(httpretty.last_request().body)[0]['Clusters']['desired_config']
+    assert_equals([c['type'] for c in desired_config], ['a_type', 'b_type', 'c_type'])
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
+def test_batch_fetch_failure_reported_per_type(mock_module):
+    mock_module.check_mode = False
+    configs_endpoint = SlowConfigs({'a_type': 0.1, 'b_type': 0, 'c_type': 0.1}, failing=['b_type'])
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                           body=sample_parallel_desire_config)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/configurations",
+                           body=configs_endpoint)
+    ambari_configs(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', parallel_configs(), True, 60, 3)
+    # The failed type does not cancel the other fetches, only that type is reported and nothing is written
+    assert_equals(sorted(configs_endpoint.served), ['a_type', 'b_type', 'c_type'])
+    assert_equals(mock_module.exit_json.call_count, 0)
+    msg = mock_module.fail_json.call_args[1]['msg']
+    errors = json.loads(msg.split(': ', 1)[1])
+    assert_equals(sorted(errors), ['b_type'])
+    assert_equals(httpretty.last_request().method, 'GET')
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
+def test_drift_only_diffs_moved_tags(mock_module):
+    mock_module.check_mode = False
+    state_dir = tempfile.mkdtemp()
+    try:
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                               body=sample_batch_desire_config)
+        ambari_drift(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 60, 1, None, state_dir)
+        mock_module.exit_json.assert_called_with(changed=False, drift={}, msg=mock.ANY)
+
+        moved_desire_config = json.loads(sample_batch_desire_config)
+        moved_desire_config['Clusters']['desired_configs']['other_config_type']['tag'] = 'version8'
+
+        def moved_config_detail(request, uri, headers):
+            config = json.loads(sample_config_detail)
+            config['items'][0]['tag'] = request.querystring['tag'][0]
+            if request.querystring['tag'][0] == 'version8':
+                config['items'][0]['properties']['key1'] = 'handchanged'
+                config['items'][0]['properties']['key3'] = 'added'
+                del config['items'][0]['properties']['key2']
+            return (200, headers, json.dumps(config))
+
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                               body=json.dumps(moved_desire_config))
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/configurations",
+                               body=moved_config_detail)
+        ambari_drift(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 60, 1, None, state_dir)
+        assert_equals(mock_module.fail_json.call_count, 0)
+        mock_module.exit_json.assert_called_with(changed=True, msg=mock.ANY, drift={
+            'other_config_type': {
+                'old_tag': 'version7',
+                'new_tag': 'version8',
+                'added': ['key3'],
+                'removed': ['key2'],
+                'changed': ['key1']
+            }
+        })
+    finally:
+        shutil.rmtree(state_dir)
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
+def test_unchanged_secrets_not_resent(mock_module):
+    mock_module.check_mode = False
+    state_dir = tempfile.mkdtemp()
+    try:
+        secret_config_detail = json.loads(sample_config_detail)
+        secret_config_detail['items'][0]['properties']['db_password'] = 'SECRET:mock_config_type:1:db_password'
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                               body=sample_desire_config)
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/configurations",
+                               body=json.dumps(secret_config_detail))
+        httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster",
+                               body=dummy_update_success_response)
+        config_map = {
+            'key1': {
+                'value': 'mockvalue1'
+            },
+            'db_password': {
+                'value': 'mysecret'
+            }
+        }
+        ambari_config(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None, config_map, True, 60, None, state_dir)
+        assert_equals(httpretty.last_request().method, 'PUT')
+        new_tag = json.loads(httpretty.last_request().body)[0]['Clusters']['desired_config'][0]['tag']
+
+        # Ambari now points at the version written above
+        moved_desire_config = json.loads(sample_desire_config)
+        moved_desire_config['Clusters']['desired_configs']['mock_config_type']['tag'] = new_tag
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                               body=json.dumps(moved_desire_config))
+        ambari_config(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None, config_map, True, 60, None, state_dir)
+        assert_equals(httpretty.last_request().method, 'GET')
+        mock_module.exit_json.assert_called_with(changed=False, msg='No changes in config')
+
+        config_map['db_password']['value'] = 'rotated'
+        ambari_config(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None, config_map, True, 60, None, state_dir)
+        assert_equals(httpretty.last_request().method, 'PUT')
+        assert_equals(mock_module.fail_json.call_count, 0)
+    finally:
+        shutil.rmtree(state_dir)
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
+def test_unwritable_state_dir_falls_back_to_resending_secrets(mock_module):
+    mock_module.check_mode = False
+    state_file = tempfile.NamedTemporaryFile()
+    try:
+        secret_config_detail = json.loads(sample_config_detail)
+        secret_config_detail['items'][0]['properties']['db_password'] = 'SECRET:mock_config_type:1:db_password'
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                               body=sample_desire_config)
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/configurations",
+                               body=json.dumps(secret_config_detail))
+        httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster",
+                               body=dummy_update_success_response)
+        config_map = {
+            'db_password': {
+                'value': 'mysecret'
+            }
+        }
+        # A state_dir below a regular file can never be created, whoever runs the test
+        ambari_config(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None,
+                      config_map, True, 60, None, state_file.name + '/state')
+        assert_equals(httpretty.last_request().method, 'PUT')
+        assert_equals(mock_module.fail_json.call_count, 0)
+        assert_equals(mock_module.exit_json.call_count, 1)
+        assert_equals(mock_module.warn.call_count, 1)
+    finally:
+        state_file.close()
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
+def test_unexpected_error_reported_with_its_message(mock_module):
+    mock_module.check_mode = False
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                           body='not json')
+    ambari_configs(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster',
+                   {'mock_config_type': {'key1': {'value': 'mockvalue1'}}}, True, 60)
+    msg = mock_module.fail_json.call_args[1]['msg']
+    assert msg.startswith('Ambari client exception occurred: ')
+    assert len(msg) > len('Ambari client exception occurred: ')
+
+
+def test_large_values_compared_by_digest():
+    cluster_config = {
+        'content': 'Line One\n' * 10,
+        'key1': 'mockvalue1'
+    }
+    config_map = {
+        'content': {
+            'value': 'line one\n' * 10
+        }
+    }
+    changed, _, _, updated_map = sync_config_map_with_cluster(cluster_config, config_map, True, 16)
+    assert_equals(changed, False)
+    assert_equals(updated_map, {})
+
+    config_map['content']['value'] = 'line two\n' * 10
+    changed, _, result_map, updated_map = sync_config_map_with_cluster(cluster_config, config_map, True, 16)
+    assert_equals(changed, True)
+    assert_equals(result_map['content'], 'line two\n' * 10)
+    assert_equals(updated_map['content']['changed_to']['size'], 90)
+    assert_equals(len(updated_map['content']['origin']['sha256']), 64)
+
+
+def test_regex_rules_report_matches():
+    cluster_config = {
+        'content': '<HistoryDays>30</HistoryDays>\nlog.level=INFO\n'
+    }
+    config_map = {
+        'content': {
+            'line_mode': True,
+            'regex_rules': [
+                {'regex': '^log.level=', 'value': 'log.level=DEBUG'},
+                {'regex': '^missing=', 'value': 'missing=1'}
+            ]
+        }
+    }
+    changed, _, result_map, updated_map = sync_config_map_with_cluster(cluster_config, config_map, True)
+    assert_equals(changed, True)
+    assert_equals(result_map['content'], '<HistoryDays>30</HistoryDays>\nlog.level=DEBUG\n')
+    assert_equals(updated_map['content']['matched_rules'], [0])
+
+    config_map = {
+        'content': {
+            'value': '<HistoryDays>30</HistoryDays>',
+            'regex': '<HistoryDays>\\d+</HistoryDays>'
+        }
+    }
+    changed, _, _, updated_map = sync_config_map_with_cluster(cluster_config, config_map, True)
+    assert_equals(changed, False)
+    assert_equals(updated_map, {})
+
+
+def test_regex_rules_with_backreferences():
+    # Combined into one pattern, the backreference of the second rule would point at the group of the first one
+    assert_equals(apply_regex_rules('aa bb cc', [('x(y)', 'z'), (r'(b)\1', 'Q')]), ('aa Q cc', [1]))
+    assert_equals(apply_regex_rules('aa bb cc', [('x(y)', 'z'), (r'(?P<c>c)(?P=c)', 'Q')]), ('aa bb Q', [1]))
+    assert_equals(apply_regex_rules('aa bb cc', [('(a)', r'<\1>'), ('(c)', r'[\1]')]), ('<a><a> bb [c][c]', [0, 1]))
+
+
+def test_result_formats():
+    result_map = {'content': 'x' * 2048, 'key1': 'mockvalue1', 'key2': 'changevalue2'}
+    updated_map = {
+        'content': {'origin': 'y' * 2048, 'changed_to': 'x' * 2048},
+        'key2': {'origin': 'mockvalue2', 'changed_to': 'changevalue2'}
+    }
+    assert_equals(format_result(result_map, updated_map, 'full'), {'result': result_map, 'updates': updated_map})
+    assert_equals(format_result(result_map, updated_map, 'summary'),
+                  {'changed_keys': ['content', 'key2'], 'changed_count': 2, 'total_count': 3})
+    diff = format_result(result_map, updated_map, 'diff')
+    assert_equals(sorted(diff), ['updates'])
+    assert_equals(diff['updates']['key2'], updated_map['key2'])
+    assert_equals(diff['updates']['content']['changed_to']['size'], 2048)
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
+def test_trimmed_result_formats_drop_put_response(mock_module):
+    mock_module.check_mode = False
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster",
+                           body=sample_batch_desire_config)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/configurations",
+                           body=batch_config_detail)
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster",
+                           body=sample_config_detail)
+    config_map = {
+        'key2': {
+            'value': 'changevalue2'
+        }
+    }
+    for result_format in ['diff', 'summary']:
+        ambari_config(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None,
+                      config_map, True, 60, result_format=result_format)
+        result = mock_module.exit_json.call_args[1]
+        assert_equals('results' in result, False)
+        assert_equals(result['config_tag'], json.loads(httpretty.last_request().body)[0]['Clusters']['desired_config'][0]['tag'])
+        ambari_configs(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster',
+                       {'other_config_type': config_map}, True, 60, result_format=result_format)
+        result = mock_module.exit_json.call_args[1]
+        assert_equals('results' in result, False)
+        assert_equals(result['config_tag'], json.loads(httpretty.last_request().body)[0]['Clusters']['desired_config'][0]['tag'])
+    assert_equals(mock_module.fail_json.call_count, 0)
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_cluster_config.AnsibleModule')
+def test_check_mode_plans_without_writing(mock_module):
+    mock_module.check_mode = True
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster?fields=Clusters/desired_configs",
+                           body=sample_desire_config)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/configurations?type=mock_config_type&tag=version1",
+                           body=sample_config_detail)
+    config_map = {
+        'key2': {
+            'value': 'changevalue2'
+        }
+    }
+    ambari_config(mock_module, 'http', 'localhost', 8080, 'username', 'password', 'mycluster', 'mock_config_type', None, config_map, True, 60)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    assert_equals(httpretty.last_request().method, 'GET')
+    plan = mock_module.exit_json.call_args[1]['plan']
+    assert_equals(len(plan), 1)
+    assert_equals(plan[0]['method'], 'PUT')
+    assert_equals(plan[0]['path'], '/api/v1/clusters/mycluster')
+    assert_equals(plan[0]['body'][0]['Clusters']['desired_config'][0]['properties']['key2'], 'changevalue2')
@@ -0,0 +1,208 @@
+import httpretty
+from extra_modules.ambari_component_extend import make_sure_hosts_exist, process_components, process_layout
+import mock
+from nose.tools import assert_equals
+import json
+
+accepted_response = '{"href": "http://localhost:8080/api/v1/clusters/mycluster/requests/7", "Requests": {"id": 7, "status": "Accepted"}}'
+completed_response = '{"Requests": {"id": 7, "request_status": "COMPLETED", "progress_percent": 100}}'
+
+
+def host_components(pairs):
+    return json.dumps({'items': [{'HostRoles': {'host_name': h, 'component_name': c}} for h, c in pairs]})
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_component_extend.AnsibleModule')
+def test_missing_components_installed_in_single_request(mock_module):
+    mock_module.check_mode = False
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           body=host_components([('amb2', 'DATANODE')]))
+    httpretty.register_uri(httpretty.POST, "http://localhost:8080/api/v1/clusters/mycluster/hosts", body='', status=201)
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           body=accepted_response, status=202)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/7",
+                           body=completed_response)
+    process_components(mock_module, 'http://localhost:8080', 'admin', 'admin', 'mycluster', ['amb2', 'amb3'],
+                       ['DATANODE', 'NODEMANAGER'], 'installed', 60, 10, None, False, True)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    mock_module.exit_json.assert_called_with(changed=True, added=[
+        {'host': 'amb2', 'component': 'NODEMANAGER'},
+        {'host': 'amb3', 'component': 'DATANODE'},
+        {'host': 'amb3', 'component': 'NODEMANAGER'}
+    ], installed=[
+        {'host': 'amb2', 'component': 'NODEMANAGER'},
+        {'host': 'amb3', 'component': 'DATANODE'},
+        {'host': 'amb3', 'component': 'NODEMANAGER'}
+    ], request_id=7, results=mock.ANY)
+    posts = [json.loads(r.body) for r in httpretty.HTTPretty.latest_requests
+             if r.method == 'POST' and r.path == '/api/v1/clusters/mycluster/hosts']
+    assert_equals(set(p['RequestInfo']['query'] for p in posts),
+                  set(['Hosts/host_name.in(amb3)', 'Hosts/host_name.in(amb2)']))
+    put_request = [r for r in httpretty.HTTPretty.latest_requests if r.method == 'PUT'][-1]
+    assert_equals(put_request.path, '/api/v1/clusters/mycluster/host_components?HostRoles/host_name.in(amb2,amb3)'
+                                    '&HostRoles/component_name.in(DATANODE,NODEMANAGER)&HostRoles/state=INIT')
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_component_extend.AnsibleModule')
+def test_leftover_init_components_installed(mock_module):
+    mock_module.check_mode = False
+    # An earlier run created the DATANODE of amb3 and stopped before installing it
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           body=json.dumps({'items': [
+                               {'HostRoles': {'host_name': 'amb2', 'component_name': 'DATANODE', 'state': 'STARTED'}},
+                               {'HostRoles': {'host_name': 'amb3', 'component_name': 'DATANODE', 'state': 'INIT'}}
+                           ]}))
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           body=accepted_response, status=202)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/7",
+                           body=completed_response)
+    process_components(mock_module, 'http://localhost:8080', 'admin', 'admin', 'mycluster', ['amb2', 'amb3'],
+                       ['DATANODE'], 'installed', 60, 10, None, False, True)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    mock_module.exit_json.assert_called_with(changed=True, added=[], installed=[{'host': 'amb3', 'component': 'DATANODE'}],
+                                             request_id=7, results=mock.ANY)
+    put_request = [r for r in httpretty.HTTPretty.latest_requests if r.method == 'PUT'][-1]
+    assert_equals(put_request.path, '/api/v1/clusters/mycluster/host_components?HostRoles/host_name.in(amb3)'
+                                    '&HostRoles/component_name.in(DATANODE)&HostRoles/state=INIT')
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_component_extend.AnsibleModule')
+def test_components_already_on_hosts(mock_module):
+    mock_module.check_mode = False
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           body=host_components([('amb2', 'DATANODE'), ('amb3', 'DATANODE')]))
+    process_components(mock_module, 'http://localhost:8080', 'admin', 'admin', 'mycluster', ['amb2', 'amb3'],
+                       ['DATANODE'], 'installed', 60, 10, None, False, True)
+    mock_module.exit_json.assert_called_with(changed=False, msg=mock.ANY)
+    assert_equals(httpretty.last_request().method, 'GET')
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_component_extend.AnsibleModule')
+def test_layout_reconciled_from_paginated_index(mock_module):
+    mock_module.check_mode = False
+    layout = [
+        {'hosts': ['amb1'], 'components': ['namenode']},
+        {'hosts': ['amb2', 'amb3'], 'components': ['DATANODE']}
+    ]
+    index = json.dumps({'items': [
+        {'HostRoles': {'host_name': 'amb1', 'component_name': 'NAMENODE', 'state': 'STARTED'}},
+        {'HostRoles': {'host_name': 'amb2', 'component_name': 'DATANODE', 'state': 'INIT'}}
+    ]})
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/host_components", body=index)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/hosts",
+                           body=json.dumps({'items': [{'Hosts': {'host_name': 'amb3'}}]}))
+    httpretty.register_uri(httpretty.POST, "http://localhost:8080/api/v1/clusters/mycluster/hosts", body='', status=201)
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           body=accepted_response, status=202)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/7",
+                           body=completed_response)
+    process_layout(mock_module, 'http://localhost:8080', 'admin', 'admin', 'mycluster', layout, 100, 'installed',
+                   60, 10, None, False, True)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    mock_module.exit_json.assert_called_with(
+        changed=True, added=[{'host': 'amb3', 'component': 'DATANODE'}],
+        installed=[{'host': 'amb2', 'component': 'DATANODE'}, {'host': 'amb3', 'component': 'DATANODE'}],
+        request_ids=[7], start_request_ids=[], results=mock.ANY)
+    put_request = [r for r in httpretty.HTTPretty.latest_requests if r.method == 'PUT'][-1]
+    assert_equals(put_request.path, '/api/v1/clusters/mycluster/host_components?HostRoles/host_name.in(amb2,amb3)'
+                                    '&HostRoles/component_name.in(DATANODE)&HostRoles/state=INIT')
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_component_extend.AnsibleModule')
+def test_layout_start_only_targets_installed_pairs(mock_module):
+    mock_module.check_mode = True
+    layout = [
+        {'hosts': ['amb1'], 'components': ['NAMENODE', 'DATANODE']},
+        {'hosts': ['amb2'], 'components': ['DATANODE']}
+    ]
+    # The DATANODE of amb1 is stopped on purpose and must stay so
+    index = json.dumps({'items': [
+        {'HostRoles': {'host_name': 'amb1', 'component_name': 'DATANODE', 'state': 'INSTALLED'}},
+        {'HostRoles': {'host_name': 'amb2', 'component_name': 'NODEMANAGER', 'state': 'STARTED'}}
+    ]})
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/host_components", body=index)
+    process_layout(mock_module, 'http://localhost:8080', 'admin', 'admin', 'mycluster', layout, 100, 'started',
+                   60, 10, None, False, True, plan=[])
+    assert_equals(mock_module.fail_json.call_count, 0)
+    plan = mock_module.exit_json.call_args[1]['plan']
+    starts = [entry['path'] for entry in plan if 'HostRoles/state=INSTALLED' in entry['path']]
+    assert_equals(starts, [
+        '/api/v1/clusters/mycluster/host_components?HostRoles/host_name.in(amb2)&HostRoles/component_name.in(DATANODE)'
+        '&HostRoles/state=INSTALLED',
+        '/api/v1/clusters/mycluster/host_components?HostRoles/host_name.in(amb1)&HostRoles/component_name.in(NAMENODE)'
+        '&HostRoles/state=INSTALLED'
+    ])
+
+
+def request_response(request_id, status):
+    return httpretty.Response(body=json.dumps({'Requests': {'id': request_id, 'status': status}}), status=202)
+
+
+def tasks_response(statuses):
+    return httpretty.Response(body=json.dumps({'items': [
+        {'Tasks': {'host_name': h, 'role': 'DATANODE', 'status': status}} for h, status in statuses]}))
+
+
+@httpretty.activate
+@mock.patch('module_utils.ambari_requests.time.sleep')
+@mock.patch('extra_modules.ambari_component_extend.AnsibleModule')
+def test_started_state_starts_each_host_after_its_install(mock_module, mock_sleep):
+    mock_module.check_mode = False
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           body=host_components([]))
+    httpretty.register_uri(httpretty.POST, "http://localhost:8080/api/v1/clusters/mycluster/hosts", body='', status=201)
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           responses=[request_response(7, 'Accepted'), request_response(8, 'Accepted'),
+                                      request_response(9, 'Accepted')])
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/7",
+                           responses=[
+                               httpretty.Response(body=json.dumps({'Requests': {'id': 7, 'request_status': 'IN_PROGRESS',
+                                                                                'progress_percent': 50, 'completed_task_count': 1}})),
+                               httpretty.Response(body=json.dumps({'Requests': {'id': 7, 'request_status': 'COMPLETED',
+                                                                                'progress_percent': 100, 'completed_task_count': 2}}))
+                           ])
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/7/tasks",
+                           responses=[tasks_response([('amb2', 'COMPLETED'), ('amb3', 'IN_PROGRESS')]),
+                                      tasks_response([])])
+    for request_id in [8, 9]:
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/{0}".format(request_id),
+                               body=json.dumps({'Requests': {'id': request_id, 'request_status': 'COMPLETED'}}))
+    process_components(mock_module, 'http://localhost:8080', 'admin', 'admin', 'mycluster', ['amb2', 'amb3'],
+                       ['DATANODE'], 'started', 60, 10, None, False, True)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    mock_module.exit_json.assert_called_with(changed=True, added=mock.ANY, installed=mock.ANY, request_id=7,
+                                             start_request_ids=[8, 9], results=mock.ANY)
+    starts = []
+    for r in httpretty.HTTPretty.latest_requests:
+        if r.method == 'PUT' and 'HostRoles/state=INSTALLED' in r.path and r.path not in starts:
+            starts.append(r.path)
+    assert_equals(starts, [
+        '/api/v1/clusters/mycluster/host_components?HostRoles/host_name.in(amb2)&HostRoles/component_name.in(DATANODE)'
+        '&HostRoles/state=INSTALLED',
+        '/api/v1/clusters/mycluster/host_components?HostRoles/host_name.in(amb3)&HostRoles/component_name.in(DATANODE)'
+        '&HostRoles/state=INSTALLED'
+    ])
+    # Only the first poll reads the whole task list, the next ones skip the completed tasks
+    task_queries = [r.path for r in httpretty.HTTPretty.latest_requests if '/requests/7/tasks' in r.path]
+    assert_equals(['Tasks/status!=COMPLETED' in path for path in task_queries], [False, True])
+
+
+@httpretty.activate
+def test_hosts_registered_in_bulk_with_per_host_outcomes():
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/hosts",
+                           body=json.dumps({'items': [{'Hosts': {'host_name': 'amb1'}}]}))
+    # The bulk create fails as a whole because amb3 has no agent registered
+    httpretty.register_uri(httpretty.POST, "http://localhost:8080/api/v1/clusters/mycluster/hosts",
+                           body='{"status": 400, "message": "unknown hosts amb3"}', status=400)
+    httpretty.register_uri(httpretty.POST, "http://localhost:8080/api/v1/clusters/mycluster/hosts/amb2", body='', status=201)
+    httpretty.register_uri(httpretty.POST, "http://localhost:8080/api/v1/clusters/mycluster/hosts/amb3",
+                           body='{"status": 400, "message": "unknown hosts amb3"}', status=400)
+    outcomes = make_sure_hosts_exist('http://localhost:8080', 'admin', 'admin', 'mycluster', ['amb1', 'amb2', 'amb3'])
+    assert_equals(outcomes['amb1'], 'exists')
+    assert_equals(outcomes['amb2'], 'registered')
+    assert outcomes['amb3'].startswith('failed: status code 400')
@@ -0,0 +1,86 @@
+import mock
+import os
+import shutil
+import tempfile
+from module_utils.ambari_config_cache import ConfigCache
+from nose.tools import assert_equals
+
+
+sample_config = {
+    'type': 'mock_config_type',
+    'tag': 'version1',
+    'properties': {
+        'content': 'test content',
+        'key1': 'mockvalue1'
+    }
+}
+
+
+def test_cache_roundtrip():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = ConfigCache(cache_dir)
+        assert_equals(cache.get('mycluster', 'mock_config_type', 'version1'), None)
+        cache.put('mycluster', 'mock_config_type', 'version1', sample_config)
+        assert_equals(cache.get('mycluster', 'mock_config_type', 'version1'), sample_config)
+        assert_equals(cache.get('mycluster', 'mock_config_type', 'version2'), None)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_cache_evicts_least_recently_used():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = ConfigCache(cache_dir)
+        cache.put('mycluster', 'type_a', 'version1', sample_config)
+        entry_size = os.path.getsize(cache.path('mycluster', 'type_a', 'version1'))
+        os.utime(cache.path('mycluster', 'type_a', 'version1'), (1, 1))
+        cache.put('mycluster', 'type_b', 'version1', sample_config)
+        os.utime(cache.path('mycluster', 'type_b', 'version1'), (2, 2))
+        # Reading type_a makes type_b the least recently used entry
+        cache.get('mycluster', 'type_a', 'version1')
+        # Room for two entries and a half, eviction frees down to 90% of it
+        cache.max_bytes = int(entry_size * 2.5)
+        cache.put('mycluster', 'type_c', 'version1', sample_config)
+        assert_equals(cache.get('mycluster', 'type_b', 'version1'), None)
+        assert_equals(cache.get('mycluster', 'type_a', 'version1'), sample_config)
+        assert_equals(cache.get('mycluster', 'type_c', 'version1'), sample_config)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_cache_walked_once_until_full():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = ConfigCache(cache_dir)
+        with mock.patch('module_utils.ambari_config_cache.os.walk', wraps=os.walk) as walk:
+            for i in range(20):
+                cache.put('mycluster', 'type_{0}'.format(i), 'version1', sample_config)
+        assert_equals(walk.call_count, 1)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_cache_write_failure_ignored():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = ConfigCache(cache_dir)
+        with mock.patch('module_utils.ambari_config_cache.write_json_atomic', side_effect=OSError(28, 'No space left on device')):
+            assert_equals(cache.put('mycluster', 'mock_config_type', 'version1', sample_config), False)
+        assert_equals(cache.get('mycluster', 'mock_config_type', 'version1'), None)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_read_only_cache_leaves_directory_untouched():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        ConfigCache(cache_dir).put('mycluster', 'type_a', 'version1', sample_config)
+        os.utime(ConfigCache(cache_dir).path('mycluster', 'type_a', 'version1'), (1, 1))
+        cache = ConfigCache(cache_dir, read_only=True)
+        assert_equals(cache.get('mycluster', 'type_a', 'version1'), sample_config)
+        assert_equals(os.path.getmtime(cache.path('mycluster', 'type_a', 'version1')), 1)
+        assert_equals(cache.put('mycluster', 'type_b', 'version1', sample_config), False)
+        assert_equals(os.path.exists(cache.path('mycluster', 'type_b', 'version1')), False)
+    finally:
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,71 @@
+import httpretty
+import json
+import mock
+import os
+import shutil
+import tempfile
+from module_utils import ambari_metrics
+from module_utils.ambari_client import get
+from nose.tools import assert_equals
+
+
+def test_path_template():
+    assert_equals(ambari_metrics.path_template('/api/v1/clusters/c1/hosts/h1.example.com?fields=Hosts/host_name'),
+                  '/api/v1/clusters/{cluster_name}/hosts/{host_name}')
+    assert_equals(ambari_metrics.path_template('/api/v1/clusters/c1/requests/42/tasks'),
+                  '/api/v1/clusters/{cluster_name}/requests/{id}/tasks')
+
+
+def test_percentiles():
+    values = list(range(1, 101))
+    assert_equals(ambari_metrics.percentile(values, 50), 50)
+    assert_equals(ambari_metrics.percentile(values, 99), 99)
+    assert_equals(ambari_metrics.percentile([], 50), None)
+
+
+@httpretty.activate
+def test_calls_summarized_and_traced():
+    trace_dir = tempfile.mkdtemp()
+    try:
+        trace_file = os.path.join(trace_dir, 'trace.jsonl')
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                               body='{"Requests": {"id": 5}}')
+        module = mock.MagicMock()
+        module._name = 'ambari_service_control'
+        exit_json = module.exit_json
+        ambari_metrics.instrument_module(module, True, trace_file)
+        get('http://localhost:8080', 'admin', 'admin', '/api/v1/clusters/mycluster/requests/5')
+        get('http://localhost:8080', 'admin', 'admin', '/api/v1/clusters/mycluster/requests/5?fields=Requests/id')
+        module.exit_json(changed=False)
+        metrics = exit_json.call_args[1]['ambari_metrics']
+        assert_equals(metrics['calls'], 2)
+        assert_equals(metrics['bytes_received'], 2 * len('{"Requests": {"id": 5}}'))
+        assert_equals(metrics['endpoints']['GET /api/v1/clusters/{cluster_name}/requests/{id}']['calls'], 2)
+        with open(trace_file) as f:
+            traces = [json.loads(line) for line in f]
+        assert_equals([t['status'] for t in traces], [200, 200])
+        assert_equals(traces[1]['path'], '/api/v1/clusters/mycluster/requests/5?fields=Requests/id')
+    finally:
+        ambari_metrics.configure()
+        shutil.rmtree(trace_dir)
+
+
+@httpretty.activate
+def test_unwritable_trace_file_warns_once_and_stops_tracing():
+    trace_dir = tempfile.mkdtemp()
+    try:
+        # A directory in place of the trace file cannot be opened for appending
+        trace_file = os.path.join(trace_dir, 'trace.jsonl')
+        os.mkdir(trace_file)
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                               body='{"Requests": {"id": 5}}')
+        module = mock.MagicMock()
+        module._name = 'ambari_request_wait'
+        ambari_metrics.instrument_module(module, False, trace_file)
+        get('http://localhost:8080', 'admin', 'admin', '/api/v1/clusters/mycluster/requests/5')
+        get('http://localhost:8080', 'admin', 'admin', '/api/v1/clusters/mycluster/requests/5')
+        assert_equals(module.warn.call_count, 1)
+        assert_equals(ambari_metrics.summary()['calls'], 2)
+    finally:
+        ambari_metrics.configure()
+        shutil.rmtree(trace_dir)
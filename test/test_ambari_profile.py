@@ -0,0 +1,32 @@
+import mock
+import os
+import shutil
+import tempfile
+from module_utils.ambari_profile import PROFILE_DIR_ENV, start_profiling
+from nose.tools import assert_equals
+
+
+def test_profile_saved_on_exit():
+    profile_dir = tempfile.mkdtemp()
+    try:
+        module = mock.MagicMock()
+        module._name = 'ambari_cluster_config'
+        exit_json = module.exit_json
+        start_profiling(module, os.path.join(profile_dir, 'profiles'), 5)
+        sorted(range(1000), key=lambda x: -x)
+        module.exit_json(changed=False)
+        profile = exit_json.call_args[1]['profile']
+        assert os.path.basename(profile['path']).startswith('ambari_cluster_config-')
+        assert os.path.getsize(profile['path']) > 0
+        with open(profile['summary_path']) as f:
+            assert 'cumulative' in f.read()
+    finally:
+        shutil.rmtree(profile_dir)
+
+
+def test_profiling_is_opt_in():
+    module = mock.MagicMock()
+    exit_json = module.exit_json
+    with mock.patch.dict(os.environ, {PROFILE_DIR_ENV: ''}):
+        start_profiling(module, None)
+    assert_equals(module.exit_json, exit_json)
@@ -0,0 +1,195 @@
+import httpretty
+import json
+import mock
+import threading
+import time
+from module_utils.ambari_client import AmbariError
+from module_utils.ambari_requests import AmbariRequestError, next_poll_interval, wait_for_request, \
+    wait_for_all, wait_for_request_schedule, wait_for_requests
+from nose.tools import assert_equals, assert_raises
+
+
+def request_status(status, percent):
+    return json.dumps({
+        'Requests': {
+            'id': 5,
+            'request_status': status,
+            'progress_percent': percent
+        }
+    })
+
+
+def test_poll_interval_backs_off_up_to_max():
+    assert_equals(next_poll_interval(1, 1, None, 10), 1.5)
+    assert_equals(next_poll_interval(8, 60, None, 10), 10)
+
+
+def test_poll_interval_follows_progress():
+    # 90% done after 9 seconds, about one second left
+    assert_equals(next_poll_interval(8, 9, 90, 10), 1)
+
+
+@httpretty.activate
+@mock.patch('module_utils.ambari_requests.time.sleep')
+def test_wait_for_request_until_completed(mock_sleep):
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           responses=[
+                               httpretty.Response(body=request_status('IN_PROGRESS', 10)),
+                               httpretty.Response(body=request_status('IN_PROGRESS', 50)),
+                               httpretty.Response(body=request_status('COMPLETED', 100))
+                           ])
+    progress = wait_for_request('mycluster', 'http://localhost:8080', 'admin', 'admin', {'id': 5}, 600, 10)
+    assert_equals(progress['Requests']['request_status'], 'COMPLETED')
+    assert_equals(mock_sleep.call_count, 2)
+    assert 'Requests/request_status' in httpretty.last_request().querystring['fields'][0]
+
+
+@httpretty.activate
+@mock.patch('module_utils.ambari_requests.time.sleep')
+def test_wait_for_request_deadline(mock_sleep):
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           body=request_status('IN_PROGRESS', 10))
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5/tasks",
+                           body=json.dumps({'items': []}))
+    assert_raises(AmbariError, wait_for_request, 'mycluster', 'http://localhost:8080', 'admin', 'admin', {'id': 5}, 0, 10)
+
+
+@httpretty.activate
+def test_failed_request_reports_failed_tasks():
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           body=request_status('FAILED', 40))
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5/tasks",
+                           body=json.dumps({'items': [{'Tasks': {'id': 7, 'host_name': 'amb1', 'role': 'DATANODE', 'status': 'FAILED'}}]}))
+    try:
+        wait_for_request('mycluster', 'http://localhost:8080', 'admin', 'admin', {'id': 5}, 600, 10)
+        raise Exception('wait_for_request should have failed')
+    except AmbariRequestError as e:
+        assert 'DATANODE' in e.message
+        assert_equals(e.failed_tasks[0]['host_name'], 'amb1')
+        assert_equals(e.aborted, False)
+
+
+@httpretty.activate
+def test_failed_task_threshold_aborts_request():
+    status = json.loads(request_status('IN_PROGRESS', 40))
+    status['Requests']['failed_task_count'] = 2
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           body=json.dumps(status))
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           body='')
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5/tasks",
+                           body=json.dumps({'items': []}))
+    try:
+        wait_for_request('mycluster', 'http://localhost:8080', 'admin', 'admin', {'id': 5}, 600, 10, 1, True)
+        raise Exception('wait_for_request should have failed')
+    except AmbariRequestError as e:
+        assert_equals(e.aborted, True)
+    abort = [r for r in httpretty.HTTPretty.latest_requests if r.method == 'PUT'][-1]
+    assert_equals(json.loads(abort.body)['Requests']['request_status'], 'ABORTED')
+
+
+@httpretty.activate
+@mock.patch('module_utils.ambari_requests.time.sleep')
+def test_aborted_request_fails_at_once(mock_sleep):
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           body=request_status('ABORTED', 40))
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5/tasks",
+                           body=json.dumps({'items': []}))
+    try:
+        wait_for_request('mycluster', 'http://localhost:8080', 'admin', 'admin', {'id': 5}, 600, 10, None, True)
+        raise Exception('wait_for_request should have failed')
+    except AmbariRequestError as e:
+        assert 'ABORTED' in e.message
+        # Failed on the first poll, nothing left to abort
+        assert_equals(e.aborted, False)
+    assert_equals(mock_sleep.call_count, 0)
+    assert_equals(httpretty.last_request().method, 'GET')
+
+
+@httpretty.activate
+@mock.patch('module_utils.ambari_requests.time.sleep')
+def test_paused_request_schedule_reports_failed_batch(mock_sleep):
+    def schedule(status, second_batch_status):
+        return httpretty.Response(body=json.dumps({'RequestSchedule': {'id': 3, 'status': status, 'batch': {'batch_requests': [
+            {'order_id': 1, 'request_id': 10, 'request_status': 'COMPLETED'},
+            {'order_id': 2, 'request_id': 11, 'request_status': second_batch_status}
+        ]}}}))
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/request_schedules/3",
+                           responses=[schedule('SCHEDULED', 'IN_PROGRESS'), schedule('PAUSED', 'FAILED')])
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/11/tasks",
+                           body=json.dumps({'items': [{'Tasks': {'id': 9, 'host_name': 'amb2', 'role': 'DATANODE', 'status': 'FAILED'}}]}))
+    try:
+        wait_for_request_schedule('mycluster', 'http://localhost:8080', 'admin', 'admin', 3, 2, 600, 10)
+        raise Exception('wait_for_request_schedule should have failed')
+    except AmbariRequestError as e:
+        assert 'PAUSED' in e.message
+        assert_equals(e.request_id, 11)
+        assert_equals(e.failed_tasks[0]['host_name'], 'amb2')
+    assert_equals(mock_sleep.call_count, 1)
+
+
+@httpretty.activate
+@mock.patch('module_utils.ambari_requests.time.sleep')
+def test_wait_for_several_requests(mock_sleep):
+    for request_id in [5, 6]:
+        httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/{0}".format(request_id),
+                               responses=[
+                                   httpretty.Response(body=request_status('IN_PROGRESS', 50)),
+                                   httpretty.Response(body=request_status('COMPLETED', 100))
+                               ])
+    results = wait_for_requests('mycluster', 'http://localhost:8080', 'admin', 'admin', [5, 6], 600, 10)
+    assert_equals(sorted(results.keys()), [5, 6])
+    assert_equals(results[6]['Requests']['request_status'], 'COMPLETED')
+
+
+@httpretty.activate
+@mock.patch('module_utils.ambari_requests.time.sleep')
+def test_wait_for_several_requests_stops_on_failure(mock_sleep):
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           body=request_status('IN_PROGRESS', 10))
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/6",
+                           body=request_status('FAILED', 40))
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/6/tasks",
+                           body=json.dumps({'items': []}))
+    assert_raises(AmbariRequestError, wait_for_requests, 'mycluster', 'http://localhost:8080', 'admin', 'admin',
+                  [5, 6], 600, 10)
+
+
+@httpretty.activate
+def test_stop_interrupts_the_sleep_between_polls():
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           body=request_status('IN_PROGRESS', 10))
+    stop = threading.Event()
+    results = []
+    poller = threading.Thread(target=lambda: results.append(wait_for_request(
+        'mycluster', 'http://localhost:8080', 'admin', 'admin', {'id': 5}, 600, 30, stop=stop)))
+    started = time.time()
+    poller.start()
+    # The first sleep between polls lasts about a second
+    time.sleep(0.3)
+    stop.set()
+    poller.join()
+    assert time.time() - started < 0.8
+    assert_equals(results[0]['Requests']['request_status'], 'IN_PROGRESS')
+
+
+@httpretty.activate
+@mock.patch('module_utils.ambari_requests.time.sleep')
+def test_wait_for_requests_and_schedules(mock_sleep):
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           responses=[
+                               httpretty.Response(body=request_status('IN_PROGRESS', 50)),
+                               httpretty.Response(body=request_status('COMPLETED', 100))
+                           ])
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/request_schedules/3",
+                           responses=[httpretty.Response(body=json.dumps({'RequestSchedule': {
+                               'id': 3, 'status': status, 'batch': {'batch_requests': [
+                                   {'order_id': 1, 'request_id': 10, 'request_status': batch_status}]}}}))
+                               for status, batch_status in [('SCHEDULED', 'IN_PROGRESS'), ('COMPLETED', 'COMPLETED')]])
+    results, schedule_results = wait_for_all('mycluster', 'http://localhost:8080', 'admin', 'admin', [5], [3], 600, 10)
+    assert_equals(results[5]['Requests']['request_status'], 'COMPLETED')
+    assert_equals(schedule_results[3]['RequestSchedule']['status'], 'COMPLETED')
+    # The schedule id is only ever polled as a schedule
+    paths = set(r.path.split('?')[0] for r in httpretty.HTTPretty.latest_requests)
+    assert '/api/v1/clusters/mycluster/request_schedules/3' in paths
+    assert '/api/v1/clusters/mycluster/requests/3' not in paths
@@ -0,0 +1,112 @@
+import httpretty
+from extra_modules.ambari_service_control import process_rolling_restart, process_services, process_stale_restart
+import mock
+from nose.tools import assert_equals
+import json
+
+services_fact = [
+    {'ServiceInfo': {'service_name': 'HDFS', 'state': 'STARTED'}},
+    {'ServiceInfo': {'service_name': 'YARN', 'state': 'INSTALLED'}},
+    {'ServiceInfo': {'service_name': 'HIVE', 'state': 'INSTALLED'}}
+]
+
+accepted_response = '{"href": "http://localhost:8080/api/v1/clusters/mycluster/requests/5", "Requests": {"id": 5, "status": "Accepted"}}'
+completed_response = '{"Requests": {"id": 5, "request_status": "COMPLETED", "progress_percent": 100}}'
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_service_control.AnsibleModule')
+def test_services_changed_in_single_request(mock_module):
+    mock_module.check_mode = False
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster/services",
+                           body=accepted_response, status=202)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           body=completed_response)
+    process_services(services_fact, 'http://localhost:8080', 'admin', 'admin', mock_module, 'mycluster',
+                     ['hdfs', 'yarn', 'hive'], 'started', 60, 10, None, False)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    mock_module.exit_json.assert_called_with(changed=True, services=['YARN', 'HIVE'], request_id=5, results=mock.ANY,
+                                             request_status=mock.ANY)
+    put_request = [r for r in httpretty.HTTPretty.latest_requests if r.method == 'PUT'][-1]
+    assert_equals(put_request.path, '/api/v1/clusters/mycluster/services?ServiceInfo/service_name.in(YARN,HIVE)')
+    assert_equals(json.loads(put_request.body)['Body']['ServiceInfo']['state'], 'STARTED')
+
+
+@mock.patch('extra_modules.ambari_service_control.AnsibleModule')
+def test_services_already_in_state(mock_module):
+    mock_module.check_mode = False
+    process_services(services_fact, 'http://localhost:8080', 'admin', 'admin', mock_module, 'mycluster',
+                     ['HDFS'], 'started', 60, 10, None, False)
+    mock_module.exit_json.assert_called_with(changed=False, msg='No changes in service state')
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_service_control.AnsibleModule')
+def test_restart_stale_components_only(mock_module):
+    mock_module.check_mode = False
+    stale_response = {'items': [
+        {'HostRoles': {'service_name': 'HDFS', 'component_name': 'DATANODE', 'host_name': 'host2'}},
+        {'HostRoles': {'service_name': 'HDFS', 'component_name': 'DATANODE', 'host_name': 'host1'}},
+        {'HostRoles': {'service_name': 'YARN', 'component_name': 'NODEMANAGER', 'host_name': 'host1'}}
+    ]}
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           body=json.dumps(stale_response))
+    httpretty.register_uri(httpretty.POST, "http://localhost:8080/api/v1/clusters/mycluster/requests",
+                           body=accepted_response, status=202)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/requests/5",
+                           body=completed_response)
+    process_stale_restart('http://localhost:8080', 'admin', 'admin', mock_module, 'mycluster',
+                          ['all'], 60, 10, None, False)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    mock_module.exit_json.assert_called_with(
+        changed=True, stale_components={'HDFS': {'DATANODE': ['host2', 'host1']}, 'YARN': {'NODEMANAGER': ['host1']}},
+        request_id=5, results=mock.ANY, request_status=mock.ANY)
+    post_request = [r for r in httpretty.HTTPretty.latest_requests if r.method == 'POST'][-1]
+    payload = json.loads(post_request.body)
+    assert_equals(payload['RequestInfo']['command'], 'RESTART')
+    assert_equals(payload['Requests/resource_filters'], [
+        {'service_name': 'HDFS', 'component_name': 'DATANODE', 'hosts': 'host1,host2'},
+        {'service_name': 'YARN', 'component_name': 'NODEMANAGER', 'hosts': 'host1'}
+    ])
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_service_control.AnsibleModule')
+def test_rolling_restart_in_batches(mock_module):
+    mock_module.check_mode = False
+    hosts_response = {'items': [
+        {'HostRoles': {'service_name': 'HDFS', 'component_name': 'DATANODE', 'host_name': 'host{0}'.format(i)}}
+        for i in range(1, 6)
+    ]}
+    completed_schedule = {'RequestSchedule': {'id': 3, 'status': 'COMPLETED', 'batch': {'batch_requests': [
+        {'order_id': i, 'request_id': 10 + i, 'request_status': 'COMPLETED'} for i in range(1, 4)
+    ]}}}
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/host_components",
+                           body=json.dumps(hosts_response))
+    httpretty.register_uri(httpretty.POST, "http://localhost:8080/api/v1/clusters/mycluster/request_schedules",
+                           body=json.dumps({'resources': [{'RequestSchedule': {'id': 3}}]}), status=201)
+    httpretty.register_uri(httpretty.GET, "http://localhost:8080/api/v1/clusters/mycluster/request_schedules/3",
+                           body=json.dumps(completed_schedule))
+    process_rolling_restart('http://localhost:8080', 'admin', 'admin', mock_module, 'mycluster', ['HDFS'],
+                            ['datanode'], 2, 120, 1, 600, 10, False)
+    assert_equals(mock_module.fail_json.call_count, 0)
+    mock_module.exit_json.assert_called_with(changed=True, host_components=mock.ANY, batches=3, request_schedule_id=3,
+                                             batch_requests=mock.ANY)
+    post_request = [r for r in httpretty.HTTPretty.latest_requests if r.method == 'POST'][-1]
+    batch = json.loads(post_request.body)[0]['RequestSchedule']['batch']
+    assert_equals([r['RequestBodyInfo']['Requests/resource_filters'][0]['hosts'] for r in batch[0]['requests']],
+                  ['host1,host2', 'host3,host4', 'host5'])
+    assert_equals(batch[1]['batch_settings'], {'batch_separation_in_seconds': 120, 'task_failure_tolerance': 1})
+
+
+@httpretty.activate
+@mock.patch('extra_modules.ambari_service_control.AnsibleModule')
+def test_services_changed_without_waiting(mock_module):
+    mock_module.check_mode = False
+    httpretty.register_uri(httpretty.PUT, "http://localhost:8080/api/v1/clusters/mycluster/services/YARN",
+                           body=accepted_response, status=202)
+    process_services(services_fact, 'http://localhost:8080', 'admin', 'admin', mock_module, 'mycluster',
+                     ['YARN'], 'started', 60, 10, None, False, False)
+    mock_module.exit_json.assert_called_with(changed=True, services=['YARN'], request_id=5, results=mock.ANY,
+                                             request_status=mock.ANY)
+    assert_equals(httpretty.last_request().method, 'PUT')
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from module_utils import ambari_throttle
+from nose.tools import assert_equals, assert_true
+
+
+def test_token_bucket_spreads_calls_beyond_the_burst():
+    lock_dir = tempfile.mkdtemp()
+    try:
+        bucket = os.path.join(lock_dir, 'ambari.bucket')
+        waits = [ambari_throttle.take_token(bucket, 10) for _ in range(15)]
+        # One second worth of calls goes through at once, the next ones are a tenth of a second apart
+        assert_equals(waits[:10], [0] * 10)
+        assert_true(0.05 < waits[10] <= 0.1)
+        assert_true(0.45 < waits[14] <= 0.5)
+    finally:
+        shutil.rmtree(lock_dir)
+
+
+def test_in_flight_calls_capped():
+    lock_dir = tempfile.mkdtemp()
+    ambari_throttle.configure_throttle(max_in_flight=2, lock_dir=lock_dir)
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+
+    def call():
+        with ambari_throttle.throttled('http://localhost:8080'):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+
+    try:
+        threads = [threading.Thread(target=call) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert_equals(peak[0], 2)
+    finally:
+        ambari_throttle.configure_throttle()
+        shutil.rmtree(lock_dir)
@@ -0,0 +1,54 @@
+from nose.tools import assert_equals
+from test.bench_modules import ModuleExit, SCENARIOS, hosts
+from test.fake_ambari import FakeAmbari
+
+
+def run_scenario(scenario, size):
+    fake = FakeAmbari()
+    setup, run = SCENARIOS[scenario]
+    setup(fake, size)
+    url = fake.start()
+    try:
+        run(url, size)
+        raise Exception('the module did not exit')
+    except ModuleExit as e:
+        return fake, e
+    finally:
+        fake.stop()
+
+
+def test_bulk_install_calls_do_not_grow_with_hosts():
+    small, result = run_scenario('component_bulk', 5)
+    assert_equals(result.failed, False)
+    large, result = run_scenario('component_bulk', 50)
+    assert_equals(result.failed, False)
+    assert_equals(small.calls, large.calls)
+    assert_equals(set(c['HostRoles']['state'] for c in large.host_components.values()), set(['STARTED']))
+    assert_equals(len(large.host_components), 100)
+
+
+def test_stale_restart_only_restarts_stale_components():
+    fake, result = run_scenario('stale_restart', 20)
+    assert_equals(result.failed, False)
+    assert_equals(result.result['stale_components'], {'HDFS': {'DATANODE': hosts(20)}})
+    assert_equals(any(c['HostRoles']['stale_configs'] for c in fake.host_components.values()), False)
+    assert_equals(fake.calls, 3)
+
+
+def test_partial_responses_keep_the_key_fields():
+    fake = FakeAmbari()
+    fake.add_host_component('amb1', 'DATANODE')
+    _, services = fake.handle('GET', '/api/v1/clusters/mycluster/services?fields=ServiceInfo/state', '')
+    assert_equals(services['items'], [{'ServiceInfo': {'cluster_name': 'mycluster', 'service_name': 'HDFS',
+                                                       'state': 'STARTED'}}])
+    _, host_components = fake.handle('GET', '/api/v1/clusters/mycluster/host_components?fields=HostRoles/state', '')
+    assert_equals(host_components['items'], [{'HostRoles': {'cluster_name': 'mycluster', 'component_name': 'DATANODE',
+                                                            'host_name': 'amb1', 'state': 'STARTED'}}])
+
+
+def test_service_start_sends_one_request():
+    fake, result = run_scenario('service_start', 20)
+    assert_equals(result.failed, False)
+    assert_equals(result.result['services'], ['HDFS', 'YARN'])
+    assert_equals(set(fake.services.values()), set(['STARTED']))
+    assert_equals(fake.calls, 3)